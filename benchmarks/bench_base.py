@@ -0,0 +1,72 @@
+"""
+Assemble a generated program with its code far from its data, with the
+formats relaxed and with a BASE placed automatically, and compare the
+size and the time.
+
+    $ make bench
+"""
+import random
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sic_assembler.assembler import Assembler
+
+
+def build_source(routines=1000):
+    """
+    Routines which use a 3 KB table of variables placed after 64 KB of
+    buffers, so most of their operands are out of PC relative range.
+    """
+    random.seed(0)
+    variables = ['V%i' % x for x in range(1000)]
+    body = ['        LDA     %s',
+            '        ADD     %s',
+            '        STA     %s',
+            '        LDT     #%s',
+            '        COMP    %s',
+            '        STX     %s']
+    source = ['BENCH   START   0', '        J       MAIN']
+    for x in range(routines):
+        source.append('R%i      CLEAR   X' % x)
+        for _ in range(8):
+            source.append(random.choice(body) % random.choice(variables))
+        source.append('        RSUB')
+    source.append('MAIN    JSUB    R0')
+    source.append('        J       MAIN')
+    source.append('BUFS    RESB    65536')
+    for name in variables:
+        source.append('%-8sWORD    0' % name)
+    source.append('        END     MAIN')
+    return '\n'.join(source) + '\n'
+
+
+def bench(source, repeat=3, **options):
+    """ Return the best time and the assembler of the last run. """
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        a = Assembler(StringIO(source), **options)
+        a.assemble()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, a
+
+
+if __name__ == '__main__':
+    source = build_source()
+    relaxed_time, relaxed = bench(source, relax=True)
+    based_time, based = bench(source, auto_base=True)
+    report = based.base_report
+    print("relaxed:   %i bytes, %i format 4, %.3fs" %
+          (relaxed.program_length, relaxed.relaxation_report['extended'],
+           relaxed_time))
+    print("auto BASE: %i bytes, %i format 4, %.3fs" %
+          (based.program_length, based.relaxation_report['extended'],
+           based_time))
+    print("BASE %s: %i format 4 instructions avoided, %i bytes saved" %
+          (report['base'], report['extended_avoided'],
+           report['bytes_saved']))
@@ -0,0 +1,92 @@
+"""
+Count the opcodes and addressing modes of a corpus of assembled programs,
+by walking the generated objects and from a column file.
+
+    $ make bench
+"""
+import os
+import shutil
+import tempfile
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sic_assembler.assembler import Assembler
+from sic_assembler.columns import ColumnFile, append_programs, numpy
+from sic_assembler.instructions import Format
+from bench_dispatch import build_source
+
+
+def walk(assemblers):
+    """ Count the opcodes and the base relative instructions in Python. """
+    opcodes = dict()
+    base = 0
+    for a in assemblers:
+        for location, output in a.generated_objects:
+            if isinstance(output, Format):
+                encoded = output.encode()
+                opcode = int(encoded.hex[:2], 16)
+                if len(output) >= 3:
+                    opcode &= 0xFC
+                    if encoded.mode == 'base':
+                        base += 1
+                opcodes[opcode] = opcodes.get(opcode, 0) + 1
+    return opcodes, base
+
+
+def query(path):
+    """ Count the same from the column file. """
+    with ColumnFile(path) as f:
+        rows, _ = f.columns()
+    if numpy is not None:
+        instructions = rows[rows['format'] > 0]
+        counts = numpy.bincount(instructions['opcode'], minlength=256)
+        base = int(numpy.count_nonzero(instructions['flags'] & 0b000100))
+        return dict((x, int(counts[x])) for x in numpy.nonzero(counts)[0]), \
+            base
+    opcodes = dict()
+    base = 0
+    for opcode, instruction_format, flags in zip(rows['opcode'],
+                                                 rows['format'],
+                                                 rows['flags']):
+        if instruction_format > 0:
+            opcodes[opcode] = opcodes.get(opcode, 0) + 1
+            if flags & 0b000100:
+                base += 1
+    return opcodes, base
+
+
+if __name__ == '__main__':
+    source = build_source(2000)
+    if not isinstance(source, type(u'')):
+        source = source.decode()
+    assemblers = []
+    for _ in range(200):
+        a = Assembler(StringIO(source))
+        a.assemble()
+        assemblers.append(a)
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'corpus.col')
+        start = timer()
+        append_programs(path, assemblers)
+        written = timer() - start
+
+        start = timer()
+        expected = walk(assemblers)
+        walked = timer() - start
+        start = timer()
+        result = query(path)
+        queried = timer() - start
+        assert result == expected
+
+        print("column file: %i programs, %i bytes, written in %.3fs" %
+              (len(assemblers), os.path.getsize(path), written))
+        print("walk generated_objects: %.3fs" % walked)
+        print("query column file (%s): %.3fs" %
+              ('NumPy' if numpy is not None else 'array', queried))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,36 @@
+"""
+Time the cost estimate of generated programs of growing size, which should
+grow linearly.
+
+    $ make bench
+"""
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sic_assembler.assembler import Assembler
+from bench_dispatch import build_source
+
+
+def bench(source, repeat=3):
+    """ Return the best time of the estimate and its report. """
+    a = Assembler(StringIO(source))
+    a.assemble()
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        report = a.estimate_cost()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, report
+
+
+if __name__ == '__main__':
+    for lines in (25000, 50000, 100000, 200000):
+        elapsed, report = bench(build_source(lines))
+        print("cost estimate of %i lines, %i blocks: %.3fs (%.2f us/line)" %
+              (lines, len(report['blocks']), elapsed,
+               elapsed / lines * 1e6))
@@ -0,0 +1,47 @@
+"""
+Assemble a table of 100k words, written as one WORD directive and as a
+WORD directive on each line, and a long BYTE string.
+
+    $ make bench
+"""
+import random
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sic_assembler.assembler import Assembler
+
+
+def build_source(words=100000, per_line=None):
+    random.seed(0)
+    values = [str(random.randint(-(1 << 23), (1 << 24) - 1))
+              for _ in range(words)]
+    per_line = per_line or words
+    source = ['TABLE   START   0', 'FIRST   LDA     #0']
+    for x in range(0, words, per_line):
+        source.append('        WORD    ' + ','.join(values[x:x + per_line]))
+    source.append("TEXT    BYTE    C'" + 'THE QUICK BROWN FOX ' * 500 + "'")
+    source.append('        END     FIRST')
+    return u'\n'.join(source) + u'\n'
+
+
+def bench(source, repeat=5):
+    """ Return the best time to assemble a source program. """
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        Assembler(StringIO(source)).assemble()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    for per_line, name in ((None, 'one WORD directive'),
+                           (1000, '1000 words per line'),
+                           (1, 'one word per line')):
+        print("100k words, %s: %.1f ms" %
+              (name, bench(build_source(per_line=per_line)) * 1000))
@@ -0,0 +1,66 @@
+"""
+Assemble a generated program of 100k lines and time each pass, to measure
+the cost of looking up the mnemonic of every line.
+
+    $ make bench
+"""
+import random
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sic_assembler.assembler import Assembler
+
+
+def build_source(lines=100000):
+    random.seed(0)
+    body = ['        CLEAR   X',
+            '        LDA     #3',
+            '        +LDT    #4096',
+            '        COMPR   A,S',
+            '        FIX',
+            '        +STCH   BUF',
+            '        +JLT    LOOP',
+            '        COMP    #0',
+            '        WORD    7',
+            "        BYTE    X'F1'",
+            '        RESB    2']
+    source = ['BENCH   START   0', 'LOOP    CLEAR   A']
+    for x in range(lines):
+        source.append(random.choice(body))
+    source.extend(['DATA    WORD    5',
+                   'BUF     RESB    16',
+                   '        END     LOOP'])
+    return '\n'.join(source) + '\n'
+
+
+def bench(source, repeat=5):
+    """ Return the best time of each phase. """
+    best = None
+    for _ in range(repeat):
+        a = Assembler(StringIO(source))
+        start = timer()
+        a.first_pass()
+        first = timer() - start
+        start = timer()
+        a.second_pass()
+        second = timer() - start
+        start = timer()
+        a.generate_records()
+        records = timer() - start
+        times = (first, second, records)
+        if best is None:
+            best = times
+        best = tuple(min(x, y) for x, y in zip(best, times))
+    return best
+
+
+if __name__ == '__main__':
+    source = build_source()
+    if not isinstance(source, type(u'')):
+        source = source.decode()
+    first, second, records = bench(source)
+    print("pass 1: %.3fs  pass 2: %.3fs  records: %.3fs  total: %.3fs" %
+          (first, second, records, first + second + records))
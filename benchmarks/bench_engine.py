@@ -0,0 +1,54 @@
+"""
+Assemble the same batch of generated programs on a pool of threads and on
+a pool of processes, and compare the programs assembled per second.
+
+    $ make bench
+"""
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer as timer
+
+from sic_assembler.engine import Engine
+from bench_dispatch import build_source
+
+
+engine = Engine(relocatable=True)
+
+
+def assemble(source):
+    return len(engine.assemble(source))
+
+
+class Serial(object):
+    """ Assemble the programs one after the other in this thread. """
+    def map(self, function, values):
+        return [function(x) for x in values]
+
+
+def throughput(pool, sources, repeat=3):
+    """ Return the best count of programs assembled per second. """
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        pool.map(assemble, sources)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(sources) / best
+
+
+if __name__ == '__main__':
+    sources = [build_source(2000) for _ in range(64)]
+    workers = max(2, multiprocessing.cpu_count())
+
+    print("1 thread: %.1f programs/s" % throughput(Serial(), sources))
+
+    threads = ThreadPool(workers)
+    print("%i threads: %.1f programs/s" %
+          (workers, throughput(threads, sources)))
+    threads.close()
+
+    processes = multiprocessing.Pool(workers)
+    print("%i processes: %.1f programs/s" %
+          (workers, throughput(processes, sources)))
+    processes.close()
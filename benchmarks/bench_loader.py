@@ -0,0 +1,57 @@
+"""
+Load a 1 MB object program with 100k modification records, relocating it
+with NumPy (when installed) and with the pure Python loop.
+
+    $ make bench
+"""
+import random
+import time
+
+from sic_assembler import loader
+from sic_assembler.records import gen_modification, text_record
+
+
+def build_records(size=1 << 20, relocations=100000):
+    random.seed(0)
+    image = bytearray(random.getrandbits(8) for _ in range(size))
+
+    records = ['HBENCH %06X%06X' % (0, size)]
+    for address in range(0, size, 30):
+        code = '%02X' * len(image[address:address+30]) % \
+                tuple(image[address:address+30])
+        records.append(text_record(address, [code]))
+    for address in random.sample(range(0, size - 3, 3), relocations):
+        records.append(gen_modification(address, random.choice((5, 6))))
+    records.append('E000000')
+    return records
+
+
+def bench(records, numpy_module):
+    loader.numpy = numpy_module
+    memory = bytearray(2 << 20)
+
+    start = time.time()
+    loader.load(records, load_address=0x80000, memory=memory)
+    total = time.time() - start
+
+    start = time.time()
+    addresses, lengths = loader.parse_modifications(records)
+    parse = time.time() - start
+    start = time.time()
+    loader.relocate(memory, addresses, lengths, 0x80000)
+    relocate = time.time() - start
+
+    return total, parse, relocate
+
+
+if __name__ == '__main__':
+    records = build_records()
+    numpy_module = loader.numpy
+
+    results = [('python', bench(records, None))]
+    if numpy_module is not None:
+        results.append(('numpy', bench(records, numpy_module)))
+
+    for name, (total, parse, relocate) in results:
+        print("%-8s load: %.3fs  parse M records: %.3fs  relocate: %.3fs" %
+              (name, total, parse, relocate))
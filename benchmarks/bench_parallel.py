@@ -0,0 +1,38 @@
+"""
+Time pass 1 of a generated program of 400k lines read in this process and
+in pools of worker processes.
+
+    $ make bench
+"""
+import multiprocessing
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from sic_assembler.assembler import Assembler
+from bench_dispatch import build_source
+
+
+def bench(source, processes, repeat=3):
+    """ Return the best time of pass 1. """
+    best = None
+    for _ in range(repeat):
+        a = Assembler(StringIO(source), processes=processes)
+        start = timer()
+        a.first_pass()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+    source = build_source(400000)
+    if not isinstance(source, type(u'')):
+        source = source.decode()
+    cpus = multiprocessing.cpu_count()
+    for processes in sorted(set([1, 2, 4, cpus])):
+        print("pass 1 with %i process(es): %.3fs" %
+              (processes, bench(source, processes)))
@@ -0,0 +1,40 @@
+"""
+Time assembling a stream of programs from a slow producer, read in turn and
+read ahead on a thread, which should hide most of the time spent waiting.
+
+    $ make bench
+"""
+import time
+from timeit import default_timer as timer
+
+from sic_assembler.multiprogram import assemble_programs
+from bench_dispatch import build_source
+
+
+def producer(programs, lines, delay):
+    """
+    Yield the lines of the programs, waiting delay before each one like a
+    generator which works out a whole program before writing it.
+    """
+    source = build_source(lines).splitlines()
+    for _ in range(programs):
+        time.sleep(delay)
+        for line in source:
+            yield line
+
+
+def bench(background, programs=20, lines=2000, delay=0.025):
+    """ Return the time to assemble the stream and the records written. """
+    start = timer()
+    records = 0
+    for result in assemble_programs(producer(programs, lines, delay),
+                                    background):
+        records += len(result.records)
+    return timer() - start, records
+
+
+if __name__ == '__main__':
+    for background in (False, True):
+        elapsed, records = bench(background)
+        print("%s: 20 programs, %i records: %.3fs" %
+              ('read ahead' if background else 'in turn', records, elapsed))
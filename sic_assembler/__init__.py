@@ -1,13 +1,122 @@
 import argparse
+import os
 import sys
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from sic_assembler.assembler import Assembler
-from sic_assembler.errors import OpcodeLookupError
+from sic_assembler.cost import write_report as write_cost_report
+from sic_assembler.errors import OpcodeLookupError, ResourceLimitError
+from sic_assembler.limits import Limits, address_space
+from sic_assembler.memprofile import write_report
+from sic_assembler.multiprogram import assemble_programs
+from sic_assembler.pipeline import StreamAssembler
+from sic_assembler.sections import assemble_sections, split_sections
 
 
 def main():
+    try:
+        run()
+    except ResourceLimitError as e:
+        # a job over its limits stops with an error status
+        sys.stderr.write("[Resource Limit]: %s\n" % e.message)
+        sys.exit(1)
+
+
+def argument_parser():
+    """ Return the parser of the options shared by files and stdin. """
     parser = argparse.ArgumentParser(description='A 2 pass SIC/XE assembler.',
             formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--relax', action='store_true', default=False,
+                        help='choose format 3 or 4 automatically')
+    parser.add_argument('--auto-base', action='store_true', default=False,
+                        help='load the B register at the first instruction ' +
+                             'when a BASE saves format 4 instructions, ' +
+                             'implies --relax')
+    parser.add_argument('--optimize', action='store_true', default=False,
+                        help='run the peephole optimizer')
+    parser.add_argument('--relocatable', action='store_true', default=False,
+                        help='generate modification records')
+    parser.add_argument('-g', '--debug-info', default=None, required=False,
+                        help='write a debug information file')
+    parser.add_argument('--memprofile', action='store_true', default=False,
+                        help='write a JSON report of the memory used by ' +
+                             'each phase to stderr (Python 3.4+ only)')
+    parser.add_argument('--memprofile-file', default=None, metavar='FILE',
+                        help='write the memory report to FILE instead, ' +
+                             'implies --memprofile')
+    parser.add_argument('--cost', action='store_true', default=False,
+                        help='write a JSON estimate of the cost of each ' +
+                             'basic block, subroutine and loop to stderr')
+    parser.add_argument('--cost-file', default=None, metavar='FILE',
+                        help='write the cost estimate to FILE instead, ' +
+                             'implies --cost')
+    parser.add_argument('--stream', action='store_true', default=False,
+                        help='emit each text record as soon as it is ' +
+                             'resolved, with the H record at the end')
+    parser.add_argument('--header-file', default=None, required=False,
+                        help='with --stream, write the H record to this ' +
+                             'file instead')
+    parser.add_argument('--programs', action='store_true', default=False,
+                        help='assemble every program in the input, each ' +
+                             'ending with its END, one after the other')
+    parser.add_argument('--split-output', default=None, metavar='PATTERN',
+                        help='with --programs, write the records of each ' +
+                             'program to the file PATTERN, formatted with ' +
+                             '{index} and {name}, instead of one output ' +
+                             'with a blank line after each program')
+    parser.add_argument('--read-ahead', action='store_true', default=False,
+                        help='with --programs, read the next program on a ' +
+                             'thread while assembling the current one')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='parse and size the lines of pass 1 in N ' +
+                             'worker processes, 0 for one for each CPU')
+    parser.add_argument('-I', '--include-path', action='append', default=[],
+                        metavar='DIR',
+                        help='search DIR for INCLUDE files, after the ' +
+                             'directory of the including file')
+    parser.add_argument('--max-source-bytes', type=int, default=None,
+                        metavar='N',
+                        help='stop reading a source longer than N characters')
+    parser.add_argument('--max-source-lines', type=int, default=None,
+                        metavar='N',
+                        help='stop reading a source longer than N lines')
+    parser.add_argument('--max-address', type=lambda x: int(x, 0),
+                        default=address_space, metavar='N',
+                        help='end of the address space a program may use')
+    parser.add_argument('--max-symbols', type=int, default=None,
+                        metavar='N', help='most symbols a program may define')
+    parser.add_argument('--max-output-bytes', type=int, default=None,
+                        metavar='N',
+                        help='largest size of the records of a program')
+    parser.add_argument('--time-limit', type=float, default=None,
+                        metavar='SECONDS',
+                        help='wall clock time a program may take')
+    return parser
+
+
+def parse_arguments(parser, argv=None):
+    """
+    Parse the command line. A report is on if its flag or its file is
+    given, and its option is then the file to write it to, '-' for stderr.
+    """
+    args = parser.parse_args(argv)
+    args.memprofile = report_path(args.memprofile, args.memprofile_file)
+    args.cost = report_path(args.cost, args.cost_file)
+    return args
+
+
+def report_path(enabled, path):
+    """ Return the file a report goes to, '-' for stderr, or None. """
+    if path is not None:
+        return path
+    return '-' if enabled else None
+
+
+def run():
+    parser = argument_parser()
 
     # Take action depending on whether or not this is being pipelined
     if sys.stdin.isatty():
@@ -16,13 +125,79 @@ def main():
                             default=None, required=False)
         parser.add_argument('-v', '--verbosity', type=int, choices=[0, 1, 2],
                             default=0, help='increase output verbosity')
-        args = parser.parse_args()
+        args = parse_arguments(parser)
+        limits = resource_limits(args)
+
+        if args.stream:
+            check_stream_args(parser, args)
+            try:
+                with open(args.file, 'r') as f:
+                    if args.outfile is None:
+                        stream(f, sys.stdout, args)
+                    else:
+                        with open(args.outfile, 'w') as w:
+                            stream(f, w, args)
+            except IOError:
+                print("[IO Error]: The source or output file could not be " +
+                      "opened.")
+            return
+
+        if args.programs:
+            check_programs_args(parser, args)
+            try:
+                with open(args.file, 'r') as f:
+                    if args.outfile is None:
+                        failed = programs(f, sys.stdout, args, limits)
+                    else:
+                        with open(args.outfile, 'w') as w:
+                            failed = programs(f, w, args, limits)
+            except IOError:
+                print("[IO Error]: The source or output file could not be " +
+                      "opened.")
+                return
+            if failed > 0:
+                sys.exit(1)
+            return
 
         try:
             with open(args.file, 'r') as f:
-                a = Assembler(f, args.verbosity)
-                a.assemble()
-                output_records = a.generated_records
+                lines = limits.read(f)
+                sections = control_sections(''.join(lines))
+                if sections is not None:
+                    check_sections_args(parser, args)
+                    output_records = assemble_sections(
+                            sections, args.jobs or None, relax=args.relax,
+                            auto_base=args.auto_base, peephole=args.optimize,
+                            relocatable=args.relocatable,
+                            include_paths=[os.path.dirname(args.file)] +
+                            args.include_path, limits=limits)
+                else:
+                    a = Assembler.from_lines(
+                            [line.rstrip('\n') for line in lines],
+                            source_path=args.file, verbosity=args.verbosity,
+                            relax=args.relax, peephole=args.optimize,
+                            relocatable=args.relocatable,
+                            memprofile=args.memprofile is not None,
+                            processes=args.jobs or None,
+                            include_paths=args.include_path,
+                            limits=limits, auto_base=args.auto_base)
+                    a.assemble()
+                    output_records = a.generated_records
+                    if args.debug_info is not None:
+                        a.write_debug_info(args.debug_info)
+                    if args.memprofile is not None:
+                        write_memory_report(a.memory_report, args.memprofile)
+                    if args.cost is not None:
+                        write_cost(a, args.cost)
+                    if a.relaxation_report is not None and args.verbosity > 0:
+                        sys.stderr.write("[Relaxation]: %i bytes saved\n" %
+                                         a.relaxation_report['bytes_saved'])
+                    if a.base_report is not None and args.verbosity > 0:
+                        write_base_report(a.base_report)
+                    if a.peephole_report is not None and args.verbosity > 0:
+                        sys.stderr.write("[Peephole]: %i bytes saved %s\n" %
+                                         (a.peephole_report['bytes_saved'],
+                                          a.peephole_report['hits']))
         except IOError:
             print("[IO Error]: The source file could not be opened.")
         except OpcodeLookupError as e:
@@ -42,10 +217,59 @@ def main():
             except IOError:
                 print("[IO Error]: The output file could not be opened.")
     else:
-        a = Assembler(sys.stdin)
+        args = parse_arguments(parser)
+        limits = resource_limits(args)
+
+        if args.stream:
+            check_stream_args(parser, args)
+            # read line by line, without waiting for a full buffer
+            try:
+                stream(iter(sys.stdin.readline, ''), sys.stdout, args)
+            except StopIteration:
+                print("[IO Error]: The source program could not be read " +
+                      "from stdin")
+            return
+
+        if args.programs:
+            check_programs_args(parser, args)
+            try:
+                failed = programs(iter(sys.stdin.readline, ''), sys.stdout,
+                                  args, limits)
+            except IOError:
+                print("[IO Error]: An output file could not be opened.")
+                return
+            if failed > 0:
+                sys.exit(1)
+            return
+
+        source = ''.join(limits.read(sys.stdin))
+        sections = control_sections(source)
+        if sections is not None:
+            check_sections_args(parser, args)
+            output_records = assemble_sections(
+                    sections, args.jobs or None, relax=args.relax,
+                    auto_base=args.auto_base, peephole=args.optimize,
+                    relocatable=args.relocatable,
+                    include_paths=args.include_path, limits=limits)
+            for record in output_records:
+                print(record)
+            return
+
+        a = Assembler(StringIO(source), relax=args.relax,
+                      peephole=args.optimize, relocatable=args.relocatable,
+                      memprofile=args.memprofile is not None,
+                      processes=args.jobs or None,
+                      include_paths=args.include_path, limits=limits,
+                      auto_base=args.auto_base)
         try:
             a.assemble()
             output_records = a.generated_records
+            if args.debug_info is not None:
+                a.write_debug_info(args.debug_info)
+            if args.memprofile is not None:
+                write_memory_report(a.memory_report, args.memprofile)
+            if args.cost is not None:
+                write_cost(a, args.cost)
         except StopIteration:
             print("[IO Error]: The source program could not be read from stdin")
         else:
@@ -53,5 +277,156 @@ def main():
                 print(record)
 
 
+def resource_limits(args):
+    """ Return the limits set on the command line. """
+    return Limits(source_bytes=args.max_source_bytes,
+                  source_lines=args.max_source_lines,
+                  address_space=args.max_address,
+                  symbols=args.max_symbols,
+                  output_bytes=args.max_output_bytes,
+                  seconds=args.time_limit)
+
+
+def check_stream_args(parser, args):
+    """ Reject the options which need the whole program at once. """
+    for name, flag in (('relax', '--relax'), ('auto_base', '--auto-base'),
+                       ('optimize', '--optimize'),
+                       ('debug_info', '--debug-info'),
+                       ('memprofile', '--memprofile'), ('cost', '--cost')):
+        if getattr(args, name):
+            parser.error(flag + ' can not be used with --stream')
+
+
+def check_programs_args(parser, args):
+    """ Reject the options which need a single program. """
+    for name, flag in (('stream', '--stream'),
+                       ('debug_info', '--debug-info'),
+                       ('memprofile', '--memprofile'), ('cost', '--cost')):
+        if getattr(args, name):
+            parser.error(flag + ' can not be used with --programs')
+
+
+def programs(lines, out, args, limits):
+    """
+    Assemble every program in a stream of lines and write the records of
+    each as soon as it is done, to out or to its own file. A program which
+    fails is reported on stderr and the next one is still assembled.
+    Returns the count of programs which failed.
+    """
+    failed = 0
+    results = assemble_programs(lines, args.read_ahead, relax=args.relax,
+                                auto_base=args.auto_base,
+                                peephole=args.optimize,
+                                relocatable=args.relocatable,
+                                include_paths=args.include_path,
+                                limits=limits)
+    for result in results:
+        if result.error is not None:
+            failed += 1
+            sys.stderr.write("[Program %i %s]: %s: %s\n" %
+                             (result.index, result.name or '',
+                              type(result.error).__name__,
+                              result.error.message))
+            continue
+        if args.split_output is not None:
+            path = args.split_output.format(index=result.index,
+                                            name=result.name or '')
+            with open(path, 'w') as w:
+                for record in result.records:
+                    w.write(record)
+                    w.write('\n')
+        else:
+            for record in result.records:
+                out.write(record)
+                out.write('\n')
+            out.write('\n')
+            out.flush()
+    return failed
+
+
+def control_sections(source):
+    """
+    Return the control sections of a source program, or None if it has
+    no CSECT directives.
+    """
+    if 'CSECT' not in source:
+        return None
+    sections = split_sections(source.splitlines())
+    if len(sections) == 1:
+        return None
+    return sections
+
+
+def check_sections_args(parser, args):
+    """ Reject the options which need a single program. """
+    for name, flag in (('debug_info', '--debug-info'),
+                       ('memprofile', '--memprofile'), ('cost', '--cost')):
+        if getattr(args, name):
+            parser.error(flag + ' can not be used with control sections')
+
+
+def stream(lines, out, args):
+    """
+    Assemble in pipeline mode, writing each record to out as soon as it is
+    ready, then report the latency to the first record on stderr.
+    """
+    def emit(record):
+        out.write(record)
+        out.write('\n')
+        out.flush()
+
+    if args.header_file is not None:
+        with open(args.header_file, 'w') as header_file:
+            def header(record):
+                header_file.write(record)
+                header_file.write('\n')
+            report = StreamAssembler(lines, emit, header,
+                                     args.relocatable,
+                                     resource_limits(args)).assemble()
+    else:
+        report = StreamAssembler(lines, emit, None, args.relocatable,
+                                 resource_limits(args)).assemble()
+
+    if report['first_record'] is not None:
+        sys.stderr.write("[Pipeline]: first record after %.3f ms, %i text "
+                         "records, at most %i held back\n" %
+                         (report['first_record'] * 1000, report['records'],
+                          report['held_back']))
+
+
+def write_base_report(report):
+    """ Write the result of the BASE placement to stderr. """
+    if report['base'] is None:
+        sys.stderr.write("[Auto BASE]: none placed, the program %s\n" %
+                         report['skipped'])
+    else:
+        sys.stderr.write("[Auto BASE]: BASE %s, %i format 4 instructions "
+                         "avoided, %i bytes saved\n" %
+                         (report['base'], report['extended_avoided'],
+                          report['bytes_saved']))
+
+
+def write_cost(assembler, path):
+    """ Write the cost estimate of a program to a file, or to stderr. """
+    report = assembler.estimate_cost()
+    if path == '-':
+        write_cost_report(report, sys.stderr)
+    else:
+        with open(path, 'w') as out:
+            write_cost_report(report, out)
+
+
+def write_memory_report(report, path):
+    """ Write a memory report to a file, or to stderr for '-'. """
+    if not report['available']:
+        sys.stderr.write("[Memory Profile]: tracemalloc is not available " +
+                         "in this version of Python\n")
+    if path == '-':
+        write_report(report, sys.stderr)
+    else:
+        with open(path, 'w') as out:
+            write_report(report, out)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,25 @@
+import sys
+from array import array
+
+
+def array_bytes(values, typecode):
+    """ Pack a list of values as a little endian array. """
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def read_array(data, offset, count, typecode):
+    """ Unpack a little endian array of count values at an offset. """
+    values = array(typecode)
+    chunk = data[offset:offset + values.itemsize * count]
+    if hasattr(values, 'frombytes'):
+        values.frombytes(chunk)
+    else:
+        values.fromstring(chunk)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
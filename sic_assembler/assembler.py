@@ -1,10 +1,24 @@
-import codecs
-
-from sic_assembler.errors import DuplicateSymbolError, LineFieldsError, OpcodeLookupError
-from sic_assembler.instructions import Format
-from sic_assembler.instructions import Format1, Format2, Format3, Format4
-from sic_assembler.instructions import extended, op_table
+import os
+
+from sic_assembler.autobase import place_base
+from sic_assembler.checkpoint import Pass1, read_pass1, write_pass1
+from sic_assembler.columns import export_columns
+from sic_assembler.cost import estimate
+from sic_assembler.debuginfo import write_debug_info
+from sic_assembler.dispatch import dispatch_table
+from sic_assembler.errors import BaseError, DuplicateSymbolError
+from sic_assembler.errors import IncludeError, InstructionError
+from sic_assembler.errors import LineFieldsError, OpcodeLookupError
+from sic_assembler.errors import UndefinedSymbolError
+from sic_assembler.expressions import resolve_equates
+from sic_assembler.includes import find_include, in_file, include_name
+from sic_assembler.includes import load_include
+from sic_assembler.limits import Limits, clock_lines, exceeded, limit_error
+from sic_assembler.linkage import external_symbols, external_terms
+from sic_assembler.memprofile import MemoryProfile, phase
+from sic_assembler.peephole import optimize
 from sic_assembler.records import generate_records
+from sic_assembler.relaxation import relax
 
 
 # A comment
@@ -24,7 +38,25 @@ def remove_comments(line):
     return line
 
 
+def quoted_fields(line):
+    """
+    Split a line into fields like str.split(), but keep the spaces in a
+    quoted constant like C'HELLO WORLD'.
+    """
+    start = line.find("'")
+    end = line.find("'", start + 1)
+    if start < 1 or end == -1 or line[start-1].isspace():
+        return line.split()
+    fields = line[:start].split()
+    fields[-1] += line[start:end+1]
+    return fields + line[end+1:].split()
+
+
 class SourceLine(object):
+    # the file of a line from an INCLUDE directive, None for the source
+    # program
+    filename = None
+
     def __init__(self, line_number, label, mnemonic, operand):
         self.location = None
         self.line_number = line_number
@@ -35,15 +67,19 @@ class SourceLine(object):
     @staticmethod
     def parse(line, line_number):
         """ Parse an individual line and return a SourceLine object. """
-        fields = remove_comments(line.split())
+        if "'" in line:
+            fields = remove_comments(quoted_fields(line))
+        else:
+            fields = remove_comments(line.split())
 
-        # if there is a space between operands, fix it
-        if len(fields) > 1 and fields[1].endswith(','):
-            operands = fields.pop(1) + fields.pop(1)
-            fields.append(operands)
-        elif len(fields) > 2 and fields[2].endswith(','):
-            operands = fields.pop(2) + fields.pop(2)
-            fields.append(operands)
+        # if there are spaces between operands, join them
+        for x in (1, 2):
+            if len(fields) > x + 1 and fields[x].endswith(','):
+                end = x + 1
+                while end < len(fields) - 1 and fields[end].endswith(','):
+                    end += 1
+                fields[x:end + 1] = [''.join(fields[x:end + 1])]
+                break
 
         if len(fields) is 3:
             return SourceLine(label=fields[0], mnemonic=fields[1],
@@ -56,9 +92,9 @@ class SourceLine(object):
                               line_number=line_number)
         else:
             raise LineFieldsError(
-                    message='Invalid amount of fields on line:' +
-                    str(line_number+1), code=1,
-                    line_number=line_number+1, contents=line)
+                    message='Invalid amount of fields on line: ' +
+                    str(line_number+2), code=1,
+                    line_number=line_number+2, contents=line)
 
     def __repr__(self):
         return "<SourceLine: %s, %s, %s>" % (self.label, self.mnemonic,
@@ -66,14 +102,63 @@ class SourceLine(object):
 
 
 class Assembler(object):
-    def __init__(self, inputfile, verbosity=0):
+    def __init__(self, inputfile, verbosity=0, relax=False, peephole=False,
+                 relocatable=False, memprofile=False, processes=1,
+                 include_paths=(), limits=None, auto_base=False,
+                 parse=None):
         self.verbosity = verbosity
-
-        self.contents = (line.rstrip('\n') for line in inputfile.readlines())
+        # The most the program may use, see sic_assembler.limits
+        self.limits = limits if limits is not None else Limits()
+        # The clock of the job starts before the source is read
+        self.__deadline = self.limits.deadline()
+        # Directories searched for INCLUDE files, after the directory of
+        # the file with the INCLUDE directive
+        self.include_paths = list(include_paths)
+        # The source file, if it is a file, to find the INCLUDE files
+        # next to it, and the files being included, to find circular
+        # includes
+        self.__set_source_path(getattr(inputfile, 'name', None))
+        # Parses a line of pass 1 into a SourceLine, an Engine gives its
+        # jobs one which remembers the lines parsed by the other jobs
+        self.parse = parse if parse is not None else SourceLine.parse
+        # Worker processes which parse and size the lines in pass 1, None
+        # for one for each CPU
+        self.processes = processes
+        # Generate modification records for relocation
+        self.relocatable = relocatable
+        # Run the peephole optimizer between the passes
+        self.peephole = peephole
+        # Results of the peephole optimizer
+        self.peephole_report = None
+        # Choose between format 3 and 4 automatically
+        self.relax = relax
+        # Results of the format relaxation
+        self.relaxation_report = None
+        # Load the B register at the first instruction if it saves format 4
+        # instructions, this relaxes the formats too
+        self.auto_base = auto_base
+        # Results of the BASE placement
+        self.base_report = None
+        # Record the memory used by each phase with tracemalloc
+        self.memprofile = memprofile
+        # Results of the memory profile
+        self.memory_report = None
+        self.__profile = MemoryProfile() if memprofile else None
+
+        with phase(self.__profile, 'read'):
+            # no input file when pass 1 is loaded from a checkpoint
+            lines = self.limits.read(inputfile) \
+                if inputfile is not None else []
+            self.contents = (line.rstrip('\n') for line in lines)
+        # Line number of the first line, when the lines are a part of a
+        # larger source program
+        self.line_offset = 0
         # Temporary array to store results of the first pass
         self.temp_contents = []
         # Symbol table
         self.symtab = dict()
+        # Symbols defined with EQU whose values are absolute, not addresses
+        self.absolute = set()
         # Location counter
         self.locctr = int(0)
         # Starting address
@@ -82,29 +167,106 @@ class Assembler(object):
         self.program_length = 0
         # Program name
         self.program_name = ""
+        # Operand of the END directive: the first instruction
+        self.end_operand = None
+        # Address and length in half-bytes of each field to relocate, and
+        # the external symbol to add or subtract if there is one
+        self.modifications = []
+        # Names in the EXTDEF and EXTREF directives
+        self.definitions = []
+        self.references = []
+        # False for a control section after the first, whose E record has
+        # no address
+        self.entry = True
         # BASE register
         self.base = None
         # array of tuples containing debugging information
         self.__generated_objects = []
         # array of the generated records
         self.__generated_records = []
+        # set once pass 1 is run or loaded from a checkpoint
+        self.__pass1_done = False
+
+    @classmethod
+    def from_lines(cls, lines, line_offset=0, source_path=None, **options):
+        """
+        Create an assembler for a list of lines without line endings, which
+        may be a part of a larger source program starting at line_offset.
+        The INCLUDE files are looked for next to source_path, if the lines
+        were read from a file.
+        """
+        assembler = cls(None, **options)
+        assembler.contents = iter(lines)
+        assembler.line_offset = line_offset
+        assembler.__set_source_path(source_path)
+        return assembler
+
+    def __set_source_path(self, path):
+        if path is not None and not os.path.isfile(path):
+            path = None
+        self.source_path = path
+        self.__including = []
+        if path is not None:
+            self.__including.append(os.path.realpath(path))
 
     def assemble(self):
         """ Assemble the contents of a file-like object. """
         if len(self.__generated_records) is 0:
-            self.first_pass()
-            self.second_pass()
-            # Generate some records
-            self.__generated_records = self.generate_records()
+            try:
+                self.__assemble()
+            except BaseError as e:
+                # name the file of a line from an INCLUDE directive
+                filename = getattr(e.details.get('contents'), 'filename',
+                                   None)
+                if filename is not None:
+                    in_file(e, filename)
+                raise
 
         return self.generated_records
 
+    def __assemble(self):
+        """ Run every pass over the program. """
+        try:
+            self.__run_passes()
+        finally:
+            # tracing must not outlive a program which fails
+            if self.__profile is not None:
+                self.__profile.stop()
+
+    def __run_passes(self):
+        """ Pass 1, the optional rewrites of its lines and pass 2. """
+        profile = self.__profile
+        limits = self.limits
+        if not self.__pass1_done:
+            with phase(profile, 'first_pass'):
+                self.first_pass()
+        if self.peephole:
+            with phase(profile, 'optimize'):
+                self.optimize()
+        if self.auto_base:
+            with phase(profile, 'relax'):
+                self.place_base()
+        elif self.relax:
+            with phase(profile, 'relax'):
+                self.relax_formats()
+        limits.check_time(self.__deadline)
+        with phase(profile, 'second_pass'):
+            self.second_pass()
+        limits.check_time(self.__deadline)
+        # Generate some records
+        with phase(profile, 'generate_records'):
+            self.__generated_records = self.generate_records()
+        limits.check_output(self.__generated_records)
+        if profile is not None:
+            self.memory_report = profile.report(self)
+
     def first_pass(self):
         """ Pass 1. """
 
         # Read the first line and search for 'START'
         first = next(self.contents)
-        first_line = SourceLine.parse(first, line_number=1)
+        # the line numbers of the lines count from the third line
+        first_line = SourceLine.parse(first, self.line_offset - 1)
         if first_line.mnemonic is not None:
             # If the opcode is 'START', set the locctr to the starting address
             if first_line.mnemonic == 'START':
@@ -112,15 +274,40 @@ class Assembler(object):
                 self.locctr = int(first_line.operand, 16)
                 self.program_name = first_line.label
 
+        if self.processes != 1:
+            # imported here, the module uses the parser of this module
+            from sic_assembler.parallel import first_pass
+            first_pass(self, self.contents, self.processes)
+            self.limits.check_time(self.__deadline)
+            self.__pass1_done = True
+            return
+
+        parse = self.parse
+        # The limits as plain numbers, so each line only compares them
+        limits = self.limits
+        deadline = self.__deadline
+        max_address = limits.bound('address_space')
+        max_symbols = limits.bound('symbols')
+        # the first line is already read
+        last_line = self.line_offset + limits.bound('source_lines') - 2
+
         # Loop through every line excluding the first
-        for line_number, line in enumerate(self.contents):
+        for line_number, line in enumerate(self.contents, self.line_offset):
+            if line_number > last_line:
+                exceeded('source_lines', limits.source_lines,
+                         line_number=line_number+2)
+            if deadline is not None and line_number % clock_lines == 0:
+                limits.check_time(deadline, line_number+2)
             if not blank_line(line) and not comment(line):
-                source_line = SourceLine.parse(line, line_number)
+                source_line = parse(line, line_number)
                 source_line.location = self.locctr
 
                 # If there is a label, search for it, and/or add it to symtab
                 if source_line.label is not None:
                     if source_line.label not in self.symtab:
+                        if len(self.symtab) >= max_symbols:
+                            exceeded('symbols', limits.symbols,
+                                     line_number=line_number+2)
                         self.symtab[source_line.label] = hex(int(self.locctr))
                     else:
                         raise DuplicateSymbolError(
@@ -128,133 +315,295 @@ class Assembler(object):
                                 str(line_number+2), code=1,
                                 line_number=line_number+2, contents=line)
 
-                mnemonic = base_mnemonic(source_line.mnemonic)
-                # Search optab for the mnemonic
-                if mnemonic in op_table:
-                    self.locctr += determine_format(source_line.mnemonic)
-                elif mnemonic == 'WORD':
-                    self.locctr += 3
-                elif mnemonic == 'RESW':
-                    self.locctr += 3 * int(source_line.operand)
-                elif mnemonic == 'RESB':
-                    self.locctr += int(source_line.operand)
-                elif mnemonic == 'BYTE':
-                    if source_line.operand.startswith('X'):
-                        value = source_line.operand.replace("X", '')
-                        stripped_value = value.replace("'", '')
-                        hex_value = int(stripped_value, 16)
-                        self.locctr += (len(hex(hex_value)) - 2) / 2
-                    elif source_line.operand.startswith("C"):
-                        value = source_line.operand.replace("C", '')
-                        stripped_value = value.replace("'", '')
-                        self.locctr += len(stripped_value)
-                    else:
-                        raise LineFieldsError(
-                                message="Invalid value for BYTE on line: " +
-                                str(line_number+2), code=1,
-                                line_number=line_number+2, contents=line)
-                elif mnemonic == 'END':
-                    # Stop reading through the file contents
-                    break
-                elif mnemonic == 'BASE':
-                    # ignore the base mnemonic on the first pass
-                    # this will be taken care of on the second pass
-                    pass
-                else:
+                # Search the dispatch table for the mnemonic
+                entry = dispatch_table.get(source_line.mnemonic)
+                if entry is None:
                     raise OpcodeLookupError(
                             message='The mnemonic is invalid on line: ' +
                             str(line_number+2), code=1,
                             line_number=line_number+2, contents=line)
+                if entry.size is not None:
+                    self.locctr += entry.size
+                else:
+                    size = entry.first_pass(self, source_line, entry)
+                    if size is None:
+                        # Stop reading through the file contents at END
+                        break
+                    self.locctr += size
+                    if entry.name == 'INCLUDE':
+                        # already added, before the included lines
+                        continue
+                if self.locctr > max_address:
+                    exceeded('address_space', limits.address_space,
+                             line_number=line_number+2)
 
                 # Add to the temporary array
                 self.temp_contents.append(source_line)
- 
+
+        self.absolute = resolve_equates(self.temp_contents, self.symtab)
+        self.__pass1_done = True
+
+    def include(self, source_line):
+        """
+        Add the INCLUDE line and then the lines of the file it names after
+        the lines read so far. The file is looked for next to the file with
+        the directive, then in each of the include paths, and is only parsed
+        again if it changed. Returns the size of the INCLUDE line itself,
+        which is placed before the included lines so its label stays at the
+        first of them when the lines are laid out again.
+        """
+        line_number = source_line.line_number + 2
+        if source_line.operand is None:
+            raise LineFieldsError(
+                    message="INCLUDE needs a file name on line: " +
+                    str(line_number), code=1, line_number=line_number,
+                    contents=source_line)
+
+        including = source_line.filename or self.source_path
+        directories = [os.path.dirname(including) if including is not None
+                       else os.curdir] + self.include_paths
+        path = find_include(include_name(source_line.operand), directories)
+        if path is None:
+            raise IncludeError(
+                    message="The include file was not found on line: " +
+                    str(line_number), code=1, line_number=line_number,
+                    contents=source_line)
+        if path in self.__including:
+            raise IncludeError(
+                    message="Circular include of " + path + " on line: " +
+                    str(line_number), code=1, line_number=line_number,
+                    contents=source_line,
+                    files=self.__including[self.__including.index(path):])
+
+        tokens = load_include(path, SourceLine.parse)
+        source_line.location = self.locctr
+        self.temp_contents.append(source_line)
+        self.__including.append(path)
+        try:
+            for line_number, label, mnemonic, operand in tokens:
+                included = SourceLine(line_number, label, mnemonic, operand)
+                included.filename = path
+                included.location = self.locctr
+
+                if label is not None:
+                    if label in self.symtab:
+                        raise in_file(DuplicateSymbolError(
+                                message="A duplicate symbol was found on " +
+                                "line: " + str(line_number+2), code=1,
+                                line_number=line_number+2,
+                                contents=included), path)
+                    if len(self.symtab) >= self.limits.bound('symbols'):
+                        raise in_file(limit_error(
+                                'symbols', self.limits.symbols,
+                                line_number=line_number+2), path)
+                    self.symtab[label] = hex(int(self.locctr))
+
+                entry = dispatch_table.get(mnemonic)
+                if entry is None:
+                    raise in_file(OpcodeLookupError(
+                            message='The mnemonic is invalid on line: ' +
+                            str(line_number+2), code=1,
+                            line_number=line_number+2, contents=included),
+                            path)
+                if entry.size is not None:
+                    size = entry.size
+                else:
+                    size = entry.first_pass(self, included, entry)
+                    if size is None:
+                        raise in_file(IncludeError(
+                                message="END can't be in an include file, " +
+                                "on line: " + str(line_number+2), code=1,
+                                line_number=line_number+2,
+                                contents=included), path)
+                self.locctr += size
+                if self.locctr > self.limits.bound('address_space'):
+                    raise in_file(limit_error(
+                            'address_space', self.limits.address_space,
+                            line_number=line_number+2), path)
+                if entry.name != 'INCLUDE':
+                    self.temp_contents.append(included)
+        finally:
+            self.__including.pop()
+
+        return 0
+
+    def save_pass1(self, path):
+        """
+        Write the intermediate file, the symbol table and the rest of the
+        state after pass 1 to a checkpoint, see sic_assembler.checkpoint.
+        """
+        with open(path, 'wb') as out:
+            write_pass1(out, Pass1(self.temp_contents, self.symtab,
+                                   self.start_address, self.locctr,
+                                   self.program_name, self.end_operand))
+
+    def load_pass1(self, path):
+        """
+        Load the state after pass 1 from a checkpoint written by
+        save_pass1(), so pass 2 can run without reading the source.
+        """
+        with open(path, 'rb') as f:
+            pass1 = read_pass1(f.read(), SourceLine)
+        self.temp_contents = pass1.temp_contents
+        self.symtab = pass1.symtab
+        self.start_address = pass1.start_address
+        self.locctr = pass1.locctr
+        self.program_name = pass1.program_name
+        self.end_operand = pass1.end_operand
+        # the checkpoint only has the values, so mark the equates again
+        self.absolute = resolve_equates(self.temp_contents, self.symtab)
+        self.__pass1_done = True
+
+    def optimize(self, rules=None):
+        """
+        Remove redundant instructions from the intermediate file and
+        re-assign the locations of the remaining lines.
+        """
+        self.temp_contents, self.locctr, self.peephole_report = optimize(
+                self.temp_contents, self.symtab, self.locctr, rules)
+        return self.peephole_report
+
+    def relax_formats(self):
+        """
+        Grow format 3 instructions to format 4 only where the operand can't
+        be reached, ignoring any '+' prefixes in the source program.
+        """
+        self.locctr, self.relaxation_report = relax(self.temp_contents,
+                                                    self.symtab, self.locctr,
+                                                    self.absolute)
+        return self.relaxation_report
+
+    def place_base(self):
+        """
+        Relax the formats, then load the B register at the first
+        instruction if a BASE saves enough format 4 instructions, see
+        sic_assembler.autobase.
+        """
+        self.temp_contents, self.locctr, self.base_report = place_base(
+                self.temp_contents, self.symtab, self.locctr,
+                self.end_operand, self.absolute)
+        self.relaxation_report = self.base_report['relaxation']
+        return self.base_report
 
     def second_pass(self):
         """ Pass 2. """
 
         object_code = []
-
-        for source_line in self.temp_contents:
-            found_opcode = op_table.get(base_mnemonic(source_line.mnemonic))
-            if found_opcode:
-                # determine the instruction format
-                instr_format = determine_format(source_line.mnemonic)
-                
-                instruction_output = self.generate_instruction(
-                                            source_line.location,
-                                            instr_format,
-                                            source_line) 
-                object_code.append((source_line.location, instruction_output))
-
-            else:
-                if source_line.mnemonic == 'WORD':
-                    hex_value = hex(int(source_line.operand))
-                    stripped_value = hex_value.lstrip("0x")
-                    padded_value = stripped_value.zfill(6)
-                    object_info = (source_line.mnemonic, source_line.operand,
-                                   padded_value)
-                    object_code.append((source_line.location, object_info))
-                elif source_line.mnemonic == 'BYTE':
-                    if source_line.operand.startswith('X'):
-                        value = source_line.operand.replace("X", '')
-                        stripped_value = value.replace("'", '')
-                        object_info = (source_line.mnemonic,
-                                       source_line.operand, stripped_value)
-                        object_code.append((source_line.location,
-                                            object_info))
-                    elif source_line.operand.startswith("C"):
-                        value = source_line.operand.replace("C", '')
-                        stripped_value = value.replace("'", '').encode()
-                        hex_value = codecs.encode(stripped_value, "hex")
-                        object_info = (source_line.mnemonic,
-                                       source_line.operand, hex_value)
-                        object_code.append((source_line.location,
-                                            object_info))
-                elif source_line.mnemonic == 'BASE':
-                    self.base = self.symtab.get(source_line.operand)
-                elif source_line.mnemonic == 'NOBASE':
-                    self.base = None
+        self.modifications = []
+        self.definitions, self.references = external_symbols(
+                                                self.temp_contents)
+        if len(self.references) > 0:
+            self.__declare_references()
+
+        deadline = self.__deadline
+        for x, source_line in enumerate(self.temp_contents):
+            if deadline is not None and x % clock_lines == 0:
+                self.limits.check_time(deadline,
+                                       source_line.line_number+2)
+            entry = dispatch_table[source_line.mnemonic]
+            if entry.second_pass is None:
+                continue
+            output = entry.second_pass(self, source_line, entry)
+            if output is None:
+                continue
+            if entry.format is not None:
+                # encode the instruction once, every later use is cached
+                output.encode()
+            object_code.append((source_line.location, output))
+
+            if len(self.references) > 0 and entry.format is not None and \
+                    entry.format >= 3:
+                terms = external_terms(source_line.operand, self.references)
+                if len(terms) > 0:
+                    self.__modify_external(source_line, entry, terms)
+                    continue
+
+            # the address field of format 4 holds an absolute address
+            if self.relocatable and entry.format == 4 and output.relocatable:
+                self.modifications.append((source_line.location + 1, 5))
 
         self.__generated_objects = object_code
 
-    def generate_instruction(self, line_number, instr_format, source_line):
-        if instr_format is 1:
-            instruction = Format1(mnemonic=source_line.mnemonic)
-        elif instr_format is 2:
-            expected_operands = op_table[source_line.mnemonic].operands
-            if len(expected_operands) == 2:
-                r1, r2 = source_line.operand.split(',')
-            elif len(expected_operands) == 1:
-                r1, r2 = source_line.operand, None
-            instruction = Format2(mnemonic=source_line.mnemonic,
-                                  r1=r1, r2=r2)
-        elif instr_format is 3:
-            instruction = Format3(base=self.base, symtab=self.symtab,
-                                  source_line=source_line)
-        elif instr_format is 4:
-            instruction = Format4(symtab=self.symtab, source_line=source_line)
-
-        return instruction
+    def __declare_references(self):
+        """
+        Give every external reference the address 0 in the symbol table,
+        the loader adds the real address with a modification record.
+        """
+        labels = set(x.label for x in self.temp_contents)
+        for name in self.references:
+            if name in labels:
+                raise DuplicateSymbolError(
+                        message="An external reference is also defined " +
+                        "in the section: " + name, code=1, symbol=name)
+            self.symtab[name] = hex(0)
+
+    def __modify_external(self, source_line, entry, terms):
+        """ Add a modification record for each external reference. """
+        if entry.format != 4:
+            raise InstructionError(
+                    message="An external reference needs format 4 on line: " +
+                    str(source_line.line_number+2), code=1,
+                    line_number=source_line.line_number+2,
+                    contents=source_line)
+        for symbol in terms:
+            self.modifications.append((source_line.location + 1, 5, symbol))
 
     def generate_records(self):
         if len(self.__generated_records) > 0:
             return self.generated_records
-        last_line = self.generated_objects[len(self.generated_objects)-1]
-        if isinstance(last_line[1], Format):
-            self.program_length = self.locctr + len(last_line[1].generate()) - \
-                    self.start_address
-        else:
-            self.program_length = self.locctr + len(last_line[1])/2 - \
-                    self.start_address
+        self.program_length = self.locctr - self.start_address
+
+        first_address = self.symtab.get(self.end_operand)
+        if first_address is not None:
+            first_address = int(first_address, 16)
+
+        definitions = []
+        for name in self.definitions:
+            if name not in self.symtab:
+                raise UndefinedSymbolError(
+                        message='Undefined external definition: ' + name,
+                        code=1, symbol=name)
+            definitions.append((name, int(self.symtab[name], 16)))
 
         self.__generated_records = generate_records(
                                    generated_objects=self.generated_objects,
                                    program_name=self.program_name,
                                    start_address=self.start_address,
-                                   program_length=self.program_length)
+                                   program_length=self.program_length,
+                                   modifications=self.modifications,
+                                   first_address=first_address,
+                                   definitions=definitions,
+                                   references=self.references,
+                                   entry=self.entry)
         return self.generated_records
 
+    def export_columns(self):
+        """
+        Return the objects of the assembled program as columns and the blob
+        of their object code, see sic_assembler.columns.
+        """
+        return export_columns(self)
+
+    def estimate_cost(self, table=None, loop_weight=10, top=10):
+        """
+        Estimate the cost of running the assembled program from its control
+        flow graph, see sic_assembler.cost.
+        """
+        entry = self.symtab.get(self.end_operand)
+        if entry is not None:
+            entry = int(entry, 16)
+        return estimate(self.generated_objects, self.symtab, entry, table,
+                        loop_weight, top)
+
+    def write_debug_info(self, path):
+        """
+        Write the address to line and symbol tables and the symbol cross
+        references to a debug information file, see sic_assembler.debuginfo.
+        """
+        with open(path, 'wb') as out:
+            write_debug_info(out, self.temp_contents, self.symtab,
+                             self.locctr)
+
     @property
     def generated_objects(self):
         return self.__generated_objects
@@ -269,15 +618,9 @@ def base_mnemonic(mnemonic):
     Strips off extra information attached to a mnemonic and returns
     a simple mnemonic.
     """
-    if extended(mnemonic):
-        return mnemonic[1:]
-    else:
-        return mnemonic
+    return dispatch_table[mnemonic].name
 
 
 def determine_format(mnemonic):
     """ Determine the instruction format. """
-    if extended(mnemonic):
-        return op_table[mnemonic[1:]].format + 1
-    else:
-        return op_table[mnemonic].format
+    return dispatch_table[mnemonic].format
@@ -0,0 +1,150 @@
+from bisect import bisect_right
+
+from sic_assembler.dispatch import dispatch_table
+from sic_assembler.expressions import absolute_operand
+from sic_assembler.instructions import extended, operand_text
+from sic_assembler.layout import assign_locations, line_sizes
+from sic_assembler.relaxation import relax, relaxable, target_address
+
+
+# Format 2 instructions and the index of the register operand they write
+register_writes = {'ADDR': 1, 'CLEAR': 0, 'DIVR': 1, 'MULR': 1, 'RMO': 1,
+                   'SHIFTL': 0, 'SHIFTR': 0, 'SUBR': 1}
+
+
+def writes_base_register(source_line):
+    """ Return True if the line changes the B register. """
+    mnemonic = source_line.mnemonic.lstrip('+')
+    if mnemonic == 'LDB':
+        return True
+    index = register_writes.get(mnemonic)
+    if index is None or source_line.operand is None:
+        return False
+    registers = source_line.operand.split(',')
+    return index < len(registers) and registers[index] == 'B'
+
+
+def skip_reason(temp_contents):
+    """
+    Return why a program can't be given a BASE register, or None if it
+    can. The program must leave the B register and the BASE directives to
+    the assembler, and must not call code outside it which could change B.
+    """
+    for source_line in temp_contents:
+        if source_line.mnemonic in ('BASE', 'NOBASE'):
+            return 'has BASE directives'
+        if source_line.mnemonic == 'EXTREF':
+            return 'has external references'
+        if writes_base_register(source_line):
+            return 'writes the B register'
+    return None
+
+
+def best_window(targets, labels):
+    """
+    Return the label whose 4 KB window [address, address + 4095] holds the
+    most of the target addresses, and the number of targets it holds.
+    The lowest address wins a tie.
+    """
+    targets = sorted(targets)
+    best, covered = None, 0
+    for address, name in sorted(labels):
+        count = bisect_right(targets, address + 4095) - \
+            bisect_right(targets, address - 1)
+        if count > covered:
+            best, covered = name, count
+    return best, covered
+
+
+def place_base(temp_contents, symtab, end_address, entry=None, absolute=()):
+    """
+    Relax the formats of a program, then try to load the B register once
+    at its first instruction so the format 4 instructions whose operands
+    fall in one 4 KB window can be format 3 with base relative addressing.
+
+    The window starts at the label which covers the most operands that
+    are out of PC relative range. Since nothing else in the program
+    writes B, loading it where the program starts makes it hold the same
+    address in every instruction, in any order they are run. So the BASE
+    directive goes before the first line, and the entry line gets:
+
+        NOBASE          the LDB itself must not use B
+        LDB    #label
+        BASE   label
+
+    The formats are relaxed again with the new lines. The lines are only
+    kept if the program gets shorter, otherwise they are taken out again.
+
+    Returns the lines, the new end address and a report of the label
+    chosen, the format 4 instructions avoided and the bytes saved.
+    """
+    # the reason comes from the lines as written, before they are relaxed
+    skipped = skip_reason(temp_contents)
+    end_address, relaxation = relax(temp_contents, symtab, end_address,
+                                    absolute)
+    report = {'base': None, 'skipped': skipped, 'covered': 0,
+              'extended_avoided': 0, 'bytes_saved': 0,
+              'relaxation': relaxation}
+    if skipped is not None:
+        return temp_contents, end_address, report
+
+    targets = []
+    for source_line in temp_contents:
+        if relaxable(source_line) and extended(source_line.mnemonic):
+            target = target_address(source_line, symtab)
+            if target is not None and not absolute_operand(
+                    operand_text(source_line.operand), absolute):
+                targets.append(target)
+    labels = [(x.location, x.label) for x in temp_contents
+              if x.label is not None and
+              dispatch_table[x.mnemonic].name != 'EQU']
+    label, covered = best_window(targets, labels)
+    if label is None:
+        report['skipped'] = 'no operand out of range'
+        return temp_contents, end_address, report
+
+    # the layout after the first relaxation, to go back to
+    mnemonics = [x.mnemonic for x in temp_contents]
+    sizes = line_sizes(temp_contents, end_address)
+    first_location = temp_contents[0].location
+
+    start = 0
+    for x, source_line in enumerate(temp_contents):
+        if entry is not None and source_line.label == entry:
+            start = x
+            break
+    entry_line = temp_contents[start]
+    line_number = entry_line.line_number
+    # the new lines are the same type as the lines of the program
+    line_type = type(entry_line)
+    load = line_type(line_number, entry_line.label, 'LDB', '#' + label)
+    entry_line.label = None
+    lines = [line_type(line_number, None, 'NOBASE', None), load,
+             line_type(line_number, None, 'BASE', label)]
+    new_sizes = [0, 3, 0]
+    if start > 0:
+        lines = [line_type(line_number, None, 'BASE', label)] + \
+            temp_contents[:start] + lines
+        new_sizes = [0] + sizes[:start] + new_sizes
+    output = lines + temp_contents[start:]
+    output_sizes = new_sizes + sizes[start:]
+    output[0].location = first_location
+    based_end = assign_locations(output, symtab, output_sizes)
+    based_end, based = relax(output, symtab, based_end, absolute)
+
+    if based_end >= end_address:
+        # not worth the LDB, put the first layout back
+        entry_line.label = load.label
+        for source_line, mnemonic in zip(temp_contents, mnemonics):
+            source_line.mnemonic = mnemonic
+        temp_contents[0].location = first_location
+        assign_locations(temp_contents, symtab, sizes)
+        report['skipped'] = 'no bytes saved'
+        return temp_contents, end_address, report
+
+    report.update({'base': label, 'covered': covered,
+                   'extended_avoided': relaxation['extended'] -
+                   based['extended'] + (1 if extended(load.mnemonic) else 0),
+                   'bytes_saved': end_address - based_end,
+                   'relaxation': based})
+    return output, based_end, report
@@ -0,0 +1,153 @@
+import struct
+
+from sic_assembler.arrays import array_bytes, read_array
+from sic_assembler.errors import RecordError
+
+
+# Layout of the file, all values are little endian:
+#
+#   header      magic, version, the count of each section, the start address,
+#               the location counter and the string numbers of the program
+#               name and the operand of END (-1 for none)
+#   offsets     uint32 offset of each string in the strings, and the end of
+#               the last string
+#   numbers     int32 source line number of each line
+#   locations   int32 location of each line
+#   labels      int32 string number of the label of each line, or -1
+#   mnemonics   int32 string number of the mnemonic of each line
+#   operands    int32 string number of the operand of each line, or -1
+#   filenames   int32 string number of the INCLUDE file of each line, or -1
+#   sym_names   int32 string number of each symbol
+#   sym_values  int32 value of each symbol
+#   strings     every distinct label, mnemonic, operand, file and name, once
+magic = b'SICP'
+version = 2
+header_format = '<4sHHIIIIIii'
+header_size = struct.calcsize(header_format)
+
+
+def _text(value):
+    """ Return a string read from the file as the native string type. """
+    if isinstance(value, str):
+        return value
+    return value.decode('utf-8')
+
+
+class _StringTable(object):
+    """ Give each distinct string a number, in the order they are added. """
+    def __init__(self):
+        self.numbers = dict()
+        self.strings = []
+
+    def add(self, value):
+        if value is None:
+            return -1
+        number = self.numbers.get(value)
+        if number is None:
+            number = self.numbers[value] = len(self.strings)
+            self.strings.append(value)
+        return number
+
+
+class Pass1(object):
+    """ The state of an assembler after pass 1. """
+    def __init__(self, temp_contents, symtab, start_address, locctr,
+                 program_name, end_operand):
+        self.temp_contents = temp_contents
+        self.symtab = symtab
+        self.start_address = start_address
+        self.locctr = locctr
+        self.program_name = program_name
+        self.end_operand = end_operand
+
+
+def write_pass1(out, pass1):
+    """ Write the state of an assembler after pass 1 to a binary file. """
+    strings = _StringTable()
+    numbers, locations, labels, mnemonics, operands, filenames = \
+        [], [], [], [], [], []
+    for source_line in pass1.temp_contents:
+        numbers.append(source_line.line_number)
+        locations.append(source_line.location)
+        labels.append(strings.add(source_line.label))
+        mnemonics.append(strings.add(source_line.mnemonic))
+        operands.append(strings.add(source_line.operand))
+        filenames.append(strings.add(source_line.filename))
+
+    names = sorted(pass1.symtab)
+    sym_names = [strings.add(name) for name in names]
+    sym_values = [int(str(pass1.symtab[name]), 16) for name in names]
+
+    program_name = strings.add(pass1.program_name)
+    end_operand = strings.add(pass1.end_operand)
+
+    encoded = [x.encode('utf-8') for x in strings.strings]
+    offsets = [0]
+    for x in encoded:
+        offsets.append(offsets[-1] + len(x))
+
+    out.write(struct.pack(header_format, magic, version, 0,
+                          len(numbers), len(names), len(encoded),
+                          pass1.start_address, pass1.locctr,
+                          program_name, end_operand))
+    out.write(array_bytes(offsets, 'I'))
+    out.write(array_bytes(numbers, 'i'))
+    out.write(array_bytes(locations, 'i'))
+    out.write(array_bytes(labels, 'i'))
+    out.write(array_bytes(mnemonics, 'i'))
+    out.write(array_bytes(operands, 'i'))
+    out.write(array_bytes(filenames, 'i'))
+    out.write(array_bytes(sym_names, 'i'))
+    out.write(array_bytes(sym_values, 'i'))
+    out.write(b''.join(encoded))
+
+
+def read_pass1(data, source_line_type):
+    """
+    Read the state of an assembler after pass 1 from the contents of a
+    file, making a source_line_type for each line.
+    """
+    if len(data) < header_size:
+        raise RecordError(message="Not a pass 1 checkpoint")
+    (file_magic, file_version, _, line_count, symbol_count, string_count,
+     start_address, locctr, program_name, end_operand) = \
+        struct.unpack_from(header_format, data, 0)
+    if file_magic != magic:
+        raise RecordError(message="Not a pass 1 checkpoint")
+    if file_version != version:
+        raise RecordError(message="Pass 1 checkpoint version %i, expected %i"
+                          % (file_version, version))
+
+    offset = header_size
+    offsets = read_array(data, offset, string_count + 1, 'I')
+    offset += 4 * (string_count + 1)
+    columns = []
+    for _ in range(6):
+        columns.append(read_array(data, offset, line_count, 'i'))
+        offset += 4 * line_count
+    sym_names = read_array(data, offset, symbol_count, 'i')
+    offset += 4 * symbol_count
+    sym_values = read_array(data, offset, symbol_count, 'i')
+    offset += 4 * symbol_count
+
+    blob = data[offset:]
+    if len(blob) != offsets[-1]:
+        raise RecordError(message="Truncated pass 1 checkpoint")
+    # None for -1, so a string number can be used as an index directly
+    strings = [_text(blob[offsets[x]:offsets[x+1]])
+               for x in range(string_count)] + [None]
+
+    temp_contents = []
+    for line_number, location, label, mnemonic, operand, filename in \
+            zip(*columns):
+        source_line = source_line_type(line_number, strings[label],
+                                       strings[mnemonic], strings[operand])
+        source_line.location = location
+        if filename >= 0:
+            source_line.filename = strings[filename]
+        temp_contents.append(source_line)
+
+    symtab = dict((strings[name], hex(value))
+                  for name, value in zip(sym_names, sym_values))
+    return Pass1(temp_contents, symtab, start_address, locctr,
+                 strings[program_name], strings[end_operand])
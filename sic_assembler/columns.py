@@ -0,0 +1,270 @@
+import binascii
+import mmap
+import os
+import struct
+from array import array
+
+from sic_assembler.errors import RecordError
+from sic_assembler.instructions import Format
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The columns of an exported program, one row per object in the object
+# code, with the array typecode and the NumPy type of each:
+#
+#   address     address of the object
+#   size        size of the object code in bytes
+#   offset      offset of the object code in the blob of the program
+#   line        source line number
+#   target      target address of a format 3/4 instruction, or -1
+#   opcode      opcode of an instruction, without the n and i bits, or -1
+#               for data
+#   format      format of an instruction, or 0 for data
+#   flags       nixbpe of a format 3/4 instruction, with the bits of
+#               instructions.flag_table, or 0
+fields = (('address', 'I', '<u4'), ('size', 'I', '<u4'),
+          ('offset', 'I', '<u4'), ('line', 'I', '<u4'),
+          ('target', 'i', '<i4'), ('opcode', 'h', '<i2'),
+          ('format', 'b', 'i1'), ('flags', 'B', 'u1'))
+field_names = tuple(x[0] for x in fields)
+row_format = '<' + ''.join(x[1] for x in fields)
+row_size = struct.calcsize(row_format)
+
+# Layout of a column file, all values are little endian. Programs are
+# appended one after the other and every part starts at a multiple of 8
+# bytes, so the rows of each program can be read from a memory map without
+# copying them:
+#
+#   header      magic, version, reserved and the size of a row
+#   per program:
+#     program   length of the name, count of rows, size of the blob,
+#               reserved
+#     name      the program name, padded
+#     rows      row_size bytes per row, the fields in the order above
+#     blob      the object code of the rows, padded
+magic = b'SICC'
+version = 1
+header_format = '<4sHHI4x'
+header_size = struct.calcsize(header_format)
+program_format = '<IIII'
+program_size = struct.calcsize(program_format)
+
+
+def dtype():
+    """ Return the NumPy type of a row. """
+    return numpy.dtype([(name, numpy_type) for name, _, numpy_type in fields])
+
+
+def _padding(size):
+    return -size % 8
+
+
+def export_columns(assembler):
+    """
+    Return the objects of an assembled program as columns, and the blob of
+    their object code. The columns are a NumPy structured array if NumPy is
+    installed, otherwise a dict of arrays keyed by field name.
+    """
+    # the line of each location with object code is the last line there,
+    # the lines before it at the same location have no size
+    lines = dict((x.location, x.line_number + 2)
+                 for x in assembler.temp_contents)
+
+    columns = dict((name, array(typecode)) for name, typecode, _ in fields)
+    code = []
+    offset = 0
+    for location, output in assembler.generated_objects:
+        if isinstance(output, Format):
+            encoded = output.encode()
+            data = encoded.code
+            instruction_format = len(output)
+            opcode = int(encoded.hex[:2], 16)
+            if instruction_format >= 3:
+                opcode &= 0xFC
+                flags = encoded.flags
+            else:
+                flags = 0
+            target = encoded.target if encoded.target is not None else -1
+        else:
+            data = binascii.unhexlify(output[2])
+            instruction_format, opcode, flags, target = 0, -1, 0, -1
+
+        columns['address'].append(location)
+        columns['size'].append(len(data))
+        columns['offset'].append(offset)
+        columns['line'].append(lines.get(location, 0))
+        columns['target'].append(target)
+        columns['opcode'].append(opcode)
+        columns['format'].append(instruction_format)
+        columns['flags'].append(flags)
+        code.append(data)
+        offset += len(data)
+
+    blob = b''.join(code)
+    if numpy is None:
+        return columns, blob
+    rows = numpy.zeros(len(columns['address']), dtype=dtype())
+    for name in field_names:
+        rows[name] = numpy.frombuffer(columns[name],
+                                      dtype=columns[name].typecode)
+    return rows, blob
+
+
+def _row_bytes(columns):
+    """ Pack the rows of a program, from either kind of columns. """
+    if numpy is not None and isinstance(columns, numpy.ndarray):
+        return columns.astype(dtype()).tobytes()
+    return b''.join(struct.pack(row_format, *row)
+                    for row in zip(*[columns[name] for name in field_names]))
+
+
+def write_columns(out, name, columns, blob):
+    """ Write the columns and blob of one program to a column file. """
+    encoded = (name or '').encode('utf-8')
+    rows = _row_bytes(columns)
+    out.write(struct.pack(program_format, len(encoded), len(rows) // row_size,
+                          len(blob), 0))
+    out.write(encoded + b'\0' * _padding(len(encoded)))
+    out.write(rows)
+    out.write(blob + b'\0' * _padding(len(blob)))
+
+
+def append_programs(path, assemblers):
+    """
+    Export assembled programs and append them to a column file, which is
+    created if it doesn't exist. Returns the count of programs appended.
+    """
+    count = 0
+    with open(path, 'ab') as out:
+        out.seek(0, os.SEEK_END)
+        if out.tell() == 0:
+            out.write(struct.pack(header_format, magic, version, 0,
+                                  row_size))
+        for assembler in assemblers:
+            columns, blob = export_columns(assembler)
+            write_columns(out, assembler.program_name, columns, blob)
+            count += 1
+    return count
+
+
+class ColumnFile(object):
+    """
+    Read a column file. The file is memory mapped and only the program
+    headers are read when it is opened. With NumPy the rows of a program
+    are a structured array over a numpy.memmap, which stays valid after
+    the file is closed, otherwise they are read into a dict of arrays.
+    """
+    def __init__(self, path):
+        self.__file = None
+        size = os.path.getsize(path)
+        if size < header_size:
+            raise RecordError(message="Not a column file: " + str(path))
+        if numpy is not None:
+            self.__data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        else:
+            self.__file = open(path, 'rb')
+            self.__data = mmap.mmap(self.__file.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+
+        file_magic, file_version, _, file_row_size = \
+            struct.unpack_from(header_format, self.__data, 0)
+        if file_magic != magic or file_version != version or \
+                file_row_size != row_size:
+            self.close()
+            raise RecordError(message="Not a column file: " + str(path))
+
+        # name, offset of the rows, count of rows, offset and size of the
+        # blob of each program
+        self.__programs = []
+        offset = header_size
+        while offset < size:
+            if offset + program_size > size:
+                self.close()
+                raise RecordError(message="Truncated column file: " +
+                                  str(path))
+            name_size, row_count, blob_size, _ = \
+                struct.unpack_from(program_format, self.__data, offset)
+            offset += program_size
+            name = self.__bytes(offset, name_size).decode('utf-8')
+            offset += name_size + _padding(name_size)
+            rows = offset
+            offset += row_count * row_size
+            blob = offset
+            offset += blob_size + _padding(blob_size)
+            if offset > size:
+                self.close()
+                raise RecordError(message="Truncated column file: " +
+                                  str(path))
+            self.__programs.append((name, rows, row_count, blob, blob_size))
+
+    def __len__(self):
+        return len(self.__programs)
+
+    @property
+    def names(self):
+        return [x[0] for x in self.__programs]
+
+    def __bytes(self, offset, size):
+        data = self.__data[offset:offset + size]
+        if numpy is not None:
+            return data.tobytes()
+        return data
+
+    def __rows(self, offset, count):
+        if numpy is not None:
+            return self.__data[offset:offset + count * row_size].view(dtype())
+        columns = dict((name, array(typecode))
+                       for name, typecode, _ in fields)
+        for x in range(count):
+            row = struct.unpack_from(row_format, self.__data,
+                                     offset + x * row_size)
+            for name, value in zip(field_names, row):
+                columns[name].append(value)
+        return columns
+
+    def program(self, x):
+        """ Return the name, the columns and the blob of program x. """
+        name, rows, count, blob, blob_size = self.__programs[x]
+        return name, self.__rows(rows, count), self.__bytes(blob, blob_size)
+
+    def columns(self):
+        """
+        Return the rows of every program in one set of columns, and the
+        index of the first row of each program. The offsets in the rows
+        stay relative to the blob of their own program.
+        """
+        starts = array('l')
+        parts = []
+        total = 0
+        for name, rows, count, _, _ in self.__programs:
+            starts.append(total)
+            parts.append(self.__rows(rows, count))
+            total += count
+
+        if numpy is not None:
+            if len(parts) == 0:
+                return numpy.zeros(0, dtype=dtype()), starts
+            return numpy.concatenate(parts), starts
+        columns = dict((name, array(typecode))
+                       for name, typecode, _ in fields)
+        for part in parts:
+            for name in field_names:
+                columns[name].extend(part[name])
+        return columns, starts
+
+    def close(self):
+        if self.__file is not None:
+            self.__data.close()
+            self.__file.close()
+        # the arrays already returned keep the memmap open
+        self.__data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,338 @@
+"""
+Estimate the cost of running an assembled program without running it.
+
+The instructions from the second pass are split into basic blocks at the
+targets of J, JEQ, JGT, JLT and JSUB and after every jump and RSUB, and
+the blocks are joined into a control flow graph. Each JSUB target starts
+a subroutine, which owns the blocks it reaches without calling, and a
+jump back to a block on the current path of a depth first search is a
+loop. Every step is linear in the number of instructions, except for
+sorting the loops and picking the hot spots, which is n log top.
+
+The cost of an instruction comes from a CostTable: the cycles of its
+opcode, the extra cycles of its addressing mode, and its memory accesses,
+which are counted in 3 byte words. Fetching a format 4 instruction takes
+two words and an indirect operand takes one more, so the report shows
+what format 4 and indirect addressing cost. A block inside loops is
+weighted by loop_weight for each loop around it.
+"""
+import heapq
+import json
+
+from sic_assembler.instructions import Format, flag_table, op_table
+
+
+jumps = ('J', 'JEQ', 'JGT', 'JLT')
+conditional_jumps = ('JEQ', 'JGT', 'JLT')
+
+# Cycles of the opcodes which take longer than format_cycles
+default_cycles = {'ADDF': 3, 'COMPF': 3, 'DIV': 6, 'DIVF': 8, 'DIVR': 6,
+                  'FIX': 2, 'FLOAT': 2, 'HIO': 10, 'MULF': 5, 'MULR': 4,
+                  'NORM': 2, 'RD': 10, 'SHIFTL': 2, 'SHIFTR': 2, 'SIO': 10,
+                  'SUBF': 3, 'SVC': 10, 'TD': 10, 'TIO': 10, 'WD': 10}
+default_format_cycles = {1: 1, 2: 1, 3: 1, 4: 1}
+# Extra cycles to compute the target address in each addressing mode
+default_mode_cycles = {'simple': 0, 'immediate': 0, 'indirect': 1,
+                       'indexed': 1, 'pc': 0, 'base': 0, 'extended': 0}
+# Instructions with a 6 byte floating point operand, two words
+wide_operands = ('ADDF', 'COMPF', 'DIVF', 'LDF', 'MULF', 'STF', 'SUBF')
+
+
+class CostTable(object):
+    """
+    The cost of each instruction: the cycles of its opcode (or of its
+    format if the opcode isn't in cycles), the cycles added by each
+    addressing mode it uses, and access_cycles for each memory access.
+    """
+    def __init__(self, cycles=None, format_cycles=None, mode_cycles=None,
+                 access_cycles=1):
+        self.cycles = dict(default_cycles)
+        self.cycles.update(cycles or {})
+        self.format_cycles = dict(default_format_cycles)
+        self.format_cycles.update(format_cycles or {})
+        self.mode_cycles = dict(default_mode_cycles)
+        self.mode_cycles.update(mode_cycles or {})
+        self.access_cycles = access_cycles
+
+    def cost(self, encoded, instruction_format):
+        """ Return the cycles and the memory accesses of an instruction. """
+        mnemonic = encoded.mnemonic
+        cycles = self.cycles.get(mnemonic,
+                                 self.format_cycles[instruction_format])
+        # fetching the instruction, a format 4 instruction spans two words
+        accesses = 2 if instruction_format == 4 else 1
+
+        if instruction_format >= 3:
+            for mode in modes(encoded.flags):
+                cycles += self.mode_cycles[mode]
+            operands = op_table[mnemonic].operands
+            if operands is not None and 'm' in operands:
+                accesses += operand_accesses(mnemonic, encoded.flags)
+
+        return cycles + accesses * self.access_cycles, accesses
+
+
+def modes(flags):
+    """ Return the addressing modes of the nixbpe flags of an instruction. """
+    n, i = flags & flag_table['n'], flags & flag_table['i']
+    if n and not i:
+        result = ['indirect']
+    elif i and not n:
+        result = ['immediate']
+    else:
+        result = ['simple']
+    if flags & flag_table['x']:
+        result.append('indexed')
+    if flags & flag_table['b']:
+        result.append('base')
+    if flags & flag_table['p']:
+        result.append('pc')
+    if flags & flag_table['e']:
+        result.append('extended')
+    return result
+
+
+def operand_accesses(mnemonic, flags):
+    """ Return the memory accesses for the operand of an instruction. """
+    n, i = flags & flag_table['n'], flags & flag_table['i']
+    if mnemonic in jumps or mnemonic == 'JSUB':
+        # the target is the new PC, only an indirect one is read
+        return 1 if n and not i else 0
+    if i and not n:
+        return 0
+    words = 2 if mnemonic in wide_operands else 1
+    if n and not i:
+        # the address of the operand is read first
+        return 1 + words
+    return words
+
+
+def jump_target(encoded):
+    """ Return the address a jump goes to, or None if it isn't known. """
+    flags = encoded.flags
+    if flags & flag_table['x'] or (flags & flag_table['n'] and
+                                   not flags & flag_table['i']):
+        return None
+    return encoded.target
+
+
+class Block(object):
+    """ A basic block: instructions which always run one after the other. """
+    __slots__ = ('start', 'end', 'instructions', 'cycles', 'accesses',
+                 'format4', 'indirect', 'successors', 'calls', 'subroutine',
+                 'depth', 'weighted')
+
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.instructions = 0
+        self.cycles = 0
+        self.accesses = 0
+        self.format4 = 0
+        self.indirect = 0
+        self.successors = []
+        self.calls = []
+        self.subroutine = None
+        self.depth = 0
+        self.weighted = 0
+
+    def report(self, names):
+        return {'start': self.start, 'end': self.end,
+                'label': names.get(self.start),
+                'instructions': self.instructions, 'cycles': self.cycles,
+                'accesses': self.accesses, 'format4': self.format4,
+                'indirect': self.indirect, 'successors': self.successors,
+                'calls': self.calls, 'subroutine': self.subroutine,
+                'loop_depth': self.depth, 'weighted': self.weighted}
+
+
+def build_blocks(generated_objects, entry, table):
+    """
+    Split the instructions into basic blocks and cost them. Returns the
+    blocks in address order and the count of jumps whose target isn't
+    known.
+    """
+    instructions = []
+    for location, output in generated_objects:
+        if isinstance(output, Format):
+            instructions.append((location, len(output), output.encode()))
+        else:
+            # data ends a block, nothing falls through it
+            instructions.append((location, 0, None))
+
+    leaders = set()
+    if entry is not None:
+        leaders.add(entry)
+    for location, size, encoded in instructions:
+        if encoded is None:
+            continue
+        if encoded.mnemonic in jumps or encoded.mnemonic == 'JSUB':
+            target = jump_target(encoded)
+            if target is not None:
+                leaders.add(target)
+        if encoded.mnemonic in jumps or encoded.mnemonic in ('JSUB', 'RSUB'):
+            leaders.add(location + size)
+
+    blocks = []
+    unknown = 0
+    block = None
+    for location, size, encoded in instructions:
+        if encoded is None:
+            block = None
+            continue
+        if block is not None and location in leaders:
+            block.successors.append(location)
+            block = None
+        if block is None:
+            block = Block(location)
+            blocks.append(block)
+
+        cycles, accesses = table.cost(encoded, size)
+        block.end = location + size
+        block.instructions += 1
+        block.cycles += cycles
+        block.accesses += accesses
+        if size == 4:
+            block.format4 += 1
+        if size >= 3 and 'indirect' in modes(encoded.flags):
+            block.indirect += 1
+
+        mnemonic = encoded.mnemonic
+        if mnemonic in jumps or mnemonic in ('JSUB', 'RSUB'):
+            target = jump_target(encoded) if mnemonic != 'RSUB' else None
+            if mnemonic != 'RSUB' and target is None:
+                unknown += 1
+            if mnemonic == 'JSUB':
+                if target is not None:
+                    block.calls.append(target)
+                block.successors.append(location + size)
+            elif mnemonic in jumps:
+                if target is not None:
+                    block.successors.append(target)
+                if mnemonic in conditional_jumps:
+                    block.successors.append(location + size)
+            block = None
+
+    # only keep the edges to instructions
+    starts = set(x.start for x in blocks)
+    for block in blocks:
+        block.successors = [x for x in block.successors if x in starts]
+        block.calls = [x for x in block.calls if x in starts]
+    return blocks, unknown
+
+
+def find_loops(blocks, index, entries):
+    """
+    Give each block to the first subroutine which reaches it, and find
+    the jumps back to a block on the path of a depth first search. The
+    jumps back to the same block are one loop. Marks the loop depth of
+    each block and returns the header and the blocks jumping back of each
+    loop.
+    """
+    latches = dict()
+    state = [0] * len(blocks)
+    for entry in entries:
+        if state[index[entry]] != 0:
+            continue
+        state[index[entry]] = 1
+        stack = [(index[entry], iter(blocks[index[entry]].successors))]
+        blocks[index[entry]].subroutine = entry
+        while len(stack) > 0:
+            x, successors = stack[-1]
+            for successor in successors:
+                y = index[successor]
+                if state[y] == 0:
+                    state[y] = 1
+                    blocks[y].subroutine = entry
+                    stack.append((y, iter(blocks[y].successors)))
+                    break
+                elif state[y] == 1:
+                    latches.setdefault(y, []).append(x)
+            else:
+                state[x] = 2
+                stack.pop()
+
+    # a loop covers the blocks from its header to the last jump back
+    loops = sorted(latches.items())
+    depth = [0] * (len(blocks) + 1)
+    for header, latch in loops:
+        low, high = min(header, min(latch)), max(header, max(latch))
+        depth[low] += 1
+        depth[high + 1] -= 1
+    running = 0
+    for x, block in enumerate(blocks):
+        running += depth[x]
+        block.depth = running
+    return loops
+
+
+def estimate(generated_objects, symtab=None, entry=None, table=None,
+             loop_weight=10, top=10):
+    """
+    Estimate the cost of the objects from the second pass of a program.
+    The entry address is where the program starts, the first instruction
+    if it is None. Returns a report of the blocks, the subroutines, the
+    loops and the top hot spots, the blocks with the highest weighted
+    cost.
+    """
+    if table is None:
+        table = CostTable()
+    names = dict()
+    for name, value in (symtab or {}).items():
+        names.setdefault(int(str(value), 16), name)
+
+    blocks, unknown = build_blocks(generated_objects, entry, table)
+    index = dict((block.start, x) for x, block in enumerate(blocks))
+
+    entries = []
+    if entry in index:
+        entries.append(entry)
+    elif len(blocks) > 0:
+        entries.append(blocks[0].start)
+    for block in blocks:
+        entries.extend(block.calls)
+    loops = find_loops(blocks, index, entries)
+
+    subroutines = dict()
+    for block in blocks:
+        block.weighted = block.cycles * loop_weight ** block.depth
+        if block.subroutine is None:
+            continue
+        subroutine = subroutines.get(block.subroutine)
+        if subroutine is None:
+            subroutine = subroutines[block.subroutine] = {
+                'entry': block.subroutine,
+                'label': names.get(block.subroutine),
+                'blocks': 0, 'instructions': 0, 'cycles': 0, 'accesses': 0,
+                'format4': 0, 'indirect': 0, 'weighted': 0, 'loops': 0,
+                'calls': []}
+        subroutine['blocks'] += 1
+        subroutine['instructions'] += block.instructions
+        subroutine['cycles'] += block.cycles
+        subroutine['accesses'] += block.accesses
+        subroutine['format4'] += block.format4
+        subroutine['indirect'] += block.indirect
+        subroutine['weighted'] += block.weighted
+        subroutine['calls'].extend(block.calls)
+    for header, latch in loops:
+        subroutines[blocks[header].subroutine]['loops'] += 1
+
+    hot_spots = heapq.nlargest(top, blocks, key=lambda x: x.weighted)
+    return {'blocks': [x.report(names) for x in blocks],
+            'subroutines': sorted(subroutines.values(),
+                                  key=lambda x: x['entry']),
+            'loops': [{'header': blocks[header].start,
+                       'latches': [blocks[x].start for x in latch],
+                       'label': names.get(blocks[header].start)}
+                      for header, latch in loops],
+            'hot_spots': [x.report(names) for x in hot_spots],
+            'unreachable': sum(1 for x in blocks if x.subroutine is None),
+            'unknown_targets': unknown,
+            'cycles': sum(x.cycles for x in blocks),
+            'weighted': sum(x.weighted for x in blocks)}
+
+
+def write_report(report, out):
+    """ Write a report as JSON. """
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write('\n')
@@ -0,0 +1,220 @@
+import mmap
+import struct
+from bisect import bisect_left, bisect_right
+
+from sic_assembler.arrays import array_bytes
+from sic_assembler.dispatch import dispatch_table
+from sic_assembler.errors import RecordError
+from sic_assembler.instructions import immediate, indexed, indirect, literal
+from sic_assembler.layout import line_sizes
+
+
+# Layout of the file, all values are little endian:
+#
+#   header      magic, version, and the count of each section
+#   addresses   uint32 address of each line, sorted
+#   lines       uint32 source line number of each line
+#   sym_addrs   uint32 address of each label, sorted
+#   sym_index   uint32 symbol number of each label
+#   symbols     per symbol, sorted by name: uint32 name offset, uint32 name
+#               length, int32 address, uint32 first cross reference, uint32
+#               count of cross references
+#   xrefs       uint32 address of each use of a symbol, grouped by symbol
+#   strings     the symbol names
+magic = b'SICD'
+version = 1
+header_format = '<4sHHIIIII'
+header_size = struct.calcsize(header_format)
+symbol_format = '<IIiII'
+symbol_size = struct.calcsize(symbol_format)
+
+
+def operand_symbol(operand):
+    """ Return the symbol referenced by an operand, or None. """
+    if operand is None or literal(operand):
+        return None
+    if indexed(operand):
+        operand = operand[:len(operand)-2]
+    if indirect(operand) or immediate(operand):
+        operand = operand[1:]
+    return operand
+
+
+def write_debug_info(out, temp_contents, symtab, end_address):
+    """
+    Write the debug information for an assembled program to a binary file
+    object.
+    """
+    sizes = line_sizes(temp_contents, end_address)
+
+    addresses, lines = [], []
+    uses = dict()
+    for source_line, size in zip(temp_contents, sizes):
+        if size > 0:
+            addresses.append(source_line.location)
+            # line numbers in the source file start at 1, after START
+            lines.append(source_line.line_number + 2)
+
+        entry = dispatch_table.get(source_line.mnemonic)
+        if entry is not None and (entry.format in (3, 4) or
+                                  entry.name == 'BASE'):
+            symbol = operand_symbol(source_line.operand)
+            if symbol in symtab:
+                uses.setdefault(symbol, []).append(source_line.location)
+
+    names = sorted(symtab)
+    numbers = dict((name, x) for x, name in enumerate(names))
+    # symbols defined with EQU are values, not places in the program
+    equates = set(source_line.label for source_line in temp_contents
+                  if source_line.mnemonic == 'EQU')
+    labels = sorted((int(str(symtab[name]), 16), numbers[name])
+                    for name in names if name not in equates and
+                    int(str(symtab[name]), 16) >= 0)
+
+    strings = []
+    string_offset = 0
+    xrefs = []
+    symbols = []
+    for name in names:
+        encoded = name.encode()
+        symbol_uses = uses.get(name, [])
+        symbols.append(struct.pack(symbol_format, string_offset, len(encoded),
+                                   int(str(symtab[name]), 16), len(xrefs),
+                                   len(symbol_uses)))
+        xrefs.extend(symbol_uses)
+        strings.append(encoded)
+        string_offset += len(encoded)
+
+    out.write(struct.pack(header_format, magic, version, 0, len(addresses),
+                          len(labels), len(names), len(xrefs), string_offset))
+    out.write(array_bytes(addresses, 'I'))
+    out.write(array_bytes(lines, 'I'))
+    out.write(array_bytes([x[0] for x in labels], 'I'))
+    out.write(array_bytes([x[1] for x in labels], 'I'))
+    out.write(b''.join(symbols))
+    out.write(array_bytes(xrefs, 'I'))
+    out.write(b''.join(strings))
+
+
+class _Column(object):
+    """ A read only sequence of uint32 values in the file, for bisect. """
+    def __init__(self, data, offset, count):
+        self.__data = data
+        self.__offset = offset
+        self.__count = count
+
+    def __getitem__(self, x):
+        if not 0 <= x < self.__count:
+            raise IndexError(x)
+        return struct.unpack_from('<I', self.__data, self.__offset + 4*x)[0]
+
+    def __len__(self):
+        return self.__count
+
+
+class _SymbolNames(object):
+    """ The sorted symbol names in the file, for bisect. """
+    def __init__(self, debug_info):
+        self.__debug_info = debug_info
+
+    def __getitem__(self, x):
+        return self.__debug_info.symbol(x)[0]
+
+    def __len__(self):
+        return self.__debug_info.symbol_count
+
+
+class DebugInfo(object):
+    """
+    Query a debug information file. The file is memory mapped and every
+    lookup is a bisect over the sorted sections, so nothing is loaded.
+    """
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__data = mmap.mmap(self.__file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+
+        (file_magic, file_version, _, line_count, label_count,
+         symbol_count, xref_count, strings_size) = \
+            struct.unpack_from(header_format, self.__data, 0)
+        if file_magic != magic or file_version != version:
+            raise RecordError(message="Not a debug information file: " +
+                              str(path))
+
+        offset = header_size
+        self.__addresses = _Column(self.__data, offset, line_count)
+        offset += 4 * line_count
+        self.__lines = _Column(self.__data, offset, line_count)
+        offset += 4 * line_count
+        self.__label_addresses = _Column(self.__data, offset, label_count)
+        offset += 4 * label_count
+        self.__label_symbols = _Column(self.__data, offset, label_count)
+        offset += 4 * label_count
+        self.__symbols_offset = offset
+        self.symbol_count = symbol_count
+        offset += symbol_size * symbol_count
+        self.__xrefs = _Column(self.__data, offset, xref_count)
+        offset += 4 * xref_count
+        self.__strings_offset = offset
+
+        self.__names = _SymbolNames(self)
+
+    def symbol(self, x):
+        """ Return the name, address and cross references of symbol x. """
+        (name_offset, name_length, address, xref_start, xref_count) = \
+            struct.unpack_from(symbol_format, self.__data,
+                               self.__symbols_offset + symbol_size * x)
+        start = self.__strings_offset + name_offset
+        name = self.__data[start:start+name_length].decode()
+        return name, address, xref_start, xref_count
+
+    def line_at(self, address):
+        """ Return the source line number of the code at an address. """
+        x = bisect_right(self.__addresses, address) - 1
+        if x < 0:
+            return None
+        return self.__lines[x]
+
+    def symbol_at(self, address):
+        """
+        Return the closest label at or before an address and the offset of
+        the address from it, or None.
+        """
+        x = bisect_right(self.__label_addresses, address) - 1
+        if x < 0:
+            return None
+        name = self.symbol(self.__label_symbols[x])[0]
+        return name, address - self.__label_addresses[x]
+
+    def __find(self, name):
+        x = bisect_left(self.__names, name)
+        if x < self.symbol_count:
+            symbol = self.symbol(x)
+            if symbol[0] == name:
+                return symbol
+        return None
+
+    def address_of(self, name):
+        """ Return the address of a symbol, or None. """
+        symbol = self.__find(name)
+        if symbol is not None:
+            return symbol[1]
+        return None
+
+    def uses_of(self, name):
+        """ Return the addresses of the instructions which use a symbol. """
+        symbol = self.__find(name)
+        if symbol is None:
+            return []
+        start, count = symbol[2], symbol[3]
+        return [self.__xrefs[x] for x in range(start, start + count)]
+
+    def close(self):
+        self.__data.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
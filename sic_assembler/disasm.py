@@ -0,0 +1,428 @@
+import binascii
+from bisect import bisect_right
+
+from sic_assembler.errors import LineFieldsError
+from sic_assembler.instructions import op_table, registers_table
+
+
+def build_opcode_table():
+    """
+    Build a table with an entry for each of the 256 values of the first
+    byte of an instruction. Format 3/4 instructions take the entries for
+    each combination of the n and i bits (n=i=0 is a SIC instruction, which
+    is not supported by the assembler).
+    """
+    table = [None] * 256
+    for mnemonic, instr in op_table.items():
+        opcode = int(instr.opcode, 16)
+        if instr.format == 3:
+            for ni in (1, 2, 3):
+                table[opcode | ni] = (mnemonic, 3, instr.operands)
+        else:
+            table[opcode] = (mnemonic, instr.format, instr.operands)
+    return table
+
+
+# Decoding table indexed by the first byte of an instruction
+opcode_table = build_opcode_table()
+
+# Register names indexed by register number
+register_names = dict((v, k) for k, v in registers_table.items())
+
+# Prefix of the operand for each combination of the n and i bits
+ni_prefix = {1: '#', 2: '@', 3: ''}
+
+
+class Line(object):
+    """
+    A single decoded line. Data lines have a mnemonic of None. Lines with a
+    symbolic operand keep the target address until labels are assigned.
+    """
+    __slots__ = ('address', 'size', 'mnemonic', 'operand', 'target',
+                 'suffix', 'base_disp', 'sets_base')
+
+    def __init__(self, address, size, mnemonic=None, operand=None,
+                 target=None, suffix='', base_disp=None):
+        self.address = address
+        self.size = size
+        self.mnemonic = mnemonic
+        # operand text, or the prefix of a symbolic operand
+        self.operand = operand
+        # target address of a symbolic operand
+        self.target = target
+        self.suffix = suffix
+        # displacement of a base relative operand until it is resolved
+        self.base_disp = base_disp
+        # True for an LDB which loads the address of a label
+        self.sets_base = False
+
+    def demote(self):
+        """ Turn the line into data. """
+        self.mnemonic = None
+        self.operand = None
+        self.target = None
+        self.base_disp = None
+        self.sets_base = False
+
+    def __repr__(self):
+        return "<Line: %s, %s, %s, %s>" % (hex(self.address), self.mnemonic,
+                                           self.operand, self.target)
+
+
+def decode(code, address):
+    """
+    Decode a contiguous block of object code starting at address into a
+    list of lines. Bytes which can't be decoded into an instruction the
+    assembler would generate in the same way become data lines.
+    """
+    table = opcode_table
+    registers = register_names
+    prefixes = ni_prefix
+    lines = []
+    append = lines.append
+    data = None  # the data line being extended
+
+    x = 0
+    n = len(code)
+    while x < n:
+        op = code[x]
+        entry = table[op]
+        location = address + x
+        line = None
+
+        if entry is not None:
+            mnemonic, fmt, operands = entry
+            if fmt == 3:
+                if x + 2 < n:
+                    flags = code[x+1] >> 4
+                    if flags == 2 and operands is not None:
+                        # the common case: PC relative without indexing
+                        disp = ((code[x+1] & 0xF) << 8) | code[x+2]
+                        if disp >= 2048:
+                            disp -= 4096
+                        line = Line(location, 3, mnemonic, prefixes[op & 3],
+                                    location + 3 + disp)
+                    elif flags & 1:
+                        if x + 3 < n:
+                            line = decode_format_4(code, x, location,
+                                                   mnemonic, operands,
+                                                   op & 3, flags)
+                    else:
+                        line = decode_format_3(code, x, location, mnemonic,
+                                               operands, op & 3, flags)
+            elif fmt == 2:
+                if x + 1 < n:
+                    r1 = registers.get(code[x+1] >> 4)
+                    r2 = code[x+1] & 0xF
+                    if r1 is None:
+                        pass
+                    elif operands == ['r1']:
+                        if r2 == 0:
+                            line = Line(location, 2, mnemonic, r1)
+                    elif operands == ['r1', 'r2'] and r2 in registers:
+                        line = Line(location, 2, mnemonic,
+                                    r1 + ',' + registers[r2])
+            else:
+                line = Line(location, 1, mnemonic)
+
+        if line is None:
+            if data is None:
+                data = Line(location, 1)
+                append(data)
+            else:
+                data.size += 1
+            x += 1
+        else:
+            data = None
+            append(line)
+            x += line.size
+
+    return lines
+
+
+def decode_format_3(code, x, location, mnemonic, operands, ni, flags):
+    """ Decode a format 3 instruction, or return None. """
+    disp = ((code[x+1] & 0xF) << 8) | code[x+2]
+    indexed, base, pc = flags & 8, flags & 4, flags & 2
+
+    if operands is None:
+        if ni == 3 and flags == 0 and disp == 0:
+            return Line(location, 3, mnemonic)
+        return None
+    # the assembler only supports indexing with simple addressing
+    if indexed and ni != 3:
+        return None
+
+    suffix = ',X' if indexed else ''
+    if pc and not base:
+        if disp >= 2048:
+            disp -= 4096
+        return Line(location, 3, mnemonic, ni_prefix[ni],
+                    target=location + 3 + disp, suffix=suffix)
+    elif base and not pc:
+        return Line(location, 3, mnemonic, ni_prefix[ni], suffix=suffix,
+                    base_disp=disp)
+    elif not base and not pc and ni == 1 and not indexed:
+        return Line(location, 3, mnemonic, '#%d' % disp)
+    return None
+
+
+def decode_format_4(code, x, location, mnemonic, operands, ni, flags):
+    """ Decode a format 4 instruction, or return None. """
+    address = ((code[x+1] & 0xF) << 16) | (code[x+2] << 8) | code[x+3]
+
+    # the assembler only generates direct addresses without indexing
+    if flags != 1:
+        return None
+    if operands is None:
+        if ni == 3 and address == 0:
+            return Line(location, 4, '+' + mnemonic)
+        return None
+    if ni == 1:
+        return Line(location, 4, '+' + mnemonic, '#%d' % address)
+    if ni == 3:
+        return Line(location, 4, '+' + mnemonic, '', target=address)
+    return None
+
+
+def resolve_base(lines):
+    """
+    Follow the LDB instructions through the lines to resolve the targets of
+    base relative operands. Returns True if any line had to be demoted.
+    """
+    demoted = False
+    base = None
+    for line in lines:
+        if line.mnemonic is None:
+            continue
+        if line.base_disp is not None:
+            if base is None:
+                line.demote()
+                demoted = True
+                continue
+            line.target = base + line.base_disp
+            # the assembler prefers PC relative addressing when possible
+            if -2048 <= line.target - (line.address + 3) <= 2047:
+                line.demote()
+                demoted = True
+                continue
+        if line.mnemonic == 'LDB':
+            line.sets_base = line.operand == '#' and line.target is not None
+            base = line.target if line.sets_base else None
+    return demoted
+
+
+def place_labels(lines, start_address, end_address, extra_targets):
+    """
+    Demote instructions whose targets can't be given a label: outside of
+    the program, or in the middle of another instruction. Returns True if
+    any line had to be demoted.
+    """
+    starts = [line.address for line in lines]
+    line_starts = set(starts)
+    demoted = False
+
+    def labelable(target):
+        if target in line_starts:
+            return True
+        if not start_address <= target <= end_address:
+            return False
+        x = bisect_right(starts, target) - 1
+        if x < 0:
+            return True
+        line = lines[x]
+        # inside a gap or a data line
+        return line.mnemonic is None or target >= line.address + line.size
+
+    for line in lines:
+        if line.target is not None and not labelable(line.target):
+            line.demote()
+            demoted = True
+
+    for target in extra_targets:
+        if not labelable(target):
+            # the target is in the middle of an instruction
+            lines[bisect_right(starts, target) - 1].demote()
+            demoted = True
+
+    return demoted
+
+
+class Listing(object):
+    """ The result of disassembling a program. """
+    def __init__(self, name, start_address, length, entry, lines, image):
+        self.name = name
+        self.start_address = start_address
+        self.length = length
+        self.entry = entry
+        self.lines = lines
+        # maps the address of each segment to its object code
+        self.image = image
+        self.segment_starts = sorted(image)
+
+        self.labels = dict()
+        for line in lines:
+            if line.target is not None:
+                self.labels[line.target] = label_name(line.target)
+        self.labels[entry] = label_name(entry)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def source_lines(self):
+        """ Generate the lines of a source program for the listing. """
+        labels = self.labels
+        bounds = sorted(labels)
+
+        yield format_line(self.name or 'PROG', 'START',
+                          '%X' % self.start_address)
+
+        locctr = self.start_address
+        data = []
+        data_label = None
+
+        for line in self.lines:
+            if line.mnemonic is None:
+                for address in range(line.address, line.address + line.size):
+                    # start a new BYTE directive at each label
+                    if address in labels or len(data) == 30:
+                        for out in self.__data(data_label, data):
+                            yield out
+                        data = []
+                    if len(data) == 0:
+                        data_label = labels.get(address)
+                    data.append(self.__byte(address))
+                locctr = line.address + line.size
+                continue
+
+            for out in self.__data(data_label, data):
+                yield out
+            data, data_label = [], None
+
+            for out in self.__reserve(locctr, line.address, bounds):
+                yield out
+
+            label = labels.get(line.address)
+            operand = line.operand
+            if line.target is not None:
+                operand = operand + labels[line.target] + line.suffix
+            if label is not None and operand is None:
+                # a label can't be placed on a line without an operand
+                yield format_line(label, 'RESB', '0')
+                label = None
+            yield format_line(label, line.mnemonic, operand)
+            if line.sets_base:
+                yield format_line(None, 'BASE', labels[line.target])
+            locctr = line.address + line.size
+
+        for out in self.__data(data_label, data):
+            yield out
+        end_address = self.start_address + self.length
+        for out in self.__reserve(locctr, end_address, bounds):
+            yield out
+        if end_address in labels:
+            yield format_line(labels[end_address], 'RESB', '0')
+
+        yield format_line(None, 'END', labels[self.entry])
+
+    def source(self):
+        """ Return a source program for the listing as a string. """
+        return '\n'.join(self.source_lines()) + '\n'
+
+    def __byte(self, address):
+        x = bisect_right(self.segment_starts, address) - 1
+        if x >= 0:
+            start = self.segment_starts[x]
+            code = self.image[start]
+            if address < start + len(code):
+                return code[address - start]
+        raise LineFieldsError(message="Address out of the object code: " +
+                              hex(address))
+
+    def __data(self, label, data):
+        if len(data) > 0:
+            hex_value = ''.join(['%02X' % byte for byte in data])
+            yield format_line(label, 'BYTE', "X'%s'" % hex_value)
+
+    def __reserve(self, locctr, address, bounds):
+        """ Reserve the gap between locctr and address, split at labels. """
+        while locctr < address:
+            x = bisect_right(bounds, locctr)
+            if x < len(bounds):
+                size = min(bounds[x], address) - locctr
+            else:
+                size = address - locctr
+            yield format_line(self.labels.get(locctr), 'RESB', str(size))
+            locctr += size
+
+
+def label_name(address):
+    """ Generate the name of the label for an address. """
+    return 'L%05X' % address
+
+
+def format_line(label, mnemonic, operand):
+    """ Format a line of a source program. """
+    return '%-8s%-8s%s' % (label or '', mnemonic, operand or '')
+
+
+def disassemble(image, start_address=0, name='', entry=None, length=None,
+                segments=None):
+    """
+    Disassemble a binary image loaded at start_address. A dict of segments
+    mapping addresses to object code can be given instead, for programs
+    with gaps. Returns a Listing.
+    """
+    if segments is None:
+        segments = {start_address: bytearray(image)}
+    if length is None:
+        length = max(a + len(c) for a, c in segments.items()) - start_address
+    end_address = start_address + length
+    if entry is None or not start_address <= entry < end_address:
+        entry = start_address
+
+    lines = []
+    for address in sorted(segments):
+        lines.extend(decode(segments[address], address))
+
+    # demoting a line can remove an LDB, so repeat until nothing changes
+    while True:
+        demoted = resolve_base(lines)
+        demoted = place_labels(lines, start_address, end_address,
+                               [entry]) or demoted
+        if not demoted:
+            break
+
+    return Listing(name, start_address, length, entry, lines, segments)
+
+
+def disassemble_records(records):
+    """
+    Disassemble an object program from a list of H, T and E records.
+    Returns a Listing.
+    """
+    name, start_address, length, entry = '', 0, None, None
+    segments = dict()
+    last_address, last_code = None, None
+
+    for record in records:
+        record = record.strip()
+        if record.startswith('H'):
+            name = record[1:7].strip()
+            start_address = int(record[7:13], 16)
+            length = int(record[13:19], 16)
+        elif record.startswith('T'):
+            address = int(record[1:7], 16)
+            size = int(record[7:9], 16)
+            code = bytearray(binascii.unhexlify(record[9:9 + 2 * size]))
+            # merge adjacent text records into a single segment
+            if last_code is not None and \
+                    last_address + len(last_code) == address:
+                last_code.extend(code)
+            else:
+                segments[address] = code
+                last_address, last_code = address, code
+        elif record.startswith('E'):
+            entry = int(record[1:7], 16)
+
+    return disassemble(None, start_address, name, entry, length, segments)
@@ -0,0 +1,238 @@
+import binascii
+import re
+import struct
+
+from sic_assembler.errors import LineFieldsError
+from sic_assembler.expressions import operand_value
+from sic_assembler.instructions import Format1, Format2, Format3, Format4
+from sic_assembler.instructions import op_table
+
+
+class Entry(object):
+    """
+    Everything both passes need to know about one spelling of a mnemonic.
+    Entries are built once, when the module is imported.
+    """
+    __slots__ = ('mnemonic', 'name', 'opcode', 'format', 'size', 'operands',
+                 'first_pass', 'second_pass')
+
+    def __init__(self, mnemonic, name, opcode=None, format=None, size=None,
+                 operands=None, first_pass=None, second_pass=None):
+        # the spelling in the source program, like '+LDA'
+        self.mnemonic = mnemonic
+        # the mnemonic without the extended format prefix
+        self.name = name
+        # the opcode as an int, None for directives
+        self.opcode = opcode
+        # the instruction format (1-4), None for directives
+        self.format = format
+        # the size of the line in bytes, None if it depends on the operand
+        self.size = size
+        self.operands = operands
+        # called as first_pass(assembler, source_line, entry) when size is
+        # None, returns the size of the line or None at the end of the
+        # program
+        self.first_pass = first_pass
+        # called as second_pass(assembler, source_line, entry), returns the
+        # object for the line or None
+        self.second_pass = second_pass
+
+    def __repr__(self):
+        return "<Entry: %s, format=%s, size=%s>" % (self.mnemonic, self.format,
+                                                   self.size)
+
+
+def _format_1(assembler, source_line, entry):
+    return Format1(mnemonic=entry.name, opcode=entry.opcode)
+
+
+def _format_2(assembler, source_line, entry):
+    if len(entry.operands) == 2:
+        r1, r2 = source_line.operand.split(',')
+    else:
+        r1, r2 = source_line.operand, None
+    return Format2(mnemonic=entry.name, r1=r1, r2=r2, opcode=entry.opcode)
+
+
+def _format_3(assembler, source_line, entry):
+    return Format3(base=assembler.base, symtab=assembler.symtab,
+                   source_line=source_line, opcode=entry.opcode,
+                   absolute=assembler.absolute)
+
+
+def _format_4(assembler, source_line, entry):
+    return Format4(symtab=assembler.symtab, source_line=source_line,
+                   opcode=entry.opcode, absolute=assembler.absolute)
+
+
+instruction_handlers = {1: _format_1, 2: _format_2, 3: _format_3,
+                        4: _format_4}
+
+
+# The hex digits of a BYTE X'...' constant
+hex_digits = re.compile(r'(?:[0-9A-Fa-f]{2})*\Z')
+
+
+def _data_error(source_line, directive):
+    return LineFieldsError(
+            message="Invalid value for %s on line: " % directive +
+            str(source_line.line_number+2), code=1,
+            line_number=source_line.line_number+2, contents=source_line)
+
+
+def _byte_constant(source_line):
+    """
+    Return the kind of a BYTE constant, 'C' or 'X', and the text between
+    its quotes.
+    """
+    operand = source_line.operand
+    if operand is None or len(operand) < 3 or operand[0] not in 'CX' or \
+            operand[1] != "'" or operand[-1] != "'":
+        raise _data_error(source_line, 'BYTE')
+    return operand[0], operand[2:-1]
+
+
+def _characters(text):
+    """ Return the characters of a C'...' constant as bytes, one each. """
+    if isinstance(text, bytes):
+        return text
+    return text.encode('latin-1')
+
+
+def _hex(data):
+    """ Return bytes as upper case hex digits, in the native string type. """
+    value = binascii.hexlify(data).upper()
+    if isinstance(value, str):
+        return value
+    return value.decode('ascii')
+
+
+def _byte_value(source_line):
+    """ Return the hex digits of the value of a BYTE directive. """
+    kind, text = _byte_constant(source_line)
+    if kind == 'X':
+        if hex_digits.match(text) is None:
+            raise _data_error(source_line, 'BYTE')
+        return text.upper()
+    try:
+        return _hex(_characters(text))
+    except UnicodeError:
+        raise _data_error(source_line, 'BYTE')
+
+
+def _size_byte(assembler, source_line, entry):
+    # one byte for each character or each pair of hex digits
+    kind, text = _byte_constant(source_line)
+    if kind == 'X':
+        return len(text) // 2
+    return len(text)
+
+
+def _size_word(assembler, source_line, entry):
+    if source_line.operand is None:
+        raise _data_error(source_line, 'WORD')
+    return 3 * (source_line.operand.count(',') + 1)
+
+
+def _size_resw(assembler, source_line, entry):
+    return 3 * int(source_line.operand)
+
+
+def _size_resb(assembler, source_line, entry):
+    return int(source_line.operand)
+
+
+def _size_end(assembler, source_line, entry):
+    assembler.end_operand = source_line.operand
+    return None
+
+
+def _size_include(assembler, source_line, entry):
+    # the included lines are added by the assembler
+    if getattr(assembler, 'include', None) is None:
+        raise LineFieldsError(
+                message="INCLUDE can't be used here, on line: " +
+                str(source_line.line_number+2), code=1,
+                line_number=source_line.line_number+2, contents=source_line)
+    return assembler.include(source_line)
+
+
+def _size_equ(assembler, source_line, entry):
+    # the value is set once every symbol is known
+    if source_line.label is None or source_line.operand is None:
+        raise LineFieldsError(
+                message="EQU needs a label and a value on line: " +
+                str(source_line.line_number+2), code=1,
+                line_number=source_line.line_number+2, contents=source_line)
+    return 0
+
+
+def _generate_word(assembler, source_line, entry):
+    # every value is a 24 bit word, negative values in two's complement
+    try:
+        values = [int(x) for x in source_line.operand.split(',')]
+    except ValueError:
+        raise _data_error(source_line, 'WORD')
+    if len(values) > 0 and (min(values) < -(1 << 23) or
+                            max(values) >= 1 << 24):
+        raise _data_error(source_line, 'WORD')
+    # pack every value as a 32 bit word at once, then drop the high byte
+    # of each
+    data = bytearray(struct.pack('>%ii' % len(values), *values))
+    del data[0::4]
+    return (source_line.mnemonic, source_line.operand, _hex(bytes(data)))
+
+
+def _generate_byte(assembler, source_line, entry):
+    return (source_line.mnemonic, source_line.operand,
+            _byte_value(source_line))
+
+
+def _generate_base(assembler, source_line, entry):
+    assembler.base = operand_value(source_line.operand, assembler.symtab,
+                                   source_line.location)
+
+
+def _generate_nobase(assembler, source_line, entry):
+    assembler.base = None
+
+
+def build_dispatch_table():
+    """
+    Build the dispatch table: every accepted spelling of a mnemonic, with
+    and without the '+' prefix for format 3/4 instructions, and every
+    directive.
+    """
+    table = dict()
+
+    for name, instr in op_table.items():
+        opcode = int(instr.opcode, 16)
+        formats = [(name, instr.format)]
+        if instr.format == 3:
+            formats.append(('+' + name, 4))
+        for mnemonic, format in formats:
+            table[mnemonic] = Entry(mnemonic, name, opcode, format,
+                                    size=format, operands=instr.operands,
+                                    second_pass=instruction_handlers[format])
+
+    directives = [('WORD', None, _size_word, _generate_word),
+                  ('BYTE', None, _size_byte, _generate_byte),
+                  ('RESW', None, _size_resw, None),
+                  ('RESB', None, _size_resb, None),
+                  ('EQU', None, _size_equ, None),
+                  ('BASE', 0, None, _generate_base),
+                  ('NOBASE', 0, None, _generate_nobase),
+                  # read by sic_assembler.linkage before pass 2
+                  ('EXTDEF', 0, None, None),
+                  ('EXTREF', 0, None, None),
+                  ('END', None, _size_end, None),
+                  ('INCLUDE', None, _size_include, None)]
+    for name, size, first_pass, second_pass in directives:
+        table[name] = Entry(name, name, size=size, first_pass=first_pass,
+                            second_pass=second_pass)
+
+    return table
+
+
+# Entries keyed by every accepted spelling of a mnemonic
+dispatch_table = build_dispatch_table()
@@ -0,0 +1,104 @@
+"""
+Assemble many programs at once from a pool of threads.
+
+What is shared between jobs, and what isn't:
+
+- The tables are built when their module is imported and are never
+  changed afterwards, so every thread reads them without a lock:
+  instructions.op_table, flag_table and registers_table,
+  dispatch.dispatch_table, peephole.default_rules and the rules in it.
+- The cache of compiled expressions in sic_assembler.expressions is shared
+  and filled while assembling. An entry only depends on the text of the
+  expression and is never changed once it is stored, so two threads which
+  compile the same text store equal expressions, and a reader always sees
+  a complete one. The cache of parsed INCLUDE files in
+  sic_assembler.includes works the same way, an entry is replaced when
+  the file changes, never changed in place.
+- Each Engine has a LineCache of the fields of the lines its jobs parsed,
+  by the text of the line. An entry is a tuple which is never changed, so
+  it is shared the same way. A job makes its own SourceLine from it.
+- The Limits given to an Engine are only read. Each job starts its own
+  clock for the time limit when its Assembler is made.
+- Everything else belongs to one job: the Assembler, its source lines,
+  symbol table, instruction objects and records. An Assembler must not be
+  used by two threads at once, an Engine makes a new one for each call.
+
+The memory profile starts and stops tracemalloc for the whole process and
+the parallel pass 1 starts worker processes, so an Engine uses neither.
+"""
+from sic_assembler.assembler import Assembler, SourceLine
+from sic_assembler.limits import Limits, exceeded
+
+
+# Most lines a LineCache remembers, so a long running engine fed programs
+# which share no lines doesn't grow without end
+max_cached_lines = 100000
+
+
+class LineCache(object):
+    """
+    The label, mnemonic and operand of the lines parsed by the jobs of an
+    Engine, by the text of the line. Generated programs repeat the same
+    lines many times, so most lines are only split once for all the jobs.
+    A line which can't be parsed is never cached, its error is raised by
+    every job with its own line number.
+    """
+    def __init__(self, size=max_cached_lines):
+        self.__size = size
+        self.__fields = dict()
+
+    def __len__(self):
+        return len(self.__fields)
+
+    def parse(self, line, line_number):
+        """ Return a new SourceLine for a line, like SourceLine.parse. """
+        fields = self.__fields.get(line)
+        if fields is not None:
+            return SourceLine(line_number, *fields)
+        source_line = SourceLine.parse(line, line_number)
+        if len(self.__fields) < self.__size:
+            self.__fields[line] = (source_line.label, source_line.mnemonic,
+                                   source_line.operand)
+        return source_line
+
+
+class Engine(object):
+    """
+    Assemble programs with the same options. The engine holds its options,
+    which can't be changed, and the lines its jobs parsed, which are shared
+    by every later job. One engine can be called from any number of
+    threads at once.
+    """
+    def __init__(self, relax=False, peephole=False, relocatable=False,
+                 include_paths=(), limits=None, auto_base=False):
+        self.__options = (('relax', relax), ('auto_base', auto_base),
+                          ('peephole', peephole),
+                          ('relocatable', relocatable),
+                          ('include_paths', tuple(include_paths)),
+                          ('limits', limits))
+        self.lines = LineCache()
+
+    @property
+    def options(self):
+        return dict(self.__options)
+
+    def __limits(self):
+        limits = self.options['limits']
+        return limits if limits is not None else Limits()
+
+    def job(self, source):
+        """
+        Return a new Assembler for a source program, a string or a list of
+        lines without line endings, which only this job uses.
+        """
+        if isinstance(source, str) or isinstance(source, type(u'')):
+            limits = self.__limits()
+            if len(source) > limits.bound('source_bytes'):
+                exceeded('source_bytes', limits.source_bytes)
+            source = source.splitlines()
+        return Assembler.from_lines(source, parse=self.lines.parse,
+                                    **self.options)
+
+    def assemble(self, source):
+        """ Assemble a source program and return its records. """
+        return self.job(source).assemble()
@@ -30,3 +30,28 @@ class OpcodeLookupError(BaseError):
 class UndefinedSymbolError(BaseError):
     def __init__(self, *args, **kwargs):
         super(UndefinedSymbolError, self).__init__(*args, **kwargs)
+
+
+class RecordError(BaseError):
+    def __init__(self, *args, **kwargs):
+        super(RecordError, self).__init__(*args, **kwargs)
+
+
+class ExpressionError(BaseError):
+    def __init__(self, *args, **kwargs):
+        super(ExpressionError, self).__init__(*args, **kwargs)
+
+
+class CircularDefinitionError(BaseError):
+    def __init__(self, *args, **kwargs):
+        super(CircularDefinitionError, self).__init__(*args, **kwargs)
+
+
+class IncludeError(BaseError):
+    def __init__(self, *args, **kwargs):
+        super(IncludeError, self).__init__(*args, **kwargs)
+
+
+class ResourceLimitError(BaseError):
+    def __init__(self, *args, **kwargs):
+        super(ResourceLimitError, self).__init__(*args, **kwargs)
@@ -0,0 +1,228 @@
+import re
+
+from sic_assembler.errors import CircularDefinitionError, ExpressionError
+from sic_assembler.errors import UndefinedSymbolError
+
+
+# A symbol, a decimal number, the location counter or an operator
+token_pattern = re.compile(
+        r"\s*(?:([A-Za-z_][A-Za-z0-9_]*)|(\d+)|(\*)|([-+]))")
+
+# Compiled expressions keyed by their text
+_expressions = dict()
+
+
+class Expression(object):
+    """
+    A compiled operand expression: a sum of symbols, decimal numbers and
+    the location counter '*', each added or subtracted. The terms are
+    collected when the expression is compiled so evaluating it is a single
+    loop over its symbols.
+    """
+    __slots__ = ('text', 'constant', 'star', 'terms')
+
+    def __init__(self, text, constant, star, terms):
+        self.text = text
+        # sum of the numbers in the expression
+        self.constant = constant
+        # how many times the location counter is added
+        self.star = star
+        # (symbol, coefficient) pairs
+        self.terms = terms
+
+    @property
+    def symbols(self):
+        return [name for name, _ in self.terms]
+
+    def evaluate(self, symtab, location=0):
+        """
+        Return the value of the expression, or None if a symbol is not
+        defined.
+        """
+        value = self.constant + self.star * location
+        for name, coefficient in self.terms:
+            address = symtab.get(name)
+            if address is None:
+                return None
+            value += coefficient * int(str(address), 16)
+        return value
+
+    def is_absolute(self, absolute):
+        """
+        Return True if the value doesn't depend on where the program is
+        loaded, when the labels and the location counter in it cancel out.
+        The symbols in absolute are the equates with absolute values.
+        """
+        relative = self.star
+        for name, coefficient in self.terms:
+            if name not in absolute:
+                relative += coefficient
+        return relative == 0
+
+    def __repr__(self):
+        return "<Expression: %s>" % self.text
+
+
+def compile_expression(text):
+    """
+    Compile an operand expression, or return the compiled expression from
+    the cache if the same text was compiled before.
+    """
+    expression = _expressions.get(text)
+    if expression is not None:
+        return expression
+
+    constant, star = 0, 0
+    coefficients = dict()
+    order = []
+
+    sign = None
+    expect_term = True
+    position = 0
+    text = str(text)
+    while position < len(text):
+        match = token_pattern.match(text, position)
+        if match is None or match.end() == position:
+            raise ExpressionError(message="Invalid expression: " + text)
+        position = match.end()
+        symbol, number, location, operator = match.groups()
+
+        if expect_term:
+            if operator is not None:
+                # a leading sign, or a sign after another operator
+                sign = (sign or 1) * (-1 if operator == '-' else 1)
+                continue
+            if sign is None:
+                sign = 1
+            if symbol is not None:
+                if symbol not in coefficients:
+                    coefficients[symbol] = 0
+                    order.append(symbol)
+                coefficients[symbol] += sign
+            elif number is not None:
+                constant += sign * int(number)
+            else:
+                star += sign
+            sign = None
+            expect_term = False
+        else:
+            if operator is None:
+                raise ExpressionError(message="Invalid expression: " + text)
+            sign = -1 if operator == '-' else 1
+            expect_term = True
+
+    if expect_term:
+        raise ExpressionError(message="Invalid expression: " + text)
+
+    terms = tuple((name, coefficients[name]) for name in order
+                  if coefficients[name] != 0)
+    expression = Expression(text, constant, star, terms)
+    _expressions[text] = expression
+    return expression
+
+
+def operand_value(operand, symtab, location=0):
+    """
+    Return the value of a symbol or an expression as a hex string like the
+    values in the symbol table, or None if a symbol is not defined.
+    """
+    address = symtab.get(operand)
+    if address is not None:
+        return address
+    value = compile_expression(operand).evaluate(symtab, location)
+    if value is None:
+        return None
+    return hex(value)
+
+
+def absolute_operand(operand, absolute):
+    """
+    Return True if a symbol or an expression has an absolute value, one
+    which isn't an address in the program.
+    """
+    if operand in absolute:
+        return True
+    return compile_expression(operand).is_absolute(absolute)
+
+
+def resolve_equates(temp_contents, symtab):
+    """
+    Set the value of every symbol defined with EQU, and return the set of
+    those whose value is absolute rather than an address in the program.
+
+    The equates may refer to each other in any order, so they are evaluated
+    in a topological order of their dependencies: an equate is evaluated
+    once every equate it uses has a value. Each line and each dependency is
+    visited once. Raises CircularDefinitionError if the equates depend on
+    each other in a cycle.
+    """
+    equates = dict()
+    for source_line in temp_contents:
+        if source_line.mnemonic == 'EQU':
+            equates[source_line.label] = source_line
+    absolute = set()
+    if len(equates) == 0:
+        return absolute
+
+    # the equates used by each equate, and the count not evaluated yet
+    uses = dict()
+    waiting = dict()
+    dependents = dict((label, []) for label in equates)
+    ready = []
+    for label, source_line in equates.items():
+        expression = compile_expression(source_line.operand)
+        uses[label] = set(name for name in expression.symbols
+                          if name in equates)
+        waiting[label] = len(uses[label])
+        for name in uses[label]:
+            dependents[name].append(label)
+        if waiting[label] == 0:
+            ready.append(label)
+
+    while len(ready) > 0:
+        label = ready.pop()
+        source_line = equates[label]
+        expression = compile_expression(source_line.operand)
+        value = expression.evaluate(symtab, source_line.location)
+        if value is None:
+            raise UndefinedSymbolError(
+                    message='Undefined symbol on line: ' +
+                    str(source_line.line_number+2), code=1,
+                    line_number=source_line.line_number+2,
+                    contents=source_line)
+        symtab[label] = hex(value)
+        # the equates it uses are already marked
+        if expression.is_absolute(absolute):
+            absolute.add(label)
+        del waiting[label]
+        for name in dependents[label]:
+            waiting[name] -= 1
+            if waiting[name] == 0:
+                ready.append(name)
+
+    if len(waiting) > 0:
+        cycle = find_cycle(uses, waiting)
+        line_number = equates[cycle[0]].line_number + 2
+        raise CircularDefinitionError(
+                message='Circular definition of symbols: ' +
+                ' -> '.join(cycle + [cycle[0]]) + ' on line: ' +
+                str(line_number), code=1, line_number=line_number,
+                symbols=cycle)
+    return absolute
+
+
+def find_cycle(uses, remaining):
+    """
+    Return the symbols of one cycle among the equates which could not be
+    evaluated, in the order they use each other.
+    """
+    # every remaining equate uses at least one other remaining equate, so
+    # following those uses must come back to an equate already seen
+    label = min(remaining)
+    path = []
+    seen = dict()
+    while label not in seen:
+        seen[label] = len(path)
+        path.append(label)
+        label = min(name for name in uses[label] if name in remaining)
+    return path[seen[label]:]
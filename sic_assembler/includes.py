@@ -0,0 +1,89 @@
+import os
+
+from sic_assembler.errors import BaseError, IncludeError
+
+
+# Tokenized include files keyed by their real path, with the modification
+# time and size of the file when it was read. The cache is shared by every
+# assembler in the process; an entry is replaced, never changed, so threads
+# can read it without a lock.
+_cache = dict()
+# Count of the includes read from the cache and from the file
+cache_info = {'hits': 0, 'misses': 0}
+
+
+def clear_cache():
+    _cache.clear()
+    cache_info['hits'] = cache_info['misses'] = 0
+
+
+def include_name(operand):
+    """ Return the file name of an INCLUDE operand, quoted or not. """
+    if len(operand) > 1 and operand[0] == operand[-1] and operand[0] in "'\"":
+        return operand[1:-1]
+    return operand
+
+
+def find_include(name, directories):
+    """
+    Return the real path of the first file called name in a list of
+    directories, or None.
+    """
+    for directory in directories:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return os.path.realpath(path)
+    return None
+
+
+def in_file(error, filename):
+    """ Add the name of the file a line is from to an error. """
+    if 'filename' not in error.details:
+        error.details['filename'] = filename
+        error.message = "%s in %s" % (error.message, filename)
+    return error
+
+
+def tokenize_file(path, parse):
+    """
+    Parse every line of a file which isn't blank or a comment with parse,
+    and return (line_number, label, mnemonic, operand) tuples. The line
+    numbers are counted like the lines of a source program, so that the
+    line in messages is the line in the file.
+    """
+    tokens = []
+    with open(path, 'r') as f:
+        for index, line in enumerate(f):
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('.'):
+                continue
+            try:
+                source_line = parse(line.rstrip('\n'), index - 1)
+            except BaseError as e:
+                raise in_file(e, path)
+            tokens.append((source_line.line_number, source_line.label,
+                           source_line.mnemonic, source_line.operand))
+    return tuple(tokens)
+
+
+def load_include(path, parse):
+    """
+    Return the tokens of an include file, from the cache unless the file
+    changed since it was read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise IncludeError(message="The include file can't be read: " + path,
+                           code=1, filename=path)
+    key = (stat.st_mtime, stat.st_size)
+
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == key:
+        cache_info['hits'] += 1
+        return cached[1]
+
+    cache_info['misses'] += 1
+    tokens = tokenize_file(path, parse)
+    _cache[path] = (key, tokens)
+    return tokens
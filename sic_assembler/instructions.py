@@ -1,4 +1,8 @@
+import binascii
+from collections import namedtuple
+
 from sic_assembler.errors import InstructionError, LineFieldsError, UndefinedSymbolError
+from sic_assembler.expressions import absolute_operand, operand_value
 
 
 class Instr(object):
@@ -117,21 +121,51 @@ extended = lambda x: str(x).startswith('+')
 literal = lambda x: str(x).startswith('=')
 
 
-def to_binary(hex_string):
-    return bin(int(str(hex_string), 16))[2:]
+def lookup_opcode(mnemonic, opcode=None):
+    """ Return the opcode of a mnemonic as an int, unless it is given. """
+    if opcode is not None:
+        return opcode
+    instr = op_table.get(mnemonic)
+    if instr is None:
+        # reported when the instruction is generated
+        return None
+    return int(instr.opcode, 16)
 
 
-def twos_complement(value, length):
-    if value < 0:
-        value = (1 << length) + value
-    out_format = '{:0%ib}' % length
-    
-    return out_format.format(value)
+class Encoded(namedtuple('Encoded', ['mnemonic', 'operand', 'hex', 'target',
+                                     'flags', 'mode'])):
+    """
+    The immutable result of encoding an instruction: the object code as hex
+    digits, the resolved target address, the nixbpe flags and the
+    addressing mode ('pc', 'base', 'direct' or None without an operand).
+    """
+    __slots__ = ()
+
+    @property
+    def code(self):
+        """ The object code as bytes. """
+        return binascii.unhexlify(self.hex)
 
 
 class Format(object):
-    """ Base Instruction Format class. """
+    """
+    Base Instruction Format class. An instruction is encoded the first
+    time it is needed and the result is kept, so encoding it again is free.
+    """
+    _encoded = None
+
+    def encode(self):
+        """ Return the Encoded record for the instruction. """
+        if self._encoded is None:
+            self._encoded = self._encode()
+        return self._encoded
+
     def generate(self):
+        """ Generate the machine code for the instruction. """
+        encoded = self.encode()
+        return encoded.mnemonic, encoded.operand, encoded.hex
+
+    def _encode(self):
         raise NotImplementedError
 
 
@@ -144,21 +178,16 @@ class Format1(Format):
      ==========
 
     """
-    def __init__(self, mnemonic):
+    def __init__(self, mnemonic, opcode=None):
         self._mnemonic = mnemonic
+        self._opcode = lookup_opcode(mnemonic, opcode)
 
-    def generate(self):
-        """ Generate the machine code for the instruction. """
+    def _encode(self):
         if self._mnemonic is None:
             raise LineFieldsError(message="A mnemonic was not specified.")
 
-        output = ""
-
-        # lookup the opcode
-        opcode_lookup = op_table[self._mnemonic].opcode
-        output += str(opcode_lookup)
-
-        return self._mnemonic, None, output
+        return Encoded(self._mnemonic, None, '%02X' % self._opcode, None, 0,
+                       None)
 
     def __len__(self):
         return 1
@@ -176,35 +205,25 @@ class Format2(Format):
      ======================
 
     """
-    def __init__(self, mnemonic, r1, r2):
+    def __init__(self, mnemonic, r1, r2, opcode=None):
         self._mnemonic = mnemonic
+        self._opcode = lookup_opcode(mnemonic, opcode)
         self._r1 = r1
         self._r2 = r2
 
-    def generate(self):
-        """ Generate the machine code for the instruction. """
+    def _encode(self):
         if self._mnemonic is None:
             raise LineFieldsError(message="A mnemonic was not specified.")
 
-        output = ""
-
-        # lookup the opcode
-        opcode_lookup = op_table[self._mnemonic].opcode
-        output += str(opcode_lookup)
-
         # look up the registers
-        r1_lookup = registers_table[self._r1]
-        stripped_r1 = str(hex(r1_lookup)).lstrip("0x") or "0"
-        output += str(stripped_r1)
-
+        r1 = registers_table[self._r1]
+        r2 = 0
         if self._r2 is not None:
-            r2_lookup = registers_table[self._r2]
-            stripped_r2 = str(hex(r2_lookup)).lstrip("0x") or "0"
-            output += str(stripped_r2)
-        else:
-            output += "0"
+            r2 = registers_table[self._r2]
 
-        return self._mnemonic, (self._r1, self._r2), output
+        return Encoded(self._mnemonic, (self._r1, self._r2),
+                       '%04X' % ((self._opcode << 8) | (r1 << 4) | r2), None,
+                       0, None)
 
     def __len__(self):
         return 2
@@ -223,115 +242,112 @@ class Format3(Format):
      =================================================
 
     """
-    def __init__(self, base, symtab, source_line):
+    def __init__(self, base, symtab, source_line, opcode=None, absolute=()):
         self._base = base
         self._symtab = symtab
+        # the equates with absolute values
+        self._absolute = absolute
 
         self._location = source_line.location
         
         self._mnemonic = source_line.mnemonic
+        self._opcode = lookup_opcode(self._mnemonic, opcode)
         self._flags, self._n, self._i = determine_flags(source_line)
-        self._disp = source_line.operand
         self._line_number = source_line.line_number
         self._contents = source_line
 
-    def generate(self):
-        """ Generate the machine code for the instruction. """
+    def _encode(self):
         if self._mnemonic is None:
             raise LineFieldsError(message="A mnemonic was not specified.")
 
-        output = ""
-
-        # op
-        opcode_lookup = int(str(op_table[self._mnemonic].opcode), 16)
-
+        op = self._opcode
         if self._n:
-            opcode_lookup += 2
+            op += 2
         if self._i:
-            opcode_lookup += 1
-        op = twos_complement(opcode_lookup, 6)
-
-        is_digit = False
-        has_operands = False
-
-        if self._disp is not None and not literal(self._disp):
-            has_operands = True
-            if indexed(self._disp):
-                self._disp = self._disp[:len(self._disp)-2]
-                symbol_address = self._symtab.get(self._disp)
-            elif indirect(self._disp):
-                self._disp = self._disp[1:]
-                symbol_address = self._symtab.get(self._disp)
-            elif immediate(self._disp):
-                self._disp = self._disp[1:]
-                if str(self._disp).isdigit():
-                    symbol_address = self._disp
-                    is_digit = True
-                else:
-                    symbol_address = self._symtab.get(self._disp)
-            else:
-                symbol_address = self._symtab.get(self._contents.operand)
-                
-            if symbol_address is not None:
-                self._disp = symbol_address
-            else:
-                raise UndefinedSymbolError(
-                        message='Undefined symbol on line: ' +
-                        str(self._line_number+2), code=1,
+            op += 1
+        flags = self._flags
+
+        operand = self._contents.operand
+        target = None
+        mode = None
+
+        if operand is not None and not literal(operand):
+            value = operand_text(operand)
+            if immediate(operand) and value.isdigit():
+                operand, disp = value, int(value)
+                mode = 'direct'
+                if disp > 4095:
+                    raise InstructionError(
+                        message="Immediate value too large for format 3 " +
+                                "on line: " + str(self._line_number+2),
+                        line_number=self._line_number+2,
                         contents=self._contents)
-        #TODO: process the literal here in an elif
-        else:
-            self._disp = 0
-
-        if not is_digit and has_operands:
-            # Try PC relative then base relative, or raise an error
-            if (-2048 <= self.__pc_relative() <= 2047):
-                self._flags += flag_table['p']
-                disp = twos_complement(self.__pc_relative(), 12)
-            elif(0 <= self.__base_relative() <= 4095):
-                self._flags += flag_table['b']
-                disp = to_binary(self.__base_relative()).zfill(12)
             else:
-                raise InstructionError(
-                    message="Neither PC or Base relative addressing could " +
-                            "be used."
-                )
+                operand = operand_value(value, self._symtab, self._location)
+                if operand is None:
+                    raise UndefinedSymbolError(
+                            message='Undefined symbol on line: ' +
+                            str(self._line_number+2), code=1,
+                            line_number=self._line_number+2,
+                            contents=self._contents)
+                target = int(str(operand), 16)
+
+                # An absolute value is the displacement itself, otherwise
+                # try PC relative then base relative, or raise an error
+                disp = target - (self._location + 3)
+                absolute = absolute_operand(value, self._absolute)
+                if absolute and immediate(self._contents.operand):
+                    disp, target = target, None
+                    mode = 'direct'
+                    if not 0 <= disp <= 4095:
+                        raise InstructionError(
+                            message="Immediate value too large for " +
+                                    "format 3 on line: " +
+                                    str(self._line_number+2),
+                            line_number=self._line_number+2,
+                            contents=self._contents)
+                elif absolute and 0 <= target <= 4095:
+                    disp = target
+                    mode = 'direct'
+                elif -2048 <= disp <= 2047:
+                    flags += flag_table['p']
+                    mode = 'pc'
+                else:
+                    disp = target - self.__base()
+                    if 0 <= disp <= 4095:
+                        flags += flag_table['b']
+                        mode = 'base'
+                    else:
+                        raise InstructionError(
+                            message="Neither PC or Base relative " +
+                                    "addressing could be used on line: " +
+                                    str(self._line_number+2),
+                            line_number=self._line_number+2,
+                            contents=self._contents)
+        #TODO: process the literal here in an elif
         else:
-            disp = twos_complement(int(self._disp), 12)
+            operand, disp = 0, 0
 
-        # flags
-        flags = to_binary(hex(self._flags))
+        value = (op << 16) | (flags << 12) | (disp & 0xFFF)
+        return Encoded(self._mnemonic, operand, '%06X' % value, target,
+                       (self._n << 5) | (self._i << 4) | flags, mode)
 
-        # combine each section
-        output += op
-        output += flags.zfill(4)
-        output += disp
-
-        hex_output = hex(int(output, 2))[2:].zfill(6).upper()
-
-        return self._mnemonic, self._disp, hex_output
-
-    def __pc_relative(self):
-        """ Calculate the PC relative address. """
-        pc = int(str(self._disp), 16) - 3
-        disp = int(self._location)
-        return pc - disp
-
-    def __base_relative(self):
-        """ Calculate the Base relative address. """
+    def __base(self):
+        """ The address in the base register. """
         if self._base is None:
-            raise InstructionError(message="BASE directive not set")
-        base = int(str(self._base), 16)
-        disp = int(str(self._disp), 16)
-
-        return disp - base
+            raise InstructionError(
+                message="BASE directive not set on line: " +
+                        str(self._line_number+2),
+                line_number=self._line_number+2, contents=self._contents)
+        return int(str(self._base), 16)
 
     def __len__(self):
         return 3
 
     def __repr__(self):
-        return "<Format3: mnemonic=%s n=%s i=%s flags=%s disp=%s>" % \
-                (self._mnemonic, self._n, self._i, self._flags, self._disp)
+        return "<Format3: mnemonic=%s n=%s i=%s flags=%s operand=%s>" % \
+                (self._mnemonic, self._n, self._i, self._flags,
+                 self._contents.operand)
 
 
 class Format4(Format):
@@ -342,75 +358,86 @@ class Format4(Format):
     |   op   | n | i | x | b | p | e |          address          |
      ============================================================
     """
-    def __init__(self, symtab, source_line):
+    def __init__(self, symtab, source_line, opcode=None, absolute=()):
         self._symtab = symtab
+        # the equates with absolute values
+        self._absolute = absolute
 
         self._location = source_line.location
         
         self._mnemonic = source_line.mnemonic[1:]
+        self._opcode = lookup_opcode(self._mnemonic, opcode)
         self._flags, self._n, self._i = determine_flags(source_line)
-        self._disp = source_line.operand
         self._line_number = source_line.line_number
         self._contents = source_line
 
-    def generate(self):
-        """ Generate the machine code for the instruction. """
+    @property
+    def relocatable(self):
+        """ True if the address field holds the address of a symbol. """
+        operand = self._contents.operand
+        if operand is None or literal(operand):
+            return False
+        return not absolute_operand(operand_text(operand), self._absolute)
+
+    def _encode(self):
         if self._mnemonic is None:
             raise LineFieldsError(message="A mnemonic was not specified.")
 
-        output = ""
-
-        # op
-        opcode_lookup = int(str(op_table[self._mnemonic].opcode), 16)
-
+        op = self._opcode
         if self._n:
-            opcode_lookup += 2
+            op += 2
         if self._i:
-            opcode_lookup += 1
-        op = twos_complement(opcode_lookup, 6)
-
-        if self._disp is not None and not literal(self._disp):
-            if immediate(self._disp):
-                self._disp = self._disp[1:]
-                if str(self._disp).isdigit():
-                    symbol_address = hex(int(self._disp))[2:]
-                else:
-                    symbol_address = self._symtab.get(self._disp)
-            else:
-                symbol_address = self._symtab.get(self._disp)
+            op += 1
+
+        operand = self._contents.operand
+        target = None
+        mode = None
 
-            if symbol_address is not None:
-                self._disp = symbol_address
+        if operand is not None and not literal(operand):
+            value = operand_text(operand)
+            if immediate(operand) and value.isdigit():
+                address = int(value)
+                operand = hex(address)[2:]
             else:
-                self._disp = 0
-                raise UndefinedSymbolError(
-                        message='Undefined symbol on line: ' +
-                        str(self._line_number+1), code=1,
-                        contents=self._contents)
+                operand = operand_value(value, self._symtab, self._location)
+                if operand is None:
+                    raise UndefinedSymbolError(
+                            message='Undefined symbol on line: ' +
+                            str(self._line_number+2), code=1,
+                            line_number=self._line_number+2,
+                            contents=self._contents)
+                address = int(str(operand), 16)
+            if not 0 <= address <= 0xFFFFF:
+                raise InstructionError(
+                    message="Address out of range for format 4 on line: " +
+                            str(self._line_number+2),
+                    line_number=self._line_number+2, contents=self._contents)
+            target = address
+            mode = 'direct'
         #TODO: process the literal here in an elif
         else:
-            self._disp = 0
-
-        disp = twos_complement(int(self._disp, 16), 20)
-
-        # flags
-        flags = to_binary(hex(self._flags))
-
-        # combine each section
-        output += op
-        output += flags.zfill(4)
-        output += disp
-
-        hex_output = hex(int(output, 2))[2:].zfill(6).upper()
+            operand, address = 0, 0
 
-        return self._mnemonic, self._disp, hex_output
+        value = (op << 24) | (self._flags << 20) | address
+        return Encoded(self._mnemonic, operand, '%08X' % value, target,
+                       (self._n << 5) | (self._i << 4) | self._flags, mode)
 
     def __len__(self):
         return 4
 
     def __repr__(self):
-        return "<Format3: mnemonic=%s n=%s i=%s flags=%s disp=%s>" % \
-                (self._mnemonic, self._n, self._i, self._flags, self._disp)
+        return "<Format4: mnemonic=%s n=%s i=%s flags=%s operand=%s>" % \
+                (self._mnemonic, self._n, self._i, self._flags,
+                 self._contents.operand)
+
+
+def operand_text(operand):
+    """ Strip the addressing mode characters off an operand. """
+    if indexed(operand):
+        return operand[:len(operand)-2]
+    elif indirect(operand) or immediate(operand):
+        return operand[1:]
+    return operand
 
 
 def determine_flags(source_line):
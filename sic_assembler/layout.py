@@ -0,0 +1,40 @@
+from sic_assembler.expressions import resolve_equates
+
+
+def line_sizes(temp_contents, end_address):
+    """
+    Derive the size of every line of the intermediate file from the
+    locations assigned on the first pass.
+    """
+    sizes = []
+    for x in range(len(temp_contents) - 1):
+        sizes.append(temp_contents[x+1].location - temp_contents[x].location)
+    if len(temp_contents) > 0:
+        sizes.append(end_address - temp_contents[-1].location)
+    return sizes
+
+
+def assign_locations(temp_contents, symtab, sizes, first=0):
+    """
+    Re-assign the location of every line starting at index 'first' and
+    update the labels in the symbol table, then the symbols defined with
+    EQU. Lines before 'first' keep their locations. Returns the location
+    counter after the last line.
+    """
+    if len(temp_contents) == 0:
+        return 0
+
+    if first > 0:
+        locctr = temp_contents[first-1].location + sizes[first-1]
+    else:
+        locctr = temp_contents[0].location
+    for x in range(first, len(temp_contents)):
+        source_line = temp_contents[x]
+        source_line.location = locctr
+        if source_line.label is not None:
+            symtab[source_line.label] = hex(int(locctr))
+        locctr += sizes[x]
+
+    resolve_equates(temp_contents, symtab)
+
+    return locctr
@@ -0,0 +1,121 @@
+from timeit import default_timer as timer
+
+from sic_assembler.errors import ResourceLimitError
+
+
+# SIC/XE addresses have 20 bits, so a program ends at 1 MB at most
+address_space = 0x100000
+
+# How many lines are read between two looks at the clock
+clock_lines = 1024
+
+# Stands in for a limit which isn't set, so the hot loops can always compare
+unlimited = float('inf')
+
+
+class Limits(object):
+    """
+    The most a single program may use: the size of its source in characters
+    and in lines, the end of its address space, the number of symbols, the
+    size of its records and the wall clock time of the whole job. None means
+    no limit. Only the address space is limited by default.
+
+    A Limits only holds numbers and isn't changed by the assembler, so it
+    can be shared by an Engine's threads and sent to worker processes. Each
+    job starts its own clock with deadline().
+    """
+    def __init__(self, source_bytes=None, source_lines=None,
+                 address_space=address_space, symbols=None,
+                 output_bytes=None, seconds=None):
+        self.source_bytes = source_bytes
+        self.source_lines = source_lines
+        self.address_space = address_space
+        self.symbols = symbols
+        self.output_bytes = output_bytes
+        self.seconds = seconds
+
+    def __repr__(self):
+        return ("<Limits: source_bytes=%r, source_lines=%r, "
+                "address_space=%r, symbols=%r, output_bytes=%r, "
+                "seconds=%r>" % (self.source_bytes, self.source_lines,
+                                 self.address_space, self.symbols,
+                                 self.output_bytes, self.seconds))
+
+    def bound(self, name):
+        """ Return a limit, or a value no count reaches if it isn't set. """
+        value = getattr(self, name)
+        return unlimited if value is None else value
+
+    def deadline(self):
+        """ Return the time a job started now must end by, or None. """
+        if self.seconds is None:
+            return None
+        return timer() + self.seconds
+
+    def read(self, inputfile):
+        """
+        Read the lines of a source file like readlines(), but stop and
+        raise as soon as there are more characters or lines than allowed,
+        so an endless input is never read to its end.
+        """
+        if self.source_bytes is None and self.source_lines is None:
+            return inputfile.readlines()
+
+        max_bytes, max_lines = self.bound('source_bytes'), \
+            self.bound('source_lines')
+        lines = []
+        size = 0
+        while True:
+            if self.source_bytes is None:
+                line = inputfile.readline()
+            else:
+                # a single line without an end can't run over the limit
+                line = inputfile.readline(self.source_bytes - size + 1)
+            if len(line) == 0:
+                return lines
+            size += len(line)
+            if size > max_bytes:
+                exceeded('source_bytes', self.source_bytes,
+                         line_number=len(lines) + 1)
+            lines.append(line)
+            if len(lines) > max_lines:
+                exceeded('source_lines', self.source_lines,
+                         line_number=len(lines))
+
+    def check_time(self, deadline, line_number=None):
+        """ Raise if a job's deadline has passed. """
+        if deadline is not None and timer() > deadline:
+            exceeded('seconds', self.seconds, line_number=line_number)
+
+    def check_output(self, records):
+        """ Raise if the records, one per line, are larger than allowed. """
+        if self.output_bytes is None:
+            return
+        size = sum(len(record) + 1 for record in records)
+        if size > self.output_bytes:
+            exceeded('output_bytes', self.output_bytes)
+
+
+# How each limit is described in an error
+_descriptions = {
+    'source_bytes': 'source size of %s characters',
+    'source_lines': 'source length of %s lines',
+    'address_space': 'address space of %s bytes',
+    'symbols': 'symbol table size of %s symbols',
+    'output_bytes': 'output size of %s bytes',
+    'seconds': 'time limit of %s seconds',
+}
+
+
+def limit_error(name, maximum, line_number=None):
+    """ Return the ResourceLimitError for a limit. """
+    message = 'The ' + _descriptions[name] % maximum + ' was exceeded'
+    if line_number is not None:
+        message += ' on line: ' + str(line_number)
+    return ResourceLimitError(message=message, code=1, limit=name,
+                              maximum=maximum, line_number=line_number)
+
+
+def exceeded(name, maximum, line_number=None):
+    """ Raise a ResourceLimitError for a limit. """
+    raise limit_error(name, maximum, line_number)
@@ -0,0 +1,31 @@
+from sic_assembler.expressions import compile_expression
+from sic_assembler.instructions import literal, operand_text
+
+
+def external_symbols(temp_contents):
+    """
+    Return the names listed by the EXTDEF directives and by the EXTREF
+    directives of a control section, in the order they appear.
+    """
+    definitions, references = [], []
+    for source_line in temp_contents:
+        if source_line.mnemonic == 'EXTDEF':
+            definitions.extend(source_line.operand.split(','))
+        elif source_line.mnemonic == 'EXTREF':
+            references.extend(source_line.operand.split(','))
+    return definitions, references
+
+
+def external_terms(operand, references):
+    """
+    Return the external references used by an operand, each with the sign
+    it is added with, like '+RDREC'.
+    """
+    if operand is None or literal(operand):
+        return []
+    terms = []
+    for name, coefficient in compile_expression(operand_text(operand)).terms:
+        if name in references:
+            sign = '+' if coefficient > 0 else '-'
+            terms.extend([sign + name] * abs(coefficient))
+    return terms
@@ -0,0 +1,145 @@
+import binascii
+from array import array
+
+from sic_assembler.errors import RecordError
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Size of the SIC/XE address space
+memory_size = 1 << 20
+
+
+class LoadedProgram(object):
+    """ The result of loading an object program into memory. """
+    def __init__(self, name, load_address, length, entry, relocations):
+        self.name = name
+        self.load_address = load_address
+        self.length = length
+        self.entry = entry
+        self.relocations = relocations
+
+    def __repr__(self):
+        return "<LoadedProgram: %s, load_address=%s, length=%s>" % \
+                (self.name, hex(self.load_address), hex(self.length))
+
+
+def parse_modifications(records):
+    """
+    Collect the address and length of every modification record into two
+    arrays so they can be applied in a single batch.
+    """
+    addresses = array('l')
+    lengths = array('b')
+    for record in records:
+        if record.startswith('M'):
+            addresses.append(int(record[1:7], 16))
+            lengths.append(int(record[7:9], 16))
+    return addresses, lengths
+
+
+def relocate(memory, addresses, lengths, delta):
+    """
+    Relocate a program which was moved by delta bytes: add delta to the
+    field for each modification record, found at its address plus delta.
+    Fields are 3 bytes long; with a length of 5 half-bytes the high
+    half-byte of the first byte is left alone, with 6 the whole field is
+    relocated. All fields are updated in one batch, using NumPy when it is
+    installed.
+    """
+    for length in set(lengths):
+        if length not in (5, 6):
+            raise RecordError(message="Unsupported modification length: " +
+                              str(length))
+    if len(addresses) == 0 or delta == 0:
+        return
+    if min(addresses) + delta < 0 or max(addresses) + delta + 3 > len(memory):
+        raise RecordError(message="Modification record outside of memory")
+
+    if numpy is not None:
+        _relocate_numpy(memory, addresses, lengths, delta)
+    else:
+        _relocate_python(memory, addresses, lengths, delta)
+
+
+def _relocate_numpy(memory, addresses, lengths, delta):
+    image = numpy.frombuffer(memory, dtype=numpy.uint8)
+    addresses = numpy.frombuffer(addresses, dtype=addresses.typecode)
+    lengths = numpy.frombuffer(lengths, dtype=numpy.int8)
+
+    # a field listed more than once is relocated once per record
+    addresses, index, counts = numpy.unique(addresses, return_index=True,
+                                            return_counts=True)
+    lengths = lengths[index]
+    addresses = addresses + delta
+
+    fields = (image[addresses].astype(numpy.int64) << 16) | \
+             (image[addresses + 1].astype(numpy.int64) << 8) | \
+             image[addresses + 2]
+    masks = numpy.where(lengths == 5, 0xFFFFF, 0xFFFFFF)
+    fields = (fields & ~masks) | ((fields + delta * counts) & masks)
+
+    image[addresses] = (fields >> 16) & 0xFF
+    image[addresses + 1] = (fields >> 8) & 0xFF
+    image[addresses + 2] = fields & 0xFF
+
+
+def _relocate_python(memory, addresses, lengths, delta):
+    for address, length in zip(addresses, lengths):
+        address += delta
+        field = (memory[address] << 16) | (memory[address+1] << 8) | \
+                memory[address+2]
+        mask = 0xFFFFF if length == 5 else 0xFFFFFF
+        field = (field & ~mask) | ((field + delta) & mask)
+        memory[address] = (field >> 16) & 0xFF
+        memory[address+1] = (field >> 8) & 0xFF
+        memory[address+2] = field & 0xFF
+
+
+def load(records, load_address=None, memory=None):
+    """
+    Load an object program into memory at load_address and relocate it
+    with its modification records. The text records are copied first and
+    then every modification is applied in one batch.
+
+    Returns the memory as a bytearray and a LoadedProgram.
+    """
+    if memory is None:
+        memory = bytearray(memory_size)
+
+    name, start_address, length, entry = '', 0, 0, None
+    text = []
+    for record in records:
+        if record.startswith('H'):
+            name = record[1:7].strip()
+            start_address = int(record[7:13], 16)
+            length = int(record[13:19], 16)
+        elif record.startswith('T'):
+            text.append(record)
+        elif record.startswith('E'):
+            entry = int(record[1:7], 16)
+
+    if load_address is None:
+        load_address = start_address
+    delta = load_address - start_address
+    if load_address < 0 or load_address + length > len(memory):
+        raise RecordError(message="The program does not fit in memory at: " +
+                          hex(load_address))
+
+    for record in text:
+        address = int(record[1:7], 16) + delta
+        size = int(record[7:9], 16)
+        memory[address:address+size] = \
+            binascii.unhexlify(record[9:9+2*size].strip())
+
+    addresses, lengths = parse_modifications(records)
+    relocate(memory, addresses, lengths, delta)
+
+    if entry is not None:
+        entry += delta
+
+    return memory, LoadedProgram(name, load_address, length, entry,
+                                 len(addresses))
@@ -0,0 +1,130 @@
+import json
+import sys
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from sic_assembler.instructions import Format
+
+
+# tracemalloc is only in Python 3.4+
+available = tracemalloc is not None
+
+
+class MemoryProfile(object):
+    """
+    Record the memory allocated by each phase of the assembler with
+    tracemalloc. Tracing is started when the profile is created, unless it
+    is already running, and stopped again by report() or stop().
+    """
+    def __init__(self, top=10):
+        self.__top = top
+        self.__phases = []
+        self.__started = False
+        if available and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started = True
+
+    @contextmanager
+    def phase(self, name):
+        """ Record the peak and retained memory of the code in the block. """
+        if not available:
+            yield
+            return
+
+        before = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        yield
+        current, peak = tracemalloc.get_traced_memory()
+        self.__phases.append({'phase': name,
+                              'peak': peak,
+                              'retained': current,
+                              'allocated': current - before})
+
+    def report(self, assembler):
+        """
+        Return the report as a dict: the memory of each phase, the sources
+        which hold the most memory, the size of the assembler's objects and
+        the bytes per source line.
+        """
+        if not available:
+            return {'available': False}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__),
+                 tracemalloc.Filter(False, __file__)])
+        self.stop()
+
+        sources = []
+        for stat in snapshot.statistics('lineno')[:self.__top]:
+            frame = stat.traceback[0]
+            sources.append({'source': '%s:%d' % (frame.filename,
+                                                 frame.lineno),
+                            'size': stat.size,
+                            'count': stat.count})
+
+        lines = len(assembler.temp_contents)
+        peak = max([x['peak'] for x in self.__phases] or [0])
+        return {'available': True,
+                'phases': self.__phases,
+                'peak': peak,
+                'top_sources': sources,
+                'objects': object_sizes(assembler),
+                'lines': lines,
+                'bytes_per_line': peak // lines if lines > 0 else 0}
+
+    def stop(self):
+        """ Stop tracing, if this profile started it. """
+        if self.__started:
+            tracemalloc.stop()
+            self.__started = False
+
+
+@contextmanager
+def no_profile():
+    yield
+
+
+def phase(profile, name):
+    """ Profile a block with profile, or do nothing if it is None. """
+    if profile is None:
+        return no_profile()
+    return profile.phase(name)
+
+
+def _object_size(x):
+    size = sys.getsizeof(x)
+    if hasattr(x, '__dict__'):
+        size += sys.getsizeof(x.__dict__)
+    return size
+
+
+def object_sizes(assembler):
+    """
+    Estimate the memory held by the source lines, the instruction objects
+    and the records of an assembler.
+    """
+    source_lines = assembler.temp_contents
+    instructions = [x for _, x in assembler.generated_objects
+                    if isinstance(x, Format)]
+    records = assembler.generated_records
+
+    return {'source_lines': {'count': len(source_lines),
+                             'size': sum(_object_size(x)
+                                         for x in source_lines)},
+            'instructions': {'count': len(instructions),
+                             'size': sum(_object_size(x) +
+                                         sys.getsizeof(x.encode())
+                                         for x in instructions)},
+            'records': {'count': len(records),
+                        'size': sum(sys.getsizeof(x) for x in records)}}
+
+
+def write_report(report, out):
+    """ Write a report as JSON. """
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write('\n')
@@ -0,0 +1,177 @@
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from sic_assembler.assembler import Assembler, blank_line, comment
+from sic_assembler.errors import BaseError
+from sic_assembler.limits import Limits, limit_error
+from sic_assembler.sections import directive
+
+
+class Program(object):
+    """
+    The lines of one program in a stream, from its START to its END, or
+    the error which stopped it from being read.
+    """
+    def __init__(self, index, line_offset, lines, error=None):
+        # the number of the program in the stream, from 1
+        self.index = index
+        # line number of the first line in the whole stream
+        self.line_offset = line_offset
+        self.lines = lines
+        self.error = error
+
+    def __repr__(self):
+        return "<Program: %i, line_offset=%i, lines=%i>" % (
+                self.index, self.line_offset, len(self.lines))
+
+
+class ProgramResult(object):
+    """
+    The records of a program in a stream, or the error raised instead.
+    """
+    def __init__(self, index, name, records=None, error=None):
+        self.index = index
+        self.name = name
+        self.records = records
+        self.error = error
+
+    def __repr__(self):
+        return "<ProgramResult: %i, %s, %s>" % (
+                self.index, self.name, 'failed' if self.error else 'ok')
+
+
+def _ends_program(line, line_number):
+    """ Return True if a line is an END directive. """
+    try:
+        return directive(line, line_number, 'END') is not None
+    except BaseError:
+        # a line which can't be parsed is reported by its assembler
+        return False
+
+
+def split_programs(lines, limits=None):
+    """
+    Yield each program in a stream of lines, with or without line endings.
+    A program ends with its END directive, and the blank lines and
+    comments between two programs are skipped. Only the lines which
+    contain the text END are parsed.
+
+    The source limits apply to each program. A program over them is
+    yielded with a ResourceLimitError as soon as it runs over, and the
+    rest of its lines are skipped without being kept, up to its END.
+    """
+    if limits is None:
+        limits = Limits()
+    max_bytes = limits.bound('source_bytes')
+    max_lines = limits.bound('source_lines')
+
+    program = []
+    line_offset = 0
+    index = 0
+    size = 0
+    # True while skipping the rest of a program over the limits
+    skipping = False
+    for x, line in enumerate(lines):
+        line = line.rstrip('\r\n')
+        ends = 'END' in line and _ends_program(line, x - 1)
+        if skipping:
+            skipping = not ends
+            continue
+        if len(program) == 0:
+            if blank_line(line) or comment(line):
+                continue
+            line_offset = x
+            size = 0
+        program.append(line)
+        # the characters of the line and its end, like Limits.read
+        size += len(line) + 1
+        if size > max_bytes or len(program) > max_lines:
+            if size > max_bytes:
+                error = limit_error('source_bytes', limits.source_bytes,
+                                    line_number=x + 1)
+            else:
+                error = limit_error('source_lines', limits.source_lines,
+                                    line_number=x + 1)
+            index += 1
+            yield Program(index, line_offset, program[:1], error)
+            program = []
+            skipping = not ends
+            continue
+        if ends:
+            index += 1
+            yield Program(index, line_offset, program)
+            program = []
+    if len(program) > 0:
+        # the last program has no END
+        yield Program(index + 1, line_offset, program)
+
+
+# Put on the queue of the reader thread after the last program
+_finished = object()
+
+
+def read_ahead(programs, size=2):
+    """
+    Yield the programs of an iterator, read on a background thread which
+    stays up to size programs ahead. The next program is read while the
+    current one is assembled. An error of the reader is raised here.
+    """
+    queue = Queue(size)
+
+    def read():
+        try:
+            for program in programs:
+                queue.put((program, None))
+            queue.put((_finished, None))
+        except Exception as e:
+            queue.put((None, e))
+
+    reader = threading.Thread(target=read, name='sic-assembler-reader')
+    # the thread must not keep the process alive if the caller stops
+    reader.daemon = True
+    reader.start()
+    while True:
+        program, error = queue.get()
+        if error is not None:
+            raise error
+        if program is _finished:
+            return
+        yield program
+
+
+def assemble_program(program, **options):
+    """
+    Assemble one program of a stream, returning its result. Any error is
+    kept in the result so the next programs are still assembled.
+    """
+    first = program.lines[0].split()
+    name = first[0] if len(first) == 3 and first[1] == 'START' else None
+    if program.error is not None:
+        return ProgramResult(program.index, name, error=program.error)
+    try:
+        a = Assembler.from_lines(program.lines, program.line_offset,
+                                 **options)
+        return ProgramResult(program.index, a.program_name or name,
+                             a.assemble())
+    except BaseError as e:
+        return ProgramResult(program.index, name, error=e)
+
+
+def assemble_programs(lines, background=False, **options):
+    """
+    Assemble every program in a stream of lines one after the other, and
+    yield the result of each as soon as it is ready. The programs are
+    assembled in this process, so the tables and the caches of compiled
+    expressions and include files stay warm between them. With background
+    the next program is read on a thread while the current one is
+    assembled. The options are given to each Assembler, and its limits
+    also bound the source of each program while the stream is split.
+    """
+    programs = split_programs(lines, options.get('limits'))
+    if background:
+        programs = read_ahead(programs)
+    for program in programs:
+        yield assemble_program(program, **options)
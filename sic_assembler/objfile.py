@@ -0,0 +1,185 @@
+import binascii
+import mmap
+import os
+from array import array
+from bisect import bisect_right
+
+from sic_assembler.errors import RecordError
+
+
+class ObjectFile(object):
+    """
+    Random access reader for an object program.
+
+    The records are located the first time the reader is used, without
+    decoding them. Text records are indexed by address range so reading the
+    bytes at an address is a bisect lookup, and the other records are only
+    parsed when they are asked for. Files larger than mmap_threshold bytes
+    are memory mapped.
+    """
+    def __init__(self, path=None, data=None, mmap_threshold=1 << 20):
+        self.__file = None
+        self.__mmap = None
+
+        if data is not None:
+            self.__data = data
+        else:
+            self.__file = open(path, 'rb')
+            size = os.fstat(self.__file.fileno()).st_size
+            if size >= mmap_threshold and size > 0:
+                self.__mmap = mmap.mmap(self.__file.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+                self.__data = self.__mmap
+            else:
+                self.__data = self.__file.read()
+
+        # offsets of the records other than text records, by record type
+        self.__offsets = dict()
+        # the text record index, sorted by start address
+        self.__starts = array('l')
+        self.__ends = array('l')
+        self.__text_offsets = array('l')
+        self.__spans = None
+        self.__span_starts = None
+        self.__indexed = False
+
+    @classmethod
+    def from_records(cls, records):
+        """ Create a reader for a list of records already in memory. """
+        return cls(data=('\n'.join(records) + '\n').encode())
+
+    def __index(self):
+        """ Locate each record and index the text records by address. """
+        if self.__indexed:
+            return
+        self.__indexed = True
+
+        data = self.__data
+        size = len(data)
+        text = []
+
+        offset = 0
+        while offset < size:
+            newline = data.find(b'\n', offset)
+            if newline == -1:
+                newline = size
+            kind = data[offset:offset+1]
+            if kind == b'T':
+                try:
+                    start = int(data[offset+1:offset+7], 16)
+                    length = int(data[offset+7:offset+9], 16)
+                except ValueError:
+                    raise RecordError(message="Invalid text record at " +
+                                      "offset: " + str(offset),
+                                      offset=offset)
+                text.append((start, start + length, offset + 9))
+            elif kind.strip():
+                self.__offsets.setdefault(kind.decode(), []).append(offset)
+            offset = newline + 1
+
+        # text records are usually in order already
+        text.sort()
+        for start, end, data_offset in text:
+            self.__starts.append(start)
+            self.__ends.append(end)
+            self.__text_offsets.append(data_offset)
+
+    def __record(self, offset):
+        """ Return the record starting at an offset as a string. """
+        newline = self.__data.find(b'\n', offset)
+        if newline == -1:
+            newline = len(self.__data)
+        return self.__data[offset:newline].rstrip().decode()
+
+    def records(self, kind):
+        """ Generate the records of one type, for example 'M'. """
+        self.__index()
+        for offset in self.__offsets.get(kind, ()):
+            yield self.__record(offset)
+
+    @property
+    def header(self):
+        """ The program name, starting address and length. """
+        for record in self.records('H'):
+            return (record[1:7].strip(), int(record[7:13], 16),
+                    int(record[13:19], 16))
+        return None
+
+    @property
+    def entry(self):
+        """ The address of the first instruction. """
+        for record in self.records('E'):
+            return int(record[1:7], 16)
+        return None
+
+    @property
+    def text_ranges(self):
+        """ The address range of each text record, sorted by address. """
+        self.__index()
+        return list(zip(self.__starts, self.__ends))
+
+    def spans(self):
+        """
+        Merge adjacent text records into contiguous address ranges.
+        Returns a list of (start, end) tuples.
+        """
+        if self.__spans is None:
+            self.__index()
+            spans = []
+            for start, end in zip(self.__starts, self.__ends):
+                if len(spans) > 0 and spans[-1][1] == start:
+                    spans[-1][1] = end
+                else:
+                    spans.append([start, end])
+            self.__spans = [tuple(x) for x in spans]
+            self.__span_starts = [x[0] for x in spans]
+        return self.__spans
+
+    def read(self, start, end, fill=0):
+        """
+        Return the bytes from address start up to end as a bytearray.
+        Addresses which aren't in a text record are set to fill.
+        """
+        if end < start:
+            raise RecordError(message="Invalid address range: %s-%s" %
+                              (hex(start), hex(end)))
+
+        self.__index()
+        output = bytearray([fill]) * (end - start)
+        data = self.__data
+        starts, ends = self.__starts, self.__ends
+
+        # the records ending after start, found with a bisect
+        x = max(bisect_right(starts, start) - 1, 0)
+        while x < len(starts) and starts[x] < end:
+            if ends[x] > start:
+                low = max(starts[x], start)
+                high = min(ends[x], end)
+                offset = self.__text_offsets[x] + 2 * (low - starts[x])
+                output[low-start:high-start] = \
+                    binascii.unhexlify(data[offset:offset + 2 * (high - low)])
+            x += 1
+
+        return output
+
+    def read_span(self, address):
+        """ Return the start and bytes of the span containing an address. """
+        spans = self.spans()
+        x = bisect_right(self.__span_starts, address) - 1
+        if x < 0 or address >= spans[x][1]:
+            raise RecordError(message="Address not in a text record: " +
+                              hex(address))
+        start, end = spans[x]
+        return start, self.read(start, end)
+
+    def close(self):
+        if self.__mmap is not None:
+            self.__mmap.close()
+        if self.__file is not None:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,203 @@
+import multiprocessing
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import sic_assembler.errors as errors
+from sic_assembler.assembler import SourceLine, blank_line, comment
+from sic_assembler.dispatch import dispatch_table
+from sic_assembler.errors import BaseError, DuplicateSymbolError
+from sic_assembler.errors import OpcodeLookupError
+from sic_assembler.expressions import resolve_equates
+from sic_assembler.limits import exceeded
+
+
+# Size of a line which ends the program
+END = -1
+# Size of an INCLUDE line, the included lines are added while merging
+INCLUDE = -2
+
+# Programs with fewer lines than this per process are read in this process,
+# starting the workers would take longer than reading the lines
+min_chunk_lines = 5000
+
+
+def tokenize_chunk(chunk):
+    """
+    Parse and size the lines of one chunk of a program. A chunk is the
+    line number of its first line and a list of lines.
+
+    Returns a list of (line_number, label, mnemonic, operand, size, error)
+    tuples, one for each line which isn't blank or a comment. The size of
+    an END line is END and of an INCLUDE line INCLUDE. A line which can't
+    be read has a size of 0 and the error it raised. Errors aren't raised
+    here because a line after END is never read by the sequential first
+    pass, so only the errors before the first END are raised, in the
+    process which merges the chunks.
+    """
+    first_line_number, lines = chunk
+    tokens = []
+    for line_number, line in enumerate(lines, first_line_number):
+        if blank_line(line) or comment(line):
+            continue
+        label = mnemonic = operand = error = None
+        size = 0
+        try:
+            source_line = SourceLine.parse(line, line_number)
+            label = source_line.label
+            mnemonic = source_line.mnemonic
+            operand = source_line.operand
+
+            entry = dispatch_table.get(mnemonic)
+            if entry is None:
+                raise OpcodeLookupError(
+                        message='The mnemonic is invalid on line: ' +
+                        str(line_number+2), code=1,
+                        line_number=line_number+2, contents=line)
+            if entry.size is not None:
+                size = entry.size
+            elif entry.name == 'END':
+                size = END
+            elif entry.name == 'INCLUDE':
+                size = INCLUDE
+            else:
+                size = entry.first_pass(None, source_line, entry)
+        except BaseError as e:
+            # the errors of the assembler can't be pickled, send their fields
+            error = (type(e).__name__, e.message, e.details)
+        except Exception as e:
+            error = e
+        tokens.append((line_number, label, mnemonic, operand, size, error))
+    return tokens
+
+
+def split_lines(lines, chunks, first_line_number=0):
+    """
+    Split a list of lines into at most chunks chunks of consecutive lines,
+    each with the line number of its first line.
+    """
+    size = max(1, -(-len(lines) // chunks))
+    return [(first_line_number + x, lines[x:x + size])
+            for x in range(0, len(lines), size)]
+
+
+def raise_error(error):
+    """ Raise the error of a line sent back by tokenize_chunk. """
+    if isinstance(error, tuple):
+        name, message, details = error
+        raise getattr(errors, name)(message=message, **details)
+    raise error
+
+
+def assign_addresses(sizes, start_address):
+    """
+    Return the location of every line from the sizes of the lines: the
+    prefix sum of the sizes before each line, starting at start_address.
+    """
+    if numpy is not None:
+        sizes = numpy.asarray(sizes, dtype=numpy.int64)
+        locations = numpy.cumsum(sizes) - sizes + start_address
+        return locations.tolist()
+
+    locations = []
+    locctr = start_address
+    for size in sizes:
+        locations.append(locctr)
+        locctr += size
+    return locations
+
+
+def merge_chunks(assembler, tokens):
+    """
+    Assign the locations of the tokenized lines, build the symbol table
+    and the intermediate file of an assembler, stopping at the first END.
+    Duplicate symbols, the limits and the errors of each line are raised in
+    the order of the lines, like the sequential first pass. The lines of an
+    included file move every line after the INCLUDE by their size.
+    """
+    locations = assign_addresses(
+            [x[4] if x[4] > 0 else 0 for x in tokens],
+            assembler.start_address)
+
+    limits = assembler.limits
+    max_address = limits.bound('address_space')
+    max_symbols = limits.bound('symbols')
+    # the first line is already read
+    last_line = assembler.line_offset + limits.bound('source_lines') - 2
+
+    symtab = assembler.symtab
+    temp_contents = assembler.temp_contents
+    locctr = assembler.start_address
+    # the size of the included lines so far
+    shift = 0
+    for token, location in zip(tokens, locations):
+        line_number, label, mnemonic, operand, size, error = token
+        if line_number > last_line:
+            exceeded('source_lines', limits.source_lines,
+                     line_number=line_number+2)
+        location += shift
+        source_line = SourceLine(line_number, label, mnemonic, operand)
+        source_line.location = location
+        if label is not None:
+            if label in symtab:
+                raise DuplicateSymbolError(
+                        message="A duplicate symbol was found on line: " +
+                        str(line_number+2), code=1,
+                        line_number=line_number+2, contents=source_line)
+            if len(symtab) >= max_symbols:
+                exceeded('symbols', limits.symbols,
+                         line_number=line_number+2)
+            symtab[label] = hex(location)
+        if error is not None:
+            raise_error(error)
+
+        locctr = location
+        if size == END:
+            assembler.end_operand = operand
+            break
+        if size == INCLUDE:
+            assembler.locctr = location
+            assembler.include(source_line)
+            shift += assembler.locctr - location
+            # the INCLUDE line is added before the included lines
+            locctr = assembler.locctr
+            continue
+
+        locctr += size
+        if locctr > max_address:
+            exceeded('address_space', limits.address_space,
+                     line_number=line_number+2)
+        temp_contents.append(source_line)
+
+    assembler.locctr = locctr
+    assembler.absolute = resolve_equates(temp_contents, symtab)
+
+
+def first_pass(assembler, lines, processes=None):
+    """
+    Pass 1 over the lines of a program after its first line, with the
+    lines parsed and sized in chunks by a pool of worker processes.
+    """
+    lines = list(lines)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(lines) // min_chunk_lines)
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(tokenize_chunk,
+                               split_lines(lines, processes,
+                                           assembler.line_offset))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [tokenize_chunk((assembler.line_offset, lines))]
+
+    tokens = []
+    for chunk in results:
+        tokens.extend(chunk)
+    merge_chunks(assembler, tokens)
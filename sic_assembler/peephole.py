@@ -0,0 +1,139 @@
+from sic_assembler.instructions import extended, immediate
+from sic_assembler.layout import assign_locations, line_sizes
+
+
+# Registers which have both a load and a store instruction
+load_store_pairs = { 'LDA': 'STA',
+                     'LDB': 'STB',
+                     'LDCH': 'STCH',
+                     'LDF': 'STF',
+                     'LDL': 'STL',
+                     'LDS': 'STS',
+                     'LDT': 'STT',
+                     'LDX': 'STX'
+                   }
+store_load_pairs = dict((v, k) for k, v in load_store_pairs.items())
+
+
+def plain_mnemonic(mnemonic):
+    """ Return the mnemonic without the extended format prefix. """
+    if extended(mnemonic):
+        return mnemonic[1:]
+    return mnemonic
+
+
+class Rule(object):
+    """
+    A peephole rule looking at two consecutive lines. The match function
+    returns the index (0 or 1) of the line to remove, or None.
+    """
+    def __init__(self, name, mnemonics, match):
+        self.__name = name
+        self.__mnemonics = tuple(mnemonics)
+        self.__match = match
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def mnemonics(self):
+        return self.__mnemonics
+
+    def match(self, first, second):
+        return self.__match(first, second)
+
+
+def _redundant_store(first, second):
+    """ LDA X followed by STA X: the store doesn't change memory. """
+    if plain_mnemonic(second.mnemonic) == \
+            load_store_pairs[plain_mnemonic(first.mnemonic)] and \
+            first.operand == second.operand and \
+            not immediate(first.operand):
+        return 1
+
+
+def _redundant_load(first, second):
+    """ STA X followed by LDA X: the register already holds the value. """
+    if plain_mnemonic(second.mnemonic) == \
+            store_load_pairs[plain_mnemonic(first.mnemonic)] and \
+            first.operand == second.operand:
+        return 1
+
+
+def _jump_to_next(first, second):
+    """ J to the line directly after the jump. """
+    if second.label is not None and first.operand == second.label:
+        return 0
+
+
+def _redundant_clear(first, second):
+    """ CLEAR of a register which was just cleared. """
+    if second.mnemonic == 'CLEAR' and first.operand == second.operand:
+        return 1
+
+
+redundant_store = Rule('redundant_store', list(load_store_pairs.keys()),
+                       _redundant_store)
+redundant_load = Rule('redundant_load', list(store_load_pairs.keys()),
+                      _redundant_load)
+jump_to_next = Rule('jump_to_next', ['J'], _jump_to_next)
+redundant_clear = Rule('redundant_clear', ['CLEAR'], _redundant_clear)
+
+default_rules = (redundant_store, redundant_load, jump_to_next,
+                 redundant_clear)
+
+
+def optimize(temp_contents, symtab, end_address, rules=None):
+    """
+    Run the peephole rules over the intermediate file produced by the first
+    pass, then re-assign the locations and symbols. Labeled lines are never
+    removed.
+
+    Returns the optimized lines, the new end address and a report of the
+    hits per rule and the bytes saved.
+    """
+    if rules is None:
+        rules = default_rules
+
+    # rules keyed by mnemonic of the first line
+    rule_table = dict()
+    for rule in rules:
+        for mnemonic in rule.mnemonics:
+            rule_table.setdefault(mnemonic, []).append(rule)
+
+    sizes = line_sizes(temp_contents, end_address)
+    hits = dict((rule.name, 0) for rule in rules)
+    bytes_saved = 0
+
+    output = []
+    output_sizes = []
+    for source_line, size in zip(temp_contents, sizes):
+        removed = False
+        if len(output) > 0:
+            previous = output[-1]
+            for rule in rule_table.get(plain_mnemonic(previous.mnemonic), ()):
+                result = rule.match(previous, source_line)
+                if result == 1 and source_line.label is None:
+                    removed = True
+                elif result == 0 and previous.label is None:
+                    output.pop()
+                    bytes_saved += output_sizes.pop()
+                else:
+                    continue
+                hits[rule.name] += 1
+                break
+
+        if removed:
+            bytes_saved += size
+        else:
+            output.append(source_line)
+            output_sizes.append(size)
+
+    if len(output) > 0:
+        output[0].location = temp_contents[0].location
+        end_address = assign_locations(output, symtab, output_sizes)
+
+    report = {'hits': hits, 'bytes_saved': bytes_saved}
+
+    return output, end_address, report
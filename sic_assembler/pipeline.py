@@ -0,0 +1,373 @@
+from timeit import default_timer as timer
+
+from sic_assembler.assembler import SourceLine, blank_line, comment
+from sic_assembler.dispatch import dispatch_table
+from sic_assembler.errors import CircularDefinitionError, DuplicateSymbolError
+from sic_assembler.errors import InstructionError, OpcodeLookupError
+from sic_assembler.errors import UndefinedSymbolError
+from sic_assembler.expressions import compile_expression, operand_value
+from sic_assembler.instructions import literal, operand_text
+from sic_assembler.limits import Limits, clock_lines, exceeded
+from sic_assembler.records import gen_end, gen_header, gen_modification
+from sic_assembler.records import text_record
+
+
+class _Base(object):
+    """ The value of a BASE directive, set once its operand is known. """
+    __slots__ = ('source_line', 'value')
+
+    def __init__(self, source_line):
+        self.source_line = source_line
+        self.value = None
+
+
+class _TextRecord(object):
+    """ A text record being filled, with a slot for each object. """
+    __slots__ = ('start', 'code', 'length', 'pending', 'closed')
+
+    def __init__(self, start):
+        self.start = start
+        self.code = []
+        # length of the object code in hex digits
+        self.length = 0
+        # slots waiting for an instruction to be resolved
+        self.pending = 0
+        self.closed = False
+
+
+class StreamAssembler(object):
+    """
+    Assemble a program in a single pass over its lines and emit each text
+    record as soon as it is full and every instruction in it is resolved.
+
+    Instructions which use a symbol that isn't defined yet, or a BASE whose
+    operand isn't defined yet, wait for that symbol and hold back only
+    their own text record. Every line still gets its final location
+    straight away because the size of each line doesn't depend on later
+    lines (there is no format relaxation or optimizing in this mode).
+
+    The text records come out in the order they are completed. The H
+    record needs the program length, so it is emitted after the text
+    records, or given to the header function instead if there is one.
+
+    The limits are checked as each line is read, so a runaway input stops
+    at the first line past a limit.
+    """
+    def __init__(self, lines, emit, header=None, relocatable=False,
+                 limits=None):
+        self.__lines = lines
+        self.__emit = emit
+        self.__header = header
+        self.relocatable = relocatable
+        self.limits = limits if limits is not None else Limits()
+        # characters of the records emitted so far
+        self.__output_bytes = 0
+
+        # Symbol table
+        self.symtab = dict()
+        # Symbols defined with EQU whose values are absolute, not addresses
+        self.absolute = set()
+        # Location counter
+        self.locctr = 0
+        self.start_address = 0
+        self.program_name = ""
+        # Operand of the END directive: the first instruction
+        self.end_operand = None
+        # BASE register, set for each instruction as it is generated
+        self.base = None
+
+        # every label seen, including equates which aren't resolved yet
+        self.__labels = set()
+        # equates which aren't resolved yet
+        self.__equates = set()
+        # the functions waiting for each symbol or BASE directive
+        self.__waiting = dict()
+        self.__ready = []
+        self.__record = None
+        self.__held = 0
+        self.__modifications = []
+
+        self.__started = None
+        self.report = {'first_record': None, 'records': 0, 'held_back': 0,
+                       'lines': 0}
+
+    def assemble(self):
+        """ Read every line and emit the records. Returns the report. """
+        self.__started = timer()
+        lines = iter(self.__lines)
+        limits = self.limits
+        deadline = limits.deadline()
+        max_address = limits.bound('address_space')
+        max_symbols = limits.bound('symbols')
+        max_lines = limits.bound('source_lines')
+        max_bytes = limits.bound('source_bytes')
+
+        first = next(lines)
+        source_bytes = len(first)
+        # the line numbers of the lines count from the third line
+        first_line = SourceLine.parse(first, line_number=-1)
+        if first_line.mnemonic == 'START':
+            self.start_address = int(first_line.operand, 16)
+            self.locctr = self.start_address
+            self.program_name = first_line.label
+
+        base = None
+        for line_number, line in enumerate(lines):
+            source_bytes += len(line)
+            if source_bytes > max_bytes:
+                exceeded('source_bytes', limits.source_bytes,
+                         line_number=line_number+2)
+            if line_number + 2 > max_lines:
+                exceeded('source_lines', limits.source_lines,
+                         line_number=line_number+2)
+            if deadline is not None and line_number % clock_lines == 0:
+                limits.check_time(deadline, line_number+2)
+            line = line.rstrip('\n')
+            if blank_line(line) or comment(line):
+                continue
+            source_line = SourceLine.parse(line, line_number)
+            source_line.location = self.locctr
+            self.report['lines'] += 1
+
+            entry = dispatch_table.get(source_line.mnemonic)
+            if entry is None:
+                raise OpcodeLookupError(
+                        message='The mnemonic is invalid on line: ' +
+                        str(line_number+2), code=1,
+                        line_number=line_number+2, contents=line)
+            if entry.size is not None:
+                size = entry.size
+            else:
+                size = entry.first_pass(self, source_line, entry)
+                if size is None:
+                    break
+
+            label = source_line.label
+            if label is not None:
+                if label in self.__labels:
+                    raise DuplicateSymbolError(
+                            message="A duplicate symbol was found on line: " +
+                            str(line_number+2), code=1,
+                            line_number=line_number+2, contents=line)
+                if len(self.__labels) >= max_symbols:
+                    exceeded('symbols', limits.symbols,
+                             line_number=line_number+2)
+                self.__labels.add(label)
+                if entry.name != 'EQU':
+                    self.__define(label, hex(self.locctr))
+                    self.__run()
+
+            if entry.format is not None:
+                slot = self.__slot(self.locctr, size)
+                self.__resolve(self.__instruction(source_line, entry, base,
+                                                  slot), source_line)
+            elif entry.name == 'EQU':
+                self.__equates.add(label)
+                self.__resolve(self.__equate(source_line), source_line)
+            elif entry.name == 'BASE':
+                base = _Base(source_line)
+                self.__resolve(self.__base(base), source_line)
+            elif entry.name == 'NOBASE':
+                base = None
+            elif entry.second_pass is not None:
+                output = entry.second_pass(self, source_line, entry)
+                self.__data(self.locctr, output[2].upper())
+
+            self.locctr += size
+            if self.locctr > max_address:
+                exceeded('address_space', limits.address_space,
+                         line_number=line_number+2)
+
+        if self.__record is not None:
+            self.__close(self.__record)
+        self.__check_waiting()
+        self.__finish()
+        return self.report
+
+    def __instruction(self, source_line, entry, base, slot):
+        """ Return a function which generates an instruction if it can. """
+        def resolve():
+            operand = source_line.operand
+            if entry.format >= 3 and operand is not None and \
+                    not literal(operand):
+                missing = self.__missing(operand_text(operand))
+                if missing is not None:
+                    return missing
+
+            self.base = base.value if base is not None else None
+            try:
+                output = entry.second_pass(self, source_line, entry)
+                encoded = output.encode()
+            except InstructionError:
+                # base relative addressing needs a BASE which isn't known
+                if base is not None and base.value is None:
+                    return base
+                raise
+
+            if self.relocatable and entry.format == 4 and output.relocatable:
+                self.__modifications.append(
+                        gen_modification(source_line.location + 1, 5))
+            self.__fill(slot, encoded.hex)
+        return resolve
+
+    def __equate(self, source_line):
+        """ Return a function which sets the value of an equate. """
+        def resolve():
+            missing = self.__missing(source_line.operand)
+            if missing is not None:
+                return missing
+            expression = compile_expression(source_line.operand)
+            value = expression.evaluate(self.symtab, source_line.location)
+            if expression.is_absolute(self.absolute):
+                self.absolute.add(source_line.label)
+            self.__equates.discard(source_line.label)
+            self.__define(source_line.label, hex(value))
+        return resolve
+
+    def __base(self, base):
+        """ Return a function which sets the value of a BASE directive. """
+        def resolve():
+            source_line = base.source_line
+            missing = self.__missing(source_line.operand)
+            if missing is not None:
+                return missing
+            base.value = operand_value(source_line.operand, self.symtab,
+                                       source_line.location)
+            self.__define(base)
+        return resolve
+
+    def __missing(self, text):
+        """ Return a symbol used by an expression which isn't defined. """
+        for name in compile_expression(text).symbols:
+            if name not in self.symtab:
+                return name
+        return None
+
+    def __define(self, key, value=None):
+        """
+        Define a symbol, or mark a BASE directive as known, and queue the
+        functions waiting for it.
+        """
+        if value is not None:
+            self.symtab[key] = value
+        waiting = self.__waiting.pop(key, None)
+        if waiting is not None:
+            self.__ready.extend(waiting)
+
+    def __resolve(self, resolve, source_line):
+        """
+        Run a function, and every function which becomes ready because of
+        it. A function which returns a symbol waits for that symbol.
+        """
+        self.__ready.append((resolve, source_line))
+        self.__run()
+
+    def __run(self):
+        """ Run the functions which are ready. """
+        while len(self.__ready) > 0:
+            resolve, source_line = self.__ready.pop()
+            missing = resolve()
+            if missing is not None:
+                self.__waiting.setdefault(missing, []).append(
+                        (resolve, source_line))
+
+    def __slot(self, location, size):
+        """ Reserve the place of an object in the current text record. """
+        record = self.__record
+        if record is not None and \
+                (record.length + 2 * size > 60 or
+                 location != record.start + record.length // 2):
+            self.__close(record)
+            record = None
+        if record is None:
+            record = self.__record = _TextRecord(location)
+        record.code.append(None)
+        record.length += 2 * size
+        record.pending += 1
+        return record, len(record.code) - 1
+
+    def __data(self, location, code):
+        """
+        Fill the slots of a data object, split between records like
+        records.gen_text.
+        """
+        full = max(0, (len(code) - 1) // 60 * 60)
+        for start in range(0, full, 60):
+            self.__fill(self.__slot(location + start // 2, 30),
+                        code[start:start + 60])
+        self.__fill(self.__slot(location + full // 2,
+                                (len(code) - full) // 2), code[full:])
+
+    def __fill(self, slot, code):
+        record, index = slot
+        record.code[index] = code
+        record.pending -= 1
+        if record.closed and record.pending == 0:
+            self.__held -= 1
+            self.__write(record)
+
+    def __close(self, record):
+        record.closed = True
+        if record is self.__record:
+            self.__record = None
+        if record.pending == 0:
+            self.__write(record)
+        else:
+            self.__held += 1
+            self.report['held_back'] = max(self.report['held_back'],
+                                           self.__held)
+
+    def __write(self, record):
+        if self.report['first_record'] is None:
+            self.report['first_record'] = timer() - self.__started
+        self.report['records'] += 1
+        self.__output(text_record(record.start, record.code))
+
+    def __check_waiting(self):
+        """ Report the first symbol which was never defined. """
+        if len(self.__waiting) == 0:
+            return
+
+        if len(self.__equates) > 0 and \
+                all(key in self.__equates for key in self.__waiting):
+            # the equates left only wait for each other
+            names = sorted(self.__equates)
+            raise CircularDefinitionError(
+                    message='Circular definition of symbols: ' +
+                    ', '.join(names), code=1, symbols=names)
+
+        source_line = min((x[1] for waiting in self.__waiting.values()
+                           for x in waiting), key=lambda x: x.line_number)
+        raise UndefinedSymbolError(
+                message='Undefined symbol on line: ' +
+                str(source_line.line_number+2), code=1,
+                line_number=source_line.line_number+2, contents=source_line)
+
+    def __finish(self):
+        """ Emit the H, M and E records. """
+        header = gen_header(self.program_name or '', self.start_address,
+                            self.locctr - self.start_address)
+        if self.__header is not None:
+            self.__count_output(header)
+            self.__header(header)
+        else:
+            self.__output(header)
+
+        for record in self.__modifications:
+            self.__output(record)
+
+        first_address = self.symtab.get(self.end_operand)
+        if first_address is not None:
+            first_address = int(first_address, 16)
+        else:
+            first_address = self.start_address
+        self.__output(gen_end(first_address))
+
+    def __output(self, record):
+        self.__count_output(record)
+        self.__emit(record)
+
+    def __count_output(self, record):
+        self.__output_bytes += len(record) + 1
+        if self.__output_bytes > self.limits.bound('output_bytes'):
+            exceeded('output_bytes', self.limits.output_bytes)
@@ -2,18 +2,30 @@ from sic_assembler.instructions import  Format
 
 
 def generate_records(generated_objects, program_name, start_address,
-                    program_length):
-    """ Generate a list of records. """
+                    program_length, modifications=(), first_address=None,
+                    definitions=(), references=(), entry=True):
+    """
+    Generate a list of records. Without entry, the E record of a control
+    section doesn't give the address of the first instruction.
+    """
     records = []
 
     header = gen_header(program_name, start_address, program_length)
     records.append(header)
 
+    records.extend(gen_define(definitions))
+    records.extend(gen_refer(references))
+
     text = gen_text(generated_objects)
     for record in text:
         records.append(record)
 
-    end = gen_end(start_address)
+    for modification in modifications:
+        records.append(gen_modification(*modification))
+
+    if first_address is None and entry:
+        first_address = start_address
+    end = gen_end(first_address)
     records.append(end)
 
     return records
@@ -34,56 +46,124 @@ def gen_header(program_name, start_address, program_length):
     return col1 + col2 + col3 + col4
 
 
+def gen_define(definitions):
+    """
+    Generate the define records for a list of (name, address) pairs of
+    external definitions, six to a record.
+    """
+    records = []
+    for x in range(0, len(definitions), 6):
+        records.append("D" + "".join(
+            name[:6].ljust(6).upper() + hex(address)[2:].zfill(6).upper()
+            for name, address in definitions[x:x+6]))
+    return records
+
+
+def gen_refer(references):
+    """
+    Generate the refer records for a list of external references, twelve to
+    a record.
+    """
+    records = []
+    for x in range(0, len(references), 12):
+        records.append("R" + "".join(name[:6].ljust(6).upper()
+                                     for name in references[x:x+12]))
+    return records
+
+
 def gen_text(generated_code):
     """ Generate a text record. """
 
-    code = list(generated_code)  # create a copy of the generated code
-
     # specify the size of each column
     col2_size, col3_size, col4_size = 6, 2, 60
 
-    generated_lines = []  # contains each temp_line 
+    generated_lines = []  # contains each temp_line
 
-    temp_line = []  # temporary line for each text record object code
+    temp_line = []  # object code for the current text record
     temp_start_address = None  # starting address for a temp line
-    temp_line_length = 0  # count length of instruction formats on line
- 
-    while len(code) > 0:
-        col4 = ""
-        while (len(col4) + len(code[0][1]) <= col4_size):
-            x = code.pop(0)
-            if isinstance(x[1], Format):
-                temp_contents = x[1].generate()[2].upper()
-            else:
-                temp_contents = x[1][2].upper()
-            col4 = col4 + temp_contents
-            temp_line_length += len(temp_contents)/2
-            if temp_start_address is None:
-                temp_start_address = x[0]
-            
-            if len(code) is 0:
-                break
-
-        temp_start_address = hex(temp_start_address)[2:].zfill(6).upper()
-        temp_line_length = hex(temp_line_length)[2:].zfill(2).upper()
-        temp_line = "T%s%s%s" % (temp_start_address, temp_line_length, col4)
-
-        generated_lines.append(temp_line)
-        temp_line = []
-        temp_start_address = None
-        temp_line_length = 0
+    temp_line_length = 0  # count length of the object code on the line
+    next_address = None  # address following the last object on the line
+
+    for location, x in generated_code:
+        if isinstance(x, Format):
+            temp_contents = x.encode().hex
+        else:
+            temp_contents = x[2].upper()
+
+        # start a new record when it is full or the addresses are not
+        # contiguous (after a RESB or RESW)
+        if temp_start_address is not None and \
+                (temp_line_length + len(temp_contents) > col4_size or
+                 location != next_address):
+            generated_lines.append(text_record(temp_start_address, temp_line))
+            temp_line = []
+            temp_start_address = None
+            temp_line_length = 0
+
+        # data longer than a record fills whole records, the rest starts
+        # the next record
+        if len(temp_contents) > col4_size:
+            full = (len(temp_contents) - 1) // col4_size * col4_size
+            for start in range(0, full, col4_size):
+                generated_lines.append(text_record(
+                    location + start//2,
+                    [temp_contents[start:start + col4_size]]))
+            location += full//2
+            temp_contents = temp_contents[full:]
+
+        if temp_start_address is None:
+            temp_start_address = location
+        temp_line.append(temp_contents)
+        temp_line_length += len(temp_contents)
+        next_address = location + len(temp_contents)//2
+
+    if temp_start_address is not None:
+        generated_lines.append(text_record(temp_start_address, temp_line))
 
     return generated_lines
 
 
-def gen_end(first_instruction_address):
-    """ Generate an end record. """
-    
+def text_record(start_address, object_code):
+    """ Format a single text record from a list of object code. """
+    col4 = "".join(object_code)
+    col2 = hex(start_address)[2:].zfill(6).upper()
+    col3 = hex(len(col4)//2)[2:].zfill(2).upper()
+
+    return "T%s%s%s" % (col2, col3, col4)
+
+
+def gen_modification(address, length, symbol=None):
+    """
+    Generate a modification record for a field of length half-bytes
+    starting at address. The symbol, like '+RDREC', is the external symbol
+    whose address is added to or subtracted from the field.
+    """
+
+    # specify the size of each column
+    col2_size, col3_size = 6, 2
+
+    # content for each column
+    col1 = "M"
+    col2 = hex(address)[2:].zfill(col2_size).upper()
+    col3 = hex(length)[2:].zfill(col3_size).upper()
+    col4 = symbol[:7].upper() if symbol is not None else ""
+
+    return col1 + col2 + col3 + col4
+
+
+def gen_end(first_instruction_address=None):
+    """
+    Generate an end record, without an address for a control section which
+    isn't the first.
+    """
+
     # specify the size of each column
     col2_size = 6
     
     # content for each column
     col1 = "E"
+    if first_instruction_address is None:
+        return col1
     col2 = hex(first_instruction_address)[2:].zfill(col2_size).upper()
     
     return col1 + col2
@@ -0,0 +1,131 @@
+from sic_assembler.dispatch import dispatch_table
+from sic_assembler.expressions import absolute_operand, operand_value
+from sic_assembler.instructions import extended, immediate, indexed, indirect
+from sic_assembler.instructions import literal, operand_text
+from sic_assembler.layout import assign_locations, line_sizes
+from sic_assembler.linkage import external_symbols, external_terms
+
+
+def relaxable(source_line):
+    """ Return True if the line is a format 3/4 instruction. """
+    entry = dispatch_table.get(source_line.mnemonic)
+    return entry is not None and entry.format in (3, 4)
+
+
+def target_address(source_line, symtab):
+    """
+    Return the address the operand of a format 3/4 instruction refers to,
+    or None if it has no operand, a constant or an undefined symbol.
+    """
+    operand = source_line.operand
+    if operand is None or literal(operand):
+        return None
+
+    if indexed(operand):
+        operand = operand[:len(operand)-2]
+    elif indirect(operand):
+        operand = operand[1:]
+    elif immediate(operand):
+        operand = operand[1:]
+        if operand.isdigit():
+            return None
+
+    target = operand_value(operand, symtab, source_line.location)
+    if target is None:
+        return None
+    return int(str(target), 16)
+
+
+def fits_format_3(source_line, symtab, base, absolute=()):
+    """
+    Check if the operand of a format 3 instruction can be reached with a
+    12 bit displacement, using the same rules as Format3.generate. The
+    symbols in absolute are the equates with absolute values.
+    """
+    operand = source_line.operand
+    if operand is not None and immediate(operand) and \
+            operand[1:].isdigit():
+        return 0 <= int(operand[1:]) <= 4095
+
+    target = target_address(source_line, symtab)
+    if target is None:
+        # only an operand with a symbol which isn't resolved has no target,
+        # it keeps format 4 and is reported on the second pass
+        return operand is None or literal(operand)
+
+    if absolute_operand(operand_text(operand), absolute):
+        # the value itself is the displacement
+        if 0 <= target <= 4095:
+            return True
+        if immediate(operand):
+            return False
+
+    if -2048 <= target - (source_line.location + 3) <= 2047:
+        return True
+    if base is not None and 0 <= target - int(str(base), 16) <= 4095:
+        return True
+    return False
+
+
+def relax(temp_contents, symtab, end_address, absolute=()):
+    """
+    Select format 3 or format 4 for every format 3/4 instruction.
+
+    Every instruction starts out as format 3. Instructions which cannot
+    reach their operand are grown to format 4 and the addresses after them
+    are shifted, until no more instructions need to grow. Instructions only
+    ever grow, so this always reaches a fixed point. An instruction with an
+    external reference keeps the format it is written with, since only the
+    loader knows its address.
+
+    Returns the new end address and a report of the bytes saved compared to
+    encoding every instruction as format 4.
+    """
+    sizes = line_sizes(temp_contents, end_address)
+    references = external_symbols(temp_contents)[1]
+
+    candidates = []
+    for x, source_line in enumerate(temp_contents):
+        if relaxable(source_line) and \
+                len(external_terms(source_line.operand, references)) == 0:
+            if extended(source_line.mnemonic):
+                source_line.mnemonic = source_line.mnemonic[1:]
+            sizes[x] = 3
+            candidates.append(x)
+
+    end_address = assign_locations(temp_contents, symtab, sizes)
+
+    candidate_set = set(candidates)
+    grown = set()
+    iterations = 0
+    while True:
+        iterations += 1
+        base = None
+        grow = []
+        for x, source_line in enumerate(temp_contents):
+            if source_line.mnemonic == 'BASE':
+                base = operand_value(source_line.operand, symtab,
+                                     source_line.location)
+            elif source_line.mnemonic == 'NOBASE':
+                base = None
+            elif x in candidate_set and x not in grown:
+                if not fits_format_3(source_line, symtab, base, absolute):
+                    grow.append(x)
+
+        if len(grow) == 0:
+            break
+
+        for x in grow:
+            temp_contents[x].mnemonic = '+' + temp_contents[x].mnemonic
+            sizes[x] = 4
+            grown.add(x)
+        # only the addresses after the first grown instruction move
+        end_address = assign_locations(temp_contents, symtab, sizes,
+                                       first=grow[0])
+
+    report = {'instructions': len(candidates),
+              'extended': len(grown),
+              'iterations': iterations,
+              'bytes_saved': len(candidates) - len(grown)}
+
+    return end_address, report
@@ -0,0 +1,134 @@
+import multiprocessing
+
+from sic_assembler.assembler import Assembler, SourceLine, blank_line, comment
+from sic_assembler.errors import BaseError, LineFieldsError
+from sic_assembler.parallel import raise_error
+
+
+class Section(object):
+    """
+    The lines of one control section: a START line, or the START line made
+    from its CSECT line, followed by the lines of the section.
+    """
+    def __init__(self, name, line_offset, lines):
+        self.name = name
+        # line number of the first line in the whole source program
+        self.line_offset = line_offset
+        self.lines = lines
+
+    def __repr__(self):
+        return "<Section: %s, line_offset=%i, lines=%i>" % (
+                self.name, self.line_offset, len(self.lines))
+
+
+def directive(line, line_number, name):
+    """ Return the parsed line if it is the directive name, or None. """
+    if name not in line or blank_line(line) or comment(line):
+        return None
+    source_line = SourceLine.parse(line, line_number)
+    if source_line.mnemonic == name:
+        return source_line
+    if source_line.operand == name and source_line.label is None:
+        # a label and a directive without an operand, like 'RDREC CSECT',
+        # are parsed as a mnemonic and an operand
+        return SourceLine(line_number, source_line.mnemonic, name, None)
+    return None
+
+
+def split_sections(lines):
+    """
+    Split the lines of a source program into its control sections, at
+    every CSECT directive. Only the lines which contain the text CSECT or
+    END are parsed.
+
+    Each section gets its own START line, at address 0 for the sections
+    after the first. The END directive at the end of the program ends the
+    last section, but its operand names the first instruction of the
+    program, so it is given to the first section. The lines after END are
+    ignored, like the lines after END of a single program.
+    """
+    lines = list(lines)
+
+    end_line = None
+    starts = [0]
+    for x, line in enumerate(lines):
+        # the line number the assembler would give the line
+        if directive(line, x - 1, 'CSECT') is not None:
+            if x > 0:
+                starts.append(x)
+        elif directive(line, x - 1, 'END') is not None:
+            end_line = line
+            lines = lines[:x]
+            break
+
+    sections = []
+    for number, start in enumerate(starts):
+        end = starts[number + 1] if number + 1 < len(starts) else len(lines)
+        section_lines = lines[start:end]
+        header = directive(section_lines[0], start - 1, 'CSECT') \
+            if len(section_lines) > 0 else None
+        if header is not None:
+            if header.label is None:
+                raise LineFieldsError(
+                        message="CSECT needs a name on line: " +
+                        str(start+1), code=1, line_number=start+1,
+                        contents=section_lines[0])
+            section_lines[0] = "%s START 0" % header.label
+        if number == 0 and end_line is not None:
+            section_lines.append(end_line)
+        name = header.label if header is not None else None
+        sections.append(Section(name, start, section_lines))
+    return sections
+
+
+def assemble_section(job):
+    """
+    Assemble one control section in a worker. Returns the records, and the
+    error raised instead if there is one.
+    """
+    section, entry, options = job
+    try:
+        a = Assembler.from_lines(section.lines, section.line_offset,
+                                 **options)
+        # only the first section gives the address of the first instruction
+        a.entry = entry
+        return a.assemble(), None
+    except BaseError as e:
+        # the errors of the assembler can't be pickled, send their fields
+        return None, (type(e).__name__, e.message, e.details)
+    except Exception as e:
+        return None, e
+
+
+def assemble_sections(sections, processes=None, **options):
+    """
+    Assemble every control section with its own location counter and
+    symbol table, in a pool of worker processes, and return the records
+    of all of the sections in source order. The options are given to
+    each Assembler.
+
+    The sections don't depend on each other, so the records are the same
+    as assembling the sections one after the other. An error is raised
+    for the first section, in source order, which fails.
+    """
+    jobs = [(section, x == 0, options) for x, section in enumerate(sections)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(assemble_section, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [assemble_section(job) for job in jobs]
+
+    records = []
+    for section_records, error in results:
+        if error is not None:
+            raise_error(error)
+        records.extend(section_records)
+    return records
@@ -0,0 +1,58 @@
+COPY    START   0
+        EXTDEF  BUFFER,BUFEND,LENGTH
+        EXTREF  RDREC,WRREC
+FIRST   STL     RETADR
+CLOOP   +JSUB   RDREC
+        LDA     LENGTH
+        COMP    #0
+        JEQ     ENDFIL
+        +JSUB   WRREC
+        J       CLOOP
+ENDFIL  LDA     EOF
+        STA     BUFFER
+        LDA     #3
+        STA     LENGTH
+        +JSUB   WRREC
+        J       @RETADR
+EOF     BYTE    C'EOF'
+RETADR  RESW    1
+LENGTH  RESW    1
+BUFFER  RESB    4096
+BUFEND  EQU     *
+.
+.       SUBROUTINE TO READ RECORD INTO BUFFER
+.
+RDREC   CSECT
+        EXTREF  BUFFER,LENGTH,BUFEND
+        CLEAR   X
+        CLEAR   A
+        CLEAR   S
+        LDT     MAXLEN
+RLOOP   TD      INPUT
+        JEQ     RLOOP
+        RD      INPUT
+        COMPR   A,S
+        JEQ     EXIT
+        +STCH   BUFFER,X
+        TIXR    T
+        JLT     RLOOP
+EXIT    +STX    LENGTH
+        RSUB
+INPUT   BYTE    X'F1'
+MAXLEN  WORD    4096
+.
+.       SUBROUTINE TO WRITE RECORD FROM BUFFER
+.
+WRREC   CSECT
+        EXTREF  LENGTH,BUFFER
+        CLEAR   X
+        +LDT    LENGTH
+WLOOP   TD      OUTPUT
+        JEQ     WLOOP
+        +LDCH   BUFFER,X
+        WD      OUTPUT
+        TIXR    T
+        JLT     WLOOP
+        RSUB
+OUTPUT  BYTE    X'05'
+        END     FIRST
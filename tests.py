@@ -1,10 +1,15 @@
 import unittest
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 import sic_assembler.assembler as assembler
 import sic_assembler.instructions as instructions
 from sic_assembler.assembler import Assembler, SourceLine
 from sic_assembler.instructions import Format
 from sic_assembler.instructions import  Format1, Format2, Format3, Format4
+import sic_assembler.memprofile as memprofile
 import sic_assembler.records as records
 
 
@@ -176,6 +181,86 @@ class TestInstructionGeneration(unittest.TestCase):
 
         self.assertTrue(results[2] == "75101000")
 
+    def test_generate_is_idempotent(self):
+        symtab = {'RETADR': '30', 'RDREC': '1036'}
+
+        lines = [("FIRST   STL     RETADR", 0x0, Format3),
+                 ("        RSUB", 0x10, Format3),
+                 ("        +JSUB   RDREC", 0x6, Format4)]
+        for line, location, instruction_format in lines:
+            source_line = SourceLine.parse(line, 1)
+            source_line.location = location
+            if instruction_format is Format3:
+                instruction = Format3(base=None, symtab=symtab,
+                                      source_line=source_line)
+            else:
+                instruction = Format4(symtab=symtab, source_line=source_line)
+
+            first = instruction.generate()
+            encoded = instruction.encode()
+            self.assertEqual(instruction.generate(), first)
+            self.assertTrue(instruction.encode() is encoded)
+
+    def test_encoded_record(self):
+        symtab = {'BUFFER': '36'}
+
+        source_line = SourceLine.parse("STCH    BUFFER,X", 1)
+        source_line.location = 0x104E
+        encoded = Format3(base=hex(51), symtab=symtab,
+                          source_line=source_line).encode()
+
+        self.assertEqual(encoded.hex, '57C003')
+        self.assertEqual(encoded.code, b'\x57\xC0\x03')
+        self.assertEqual(encoded.target, 0x36)
+        self.assertEqual(encoded.flags, 0b111100)
+        self.assertEqual(encoded.mode, 'base')
+
+    def test_program_ending_in_rsub(self):
+        source = """PROG    START   0
+FIRST   CLEAR   A
+        +JSUB   SUB
+SUB     CLEAR   X
+        RSUB
+        END     FIRST
+"""
+        a = Assembler(StringIO(source))
+        output = a.assemble()
+
+        self.assertEqual(output[1], 'T0000000BB4004B100006B4104F0000')
+        # the records are the same when they are generated again
+        self.assertEqual(records.gen_text(a.generated_objects), output[1:2])
+
+
+class TestDispatchTable(unittest.TestCase):
+    """
+    Test the table of accepted mnemonics used by both passes.
+    """
+    def test_instructions(self):
+        from sic_assembler.dispatch import dispatch_table
+
+        for mnemonic, instr in instructions.op_table.items():
+            entry = dispatch_table[mnemonic]
+            self.assertEqual(entry.opcode, int(instr.opcode, 16))
+            self.assertEqual(entry.size, instr.format)
+            if instr.format == 3:
+                self.assertEqual(dispatch_table['+' + mnemonic].size, 4)
+                self.assertEqual(dispatch_table['+' + mnemonic].name,
+                                 mnemonic)
+            else:
+                self.assertFalse('+' + mnemonic in dispatch_table)
+
+    def test_directives(self):
+        from sic_assembler.dispatch import dispatch_table
+
+        self.assertEqual(dispatch_table['WORD'].size, None)
+        self.assertEqual(dispatch_table['WORD'].first_pass(
+            None, SourceLine(0, None, 'WORD', '1,2,3'), None), 9)
+        self.assertEqual(dispatch_table['BASE'].size, 0)
+        self.assertEqual(dispatch_table['RESW'].size, None)
+        self.assertEqual(dispatch_table['RESW'].first_pass(
+            None, SourceLine(0, None, 'RESW', '4'), None), 12)
+        self.assertEqual(dispatch_table['END'].format, None)
+
 
 class TestAssemblyFile(unittest.TestCase):
     """
@@ -247,16 +332,19 @@ class TestRecordGeneration(unittest.TestCase):
 
         t = records.gen_text(a.generated_objects)
         expected_t = ['T0000001D17202D69202D4B1010360320262900003320074B10105D3F2FEC032010',
-                      'T00001D1D0F20160100030F200D4B10105D3E2003454F46B410B400B44075101000',
-                      'T0010401FE32019332FFADB2013A00433200857C003B8503B2FEA1340004F0000F1B410',
-                      'T00105F18774000E32011332FFA53C003DF2008B8503B2FEF4F000005']
-        
-        records_match = t[0] == expected_t[0] and \
-                        t[1] == expected_t[1] and \
-                        t[2] == expected_t[2] and \
-                        t[3] == expected_t[3]
+                      'T00001D130F20160100030F200D4B10105D3E2003454F46',
+                      'T0010361DB410B400B44075101000E32019332FFADB2013A00433200857C003B850',
+                      'T0010531D3B2FEA1340004F0000F1B410774000E32011332FFA53C003DF2008B850',
+                      'T001070073B2FEF4F000005']
+
+        self.assertEqual(t, expected_t)
+
+    def test_program_length(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f)
+            output = a.assemble()
 
-        self.assertTrue(records_match)
+        self.assertEqual(output[0], 'HCOPY  000000001077')
 
     def test_end_record(self):
         e = records.gen_end(4096)
@@ -264,6 +352,1687 @@ class TestRecordGeneration(unittest.TestCase):
 
         self.assertTrue(e == expected_e)
 
+    def test_end_record_first_instruction(self):
+        source = """PROG    START   100
+DATA    WORD    5
+FIRST   LDA     DATA
+        END     FIRST
+"""
+        output = Assembler(StringIO(source)).assemble()
+
+        self.assertEqual(output[-1], 'E000103')
+
+    def test_modification_record(self):
+        m = records.gen_modification(7, 5)
+
+        self.assertEqual(m, 'M00000705')
+
+    def test_relocatable_records(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            output = Assembler(f, relocatable=True).assemble()
+
+        self.assertEqual(output[-4:], ['M00000705', 'M00001405', 'M00002705',
+                                       'E000000'])
+
+
+class TestLoader(unittest.TestCase):
+    """
+    Test loading and relocating object programs.
+    """
+    def setUp(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            self.output = Assembler(f, relocatable=True).assemble()
+
+    def test_load_relocated(self):
+        import binascii
+        from sic_assembler.loader import load
+
+        memory, program = load(self.output, load_address=0x4000)
+
+        self.assertEqual(program.entry, 0x4000)
+        self.assertEqual(program.relocations, 3)
+        # +JSUB RDREC, +JSUB WRREC, +JSUB WRREC
+        for address, code in [(0x4006, b'4B105036'), (0x4013, b'4B10505D'),
+                              (0x4026, b'4B10505D'), (0x4000, b'17202D')]:
+            data = memory[address:address+len(code)//2]
+            self.assertEqual(binascii.hexlify(data).upper(), code)
+
+    def test_relocate_python(self):
+        from array import array
+        import sic_assembler.loader as loader
+
+        numpy_module = loader.numpy
+        loader.numpy = None
+        try:
+            memory = bytearray(b'\x00\x4F\xFF\xFF\x00\x00\x10')
+            loader.relocate(memory, array('l', [0, 3]), array('b', [5, 6]), 1)
+        finally:
+            loader.numpy = numpy_module
+
+        # the 20 bit address wraps around without touching the flags
+        self.assertEqual(memory, bytearray(b'\x00\x40\x00\x00\x00\x00\x11'))
+
+
+class TestDisassembler(unittest.TestCase):
+    """
+    Test decoding object programs back into source programs.
+    """
+    def round_trip(self, filename):
+        from sic_assembler.disasm import disassemble_records
+
+        with open(filename, 'r') as f:
+            output = Assembler(f).assemble()
+
+        listing = disassemble_records(output)
+        result = Assembler(StringIO(listing.source())).assemble()
+        if output[0][1:7].strip() == '':
+            # a program without a name is given one by the disassembler
+            result[0] = output[0][:1] + ' ' * 6 + result[0][7:]
+        self.assertEqual(result, output)
+        return listing
+
+    def test_round_trip(self):
+        listing = self.round_trip('test-programs/page58.asm')
+
+        self.assertEqual(listing.name, 'COPY')
+        self.assertEqual(listing.length, 0x1077)
+
+    def test_round_trip_test_programs(self):
+        import glob
+        from sic_assembler.errors import BaseError
+
+        tested = []
+        for filename in sorted(glob.glob('test-programs/*.asm')):
+            try:
+                with open(filename, 'r') as f:
+                    Assembler(f).assemble()
+            except BaseError:
+                # only the programs this assembler can assemble
+                continue
+            self.round_trip(filename)
+            tested.append(filename)
+        self.assertTrue('test-programs/functions.asm' in tested)
+        self.assertTrue('test-programs/basic.asm' in tested)
+
+    def test_opcode_table(self):
+        from sic_assembler.disasm import opcode_table
+
+        self.assertEqual(len(opcode_table), 256)
+        self.assertEqual(opcode_table[0x4B][0], 'JSUB')
+        self.assertEqual(opcode_table[0xB4][0], 'CLEAR')
+        self.assertTrue(opcode_table[0x48] is None)
+        self.assertTrue(opcode_table[0xF1] is None)
+
+    def test_decode_lines(self):
+        import binascii
+        from sic_assembler.disasm import disassemble
+
+        image = binascii.unhexlify('17202D4B101036B410F1')
+        listing = disassemble(image, start_address=0, length=0x1037)
+        lines = [(x.mnemonic, x.operand, x.target) for x in listing]
+
+        self.assertEqual(lines, [('STL', '', 0x30), ('+JSUB', '', 0x1036),
+                                 ('CLEAR', 'X', None), (None, None, None)])
+        self.assertEqual(listing.labels[0x30], 'L00030')
+
+    def test_binary_round_trip(self):
+        import binascii
+        from sic_assembler.disasm import disassemble
+
+        image = binascii.unhexlify('0D17D0785EFC0A88712065B5E1068617CC'
+                                   '150862BB5021CBCE3E2003454F46B410')
+        listing = disassemble(image, start_address=0x1000, name='IMAGE')
+        output = Assembler(StringIO(listing.source())).assemble()
+        text = ''.join([x[9:] for x in output if x.startswith('T')])
+
+        self.assertEqual(text, binascii.hexlify(image).decode().upper())
+
+
+class TestObjectFile(unittest.TestCase):
+    """
+    Test random access reads of object programs.
+    """
+    def setUp(self):
+        import os
+        import tempfile
+
+        with open('test-programs/page58.asm', 'r') as f:
+            self.output = Assembler(f).assemble()
+
+        fd, self.path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as w:
+            for record in self.output:
+                w.write(record)
+                w.write('\n')
+
+    def tearDown(self):
+        import os
+        os.remove(self.path)
+
+    def test_header_and_entry(self):
+        from sic_assembler.objfile import ObjectFile
+
+        with ObjectFile(self.path) as o:
+            self.assertEqual(o.header, ('COPY', 0, 0x1077))
+            self.assertEqual(o.entry, 0)
+            self.assertEqual(list(o.records('M')), [])
+
+    def test_spans(self):
+        from sic_assembler.objfile import ObjectFile
+
+        o = ObjectFile.from_records(self.output)
+        self.assertEqual(o.text_ranges[:2], [(0, 0x1D), (0x1D, 0x30)])
+        self.assertEqual(o.spans(), [(0, 0x30), (0x1036, 0x1077)])
+
+    def test_read(self):
+        import binascii
+        from sic_assembler.objfile import ObjectFile
+
+        # memory map the file even though it is small
+        with ObjectFile(self.path, mmap_threshold=0) as o:
+            # across two text records
+            data = o.read(0x1A, 0x20)
+            self.assertEqual(binascii.hexlify(data).upper(), b'0320100F2016')
+            # the end of the first span and the BUFFER gap
+            data = o.read(0x2D, 0x32, fill=0xFF)
+            self.assertEqual(binascii.hexlify(data).upper(), b'454F46FFFF')
+
+            start, data = o.read_span(0x1040)
+            self.assertEqual(start, 0x1036)
+            self.assertEqual(len(data), 0x41)
+
+
+class TestCostEstimate(unittest.TestCase):
+    """
+    Test the static estimate of the cost of running a program.
+    """
+    source = """PROG    START   0
+FIRST   LDA     #0
+LOOP    ADD     @PTR
+        +STA    VAL
+        COMP    #10
+        JLT     LOOP
+        JSUB    SUB
+        J       FIRST
+        CLEAR   A
+SUB     LDX     VAL,X
+        RSUB
+PTR     WORD    24
+VAL     RESW    1
+        END     FIRST
+"""
+
+    def estimate(self, **options):
+        a = Assembler(StringIO(self.source))
+        a.assemble()
+        return a.estimate_cost(**options)
+
+    def test_blocks(self):
+        report = self.estimate()
+        blocks = report['blocks']
+        self.assertEqual([x['start'] for x in blocks], [0, 3, 16, 19, 22, 24])
+        loop = blocks[1]
+        self.assertEqual(loop['label'], 'LOOP')
+        self.assertEqual(loop['successors'], [3, 16])
+        # ADD @PTR 5, +STA VAL 4, COMP #10 2 and JLT LOOP 2 cycles
+        self.assertEqual(loop['cycles'], 13)
+        self.assertEqual(loop['accesses'], 8)
+        self.assertEqual(loop['format4'], 1)
+        self.assertEqual(loop['indirect'], 1)
+        self.assertEqual(blocks[2]['calls'], [24])
+        # CLEAR A is never reached
+        self.assertEqual(blocks[4]['subroutine'], None)
+        self.assertEqual(report['unreachable'], 1)
+
+    def test_subroutines_and_loops(self):
+        report = self.estimate()
+        self.assertEqual([(x['label'], x['blocks'], x['cycles'])
+                          for x in report['subroutines']],
+                         [('FIRST', 4, 19), ('SUB', 1, 6)])
+        self.assertEqual([(x['label'], x['latches']) for x in report['loops']],
+                         [('FIRST', [19]), ('LOOP', [3])])
+        # the inner loop is inside the outer one
+        self.assertEqual([x['loop_depth'] for x in report['blocks']],
+                         [1, 2, 1, 1, 0, 0])
+        self.assertEqual(report['hot_spots'][0]['label'], 'LOOP')
+        self.assertEqual(report['hot_spots'][0]['weighted'], 1300)
+
+    def test_cost_table(self):
+        from sic_assembler.cost import CostTable
+
+        table = CostTable(cycles={'ADD': 3}, mode_cycles={'indirect': 0},
+                          access_cycles=2)
+        loop = self.estimate(table=table, top=1)['blocks'][1]
+        self.assertEqual(loop['cycles'], 6 + 2 * 8)
+        self.assertEqual(loop['accesses'], 8)
+
+    def test_page58(self):
+        import json
+
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f)
+            a.assemble()
+        report = a.estimate_cost(top=2)
+        self.assertEqual([x['label'] for x in report['subroutines']],
+                         ['FIRST', 'RDREC', 'WRREC'])
+        self.assertEqual([x['label'] for x in report['loops']],
+                         ['CLOOP', 'RLOOP', 'WLOOP'])
+        # J @RETADR
+        self.assertEqual(report['unknown_targets'], 1)
+        self.assertEqual(len(report['hot_spots']), 2)
+        json.dumps(report)
+
+    def test_command_line(self):
+        from sic_assembler import argument_parser, parse_arguments
+
+        parser = argument_parser()
+        parser.add_argument('file')
+        args = parse_arguments(parser, ['--cost', 'prog.asm'])
+        self.assertEqual((args.file, args.cost), ('prog.asm', '-'))
+        args = parse_arguments(parser, ['prog.asm', '--cost-file',
+                                        'cost.json'])
+        self.assertEqual(args.cost, 'cost.json')
+        self.assertTrue(parse_arguments(parser, ['prog.asm']).cost is None)
+
+
+class TestDebugInfo(unittest.TestCase):
+    """
+    Test writing and querying debug information files.
+    """
+    def setUp(self):
+        import os
+        import tempfile
+
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f)
+            a.assemble()
+            a.write_debug_info(self.path)
+
+    def tearDown(self):
+        import os
+        os.remove(self.path)
+
+    def test_line_lookup(self):
+        from sic_assembler.debuginfo import DebugInfo
+
+        with DebugInfo(self.path) as d:
+            self.assertEqual(d.line_at(0x0006), 5)
+            # inside the RDREC CLEAR instruction and the BUFFER area
+            self.assertEqual(d.line_at(0x1037), 24)
+            self.assertEqual(d.line_at(0x0040), 20)
+
+    def test_symbol_lookup(self):
+        from sic_assembler.debuginfo import DebugInfo
+
+        with DebugInfo(self.path) as d:
+            self.assertEqual(d.symbol_at(0x1038), ('RDREC', 2))
+            self.assertEqual(d.address_of('LENGTH'), 0x33)
+            self.assertEqual(d.address_of('MISSING'), None)
+            self.assertEqual(d.uses_of('LENGTH'),
+                             [0x3, 0x6, 0xA, 0x23, 0x1056, 0x105F])
+            self.assertEqual(d.uses_of('FIRST'), [])
+
+
+class TestColumns(unittest.TestCase):
+    """
+    Test exporting assembled programs as columns and column files.
+    """
+    def setUp(self):
+        import os
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'corpus.col')
+        self.programs = []
+        for name in ('page58.asm', 'basic.asm'):
+            with open('test-programs/' + name, 'r') as f:
+                a = Assembler(f)
+                a.assemble()
+                self.programs.append(a)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def check_page58(self, columns, blob):
+        from sic_assembler.columns import field_names
+
+        row = lambda x: [int(columns[name][x]) for name in field_names]
+        # STL RETADR, +JSUB WRREC and COMP #0
+        self.assertEqual(row(0), [0, 3, 0, 2, 0x30, 0x14, 3, 0b110010])
+        self.assertEqual(row(2), [6, 4, 6, 5, 0x1036, 0x48, 4, 0b110001])
+        self.assertEqual(row(4), [13, 3, 13, 7, -1, 0x28, 3, 0b010000])
+        # EOF  BYTE C'EOF'
+        x = list(columns['address']).index(0x2D)
+        self.assertEqual(row(x)[:2], [0x2D, 3])
+        self.assertEqual(row(x)[4:], [-1, -1, 0, 0])
+        offset = int(columns['offset'][x])
+        self.assertEqual(blob[offset:offset+3], b'EOF')
+
+    def test_export(self):
+        columns, blob = self.programs[0].export_columns()
+        self.check_page58(columns, blob)
+        self.assertEqual(len(blob), sum(int(x) for x in columns['size']))
+
+    def test_export_without_numpy(self):
+        import sic_assembler.columns as columns
+
+        numpy_module = columns.numpy
+        columns.numpy = None
+        try:
+            exported, blob = self.programs[0].export_columns()
+            self.assertTrue(isinstance(exported, dict))
+            self.check_page58(exported, blob)
+        finally:
+            columns.numpy = numpy_module
+
+    def test_append_and_read(self):
+        from sic_assembler.columns import ColumnFile, append_programs
+
+        self.assertEqual(append_programs(self.path, self.programs[:1]), 1)
+        self.assertEqual(append_programs(self.path, self.programs), 2)
+        expected = [x.export_columns() for x in self.programs]
+
+        with ColumnFile(self.path) as f:
+            self.assertEqual(len(f), 3)
+            self.assertEqual(f.names[0], 'COPY')
+            name, columns, blob = f.program(1)
+            self.check_page58(columns, blob)
+            self.assertEqual(f.program(2)[2], expected[1][1])
+
+            rows, starts = f.columns()
+            counts = [len(x[0]['address']) for x in expected]
+            self.assertEqual(list(starts), [0, counts[0], 2 * counts[0]])
+            self.assertEqual(len(rows['address']), 2 * counts[0] + counts[1])
+
+    def test_read_without_numpy(self):
+        import sic_assembler.columns as columns
+
+        columns.append_programs(self.path, self.programs)
+        numpy_module = columns.numpy
+        columns.numpy = None
+        try:
+            with columns.ColumnFile(self.path) as f:
+                name, exported, blob = f.program(0)
+                self.check_page58(exported, blob)
+        finally:
+            columns.numpy = numpy_module
+
+    def test_not_a_column_file(self):
+        from sic_assembler.columns import ColumnFile
+        from sic_assembler.errors import RecordError
+
+        with open(self.path, 'wb') as f:
+            f.write(b'HCOPY  00000000107A' * 2)
+        self.assertRaises(RecordError, ColumnFile, self.path)
+
+
+class TestExpressions(unittest.TestCase):
+    """
+    Test operand expressions and symbols defined with EQU.
+    """
+    source = """PROG    START   1000
+FIRST   +LDT    #MAXLEN
+LOOP    TD      DEV
+        JEQ     *-3
+        +LDA    BUFEND-3
+        J       LOOP
+HALF    EQU     MAXLEN-2048
+MAXLEN  EQU     BUFEND-BUFFER
+DEV     BYTE    X'F1'
+BUFFER  RESB    4096
+BUFEND  EQU     *
+        WORD    5
+        END     FIRST
+"""
+
+    def test_compile_expression(self):
+        from sic_assembler.expressions import compile_expression
+
+        expression = compile_expression('BUFEND-BUFFER+3')
+        self.assertTrue(compile_expression('BUFEND-BUFFER+3') is expression)
+        self.assertEqual(expression.symbols, ['BUFEND', 'BUFFER'])
+        self.assertEqual(expression.evaluate({'BUFEND': '0x40',
+                                              'BUFFER': '0x30'}), 0x13)
+        self.assertEqual(expression.evaluate({'BUFEND': '0x40'}), None)
+        self.assertEqual(compile_expression('*-3').evaluate({}, 0x10), 0xD)
+        self.assertEqual(compile_expression('-A+-4').evaluate({'A': '0x1'}),
+                         -5)
+
+    def test_invalid_expression(self):
+        from sic_assembler.errors import ExpressionError
+        from sic_assembler.expressions import compile_expression
+
+        for text in ('A-', 'A B', "C'EOF'", '+'):
+            self.assertRaises(ExpressionError, compile_expression, text)
+
+    def test_equates(self):
+        a = Assembler(StringIO(self.source))
+        output = a.assemble()
+
+        self.assertEqual(a.symtab['BUFEND'], '0x2012')
+        self.assertEqual(a.symtab['MAXLEN'], '0x1000')
+        self.assertEqual(a.symtab['HALF'], '0x800')
+        self.assertEqual(output[1],
+                         'T0010001275101000E3200A332FFA0310200F3F2FF3F1')
+
+    def test_equates_after_relaxation(self):
+        a = Assembler(StringIO(self.source), relax=True)
+        a.assemble()
+
+        # MAXLEN is an absolute 4096, too large for a displacement, so
+        # +LDT keeps format 4 and BUFEND stays where it was
+        self.assertEqual(a.symtab['BUFEND'], '0x2012')
+        self.assertEqual(a.symtab['MAXLEN'], '0x1000')
+        self.assertEqual(a.relaxation_report['extended'], 2)
+
+    def test_absolute_symbols(self):
+        from sic_assembler.expressions import compile_expression
+
+        a = Assembler(StringIO(self.source))
+        a.assemble()
+        self.assertEqual(a.absolute, set(['MAXLEN', 'HALF']))
+        self.assertTrue(compile_expression('BUFEND-BUFFER').is_absolute(()))
+        self.assertFalse(compile_expression('BUFEND-3').is_absolute(()))
+        self.assertFalse(compile_expression('*').is_absolute(()))
+
+    def test_absolute_immediate(self):
+        source = """PROG    START   1000
+        LDT     #TEN
+        LDA     TEN
+        RSUB
+TEN     EQU     10
+        END
+"""
+        output = Assembler(StringIO(source)).assemble()
+        # the value is the displacement, with b=0 and p=0
+        self.assertEqual(output[1], 'T0010000975000A03000A4F0000')
+
+    def test_format_4_out_of_range(self):
+        from sic_assembler.errors import InstructionError
+
+        for operand in ('#2000000', 'FAR'):
+            source = """PROG    START   0
+        +LDA    %s
+        RSUB
+FAR     EQU     1048576
+        END
+""" % operand
+            a = Assembler(StringIO(source))
+            self.assertRaises(InstructionError, a.assemble)
+
+    def test_encoding_error_line_numbers(self):
+        from sic_assembler.errors import InstructionError, \
+            UndefinedSymbolError
+
+        for line, error in (('+LDA    #2000000', InstructionError),
+                            ('+LDA    MISSING', UndefinedSymbolError),
+                            ('LDA     MISSING', UndefinedSymbolError),
+                            ('LDA     FAR', InstructionError)):
+            source = """PROG    START   0
+        RSUB
+        %s
+GAP     RESB    8000
+FAR     WORD    1
+        END
+""" % line
+            a = Assembler(StringIO(source))
+            try:
+                a.assemble()
+            except error as e:
+                self.assertEqual(e.details['line_number'], 3)
+                self.assertTrue(e.message.endswith('on line: 3'))
+                self.assertEqual(e.details['contents'].operand,
+                                 line.split()[1])
+            else:
+                self.fail('%s was not raised' % error.__name__)
+
+    def test_absolute_not_relocated(self):
+        source = """PROG    START   0
+        +LDT    #MAXLEN
+        +LDA    BUFFER
+BUFFER  RESB    4096
+MAXLEN  EQU     4096
+        END
+"""
+        output = Assembler(StringIO(source), relocatable=True).assemble()
+        self.assertEqual(output[1], 'T000000087510100003100008')
+        # only the address of BUFFER is relocated
+        self.assertEqual([x for x in output if x.startswith('M')],
+                         ['M00000505'])
+
+    def test_circular_definition(self):
+        from sic_assembler.errors import CircularDefinitionError
+
+        source = """PROG    START   0
+FIRST   LDA     A
+A       EQU     B+1
+B       EQU     C
+C       EQU     A-1
+D       EQU     C
+        END     FIRST
+"""
+        a = Assembler(StringIO(source))
+        with self.assertRaises(CircularDefinitionError) as context:
+            a.assemble()
+        self.assertEqual(context.exception.details['symbols'],
+                         ['A', 'B', 'C'])
+        self.assertEqual(context.exception.details['line_number'], 3)
+
+
+class TestDataDirectives(unittest.TestCase):
+    """
+    Test the BYTE and WORD directives, with many values and long constants.
+    """
+    def generate(self, mnemonic, operand):
+        from sic_assembler.dispatch import dispatch_table
+
+        entry = dispatch_table[mnemonic]
+        source_line = SourceLine(0, None, mnemonic, operand)
+        return entry.second_pass(None, source_line, entry)[2]
+
+    def test_word(self):
+        self.assertEqual(self.generate('WORD', '0'), '000000')
+        self.assertEqual(self.generate('WORD', '4096'), '001000')
+        self.assertEqual(self.generate('WORD', '-1,0,5,16777215'),
+                         'FFFFFF000000000005FFFFFF')
+
+    def test_invalid_word(self):
+        from sic_assembler.errors import LineFieldsError
+
+        for operand in ('16777216', '-8388609', 'ONE', '1,,2'):
+            with self.assertRaises(LineFieldsError):
+                self.generate('WORD', operand)
+
+    def test_byte(self):
+        self.assertEqual(self.generate('BYTE', "C'CAT'"), '434154')
+        self.assertEqual(self.generate('BYTE', "X'00f1'"), '00F1')
+        self.assertEqual(SourceLine.parse("MSG     BYTE    C'HI THERE'", 0)
+                         .operand, "C'HI THERE'")
+
+    def test_invalid_byte(self):
+        from sic_assembler.errors import LineFieldsError
+
+        for operand in ("X'F'", "X'GG'", "C'EOF", "'EOF'"):
+            with self.assertRaises(LineFieldsError):
+                self.generate('BYTE', operand)
+
+    def test_operands_with_spaces(self):
+        source_line = SourceLine.parse("TABLE   WORD    1, 2,  3", 0)
+        self.assertEqual((source_line.label, source_line.operand),
+                         ('TABLE', '1,2,3'))
+
+    def test_long_data(self):
+        from sic_assembler.pipeline import StreamAssembler
+
+        source = """DATA    START   0
+FIRST   LDA     #0
+TABLE   WORD    %s
+TEXT    BYTE    C'%s'
+        END     FIRST
+""" % (','.join(str(x) for x in range(-50, 50)), 'HELLO WORLD ' * 10)
+        output = Assembler(StringIO(source)).assemble()
+        text = [x for x in output if x.startswith('T')]
+        self.assertTrue(all(len(x) <= 69 for x in text))
+        self.assertEqual(output[0], 'HDATA  0000000001A7')
+        # the table doesn't fit after LDA, it starts a new record
+        self.assertEqual(text[0], 'T00000003010000')
+        self.assertEqual(text[1], 'T0000031E' + 'FFFFCEFFFFCFFFFFD0FFFFD1'
+                         'FFFFD2FFFFD3FFFFD4FFFFD5FFFFD6FFFFD7')
+
+        # every address follows the one before
+        address = 0
+        for record in text:
+            self.assertEqual(int(record[1:7], 16), address)
+            address += int(record[7:9], 16)
+        self.assertEqual(address, 0x1A7)
+
+        streamed = []
+        StreamAssembler(StringIO(source), streamed.append).assemble()
+        self.assertEqual(sorted(streamed), sorted(output))
+
+
+class TestMemoryProfile(unittest.TestCase):
+    """
+    Test the memory profile of each phase of the assembler.
+    """
+    def assemble(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f, memprofile=True)
+            a.assemble()
+        return a
+
+    def test_unavailable(self):
+        available = memprofile.available
+        memprofile.available = False
+        try:
+            a = self.assemble()
+        finally:
+            memprofile.available = available
+        self.assertEqual(a.memory_report, {'available': False})
+        self.assertEqual(len(a.generated_records), 7)
+
+    @unittest.skipUnless(memprofile.available, 'tracemalloc is not available')
+    def test_report(self):
+        import json
+
+        report = self.assemble().memory_report
+        self.assertEqual([x['phase'] for x in report['phases']],
+                         ['read', 'first_pass', 'second_pass',
+                          'generate_records'])
+        self.assertEqual(report['lines'], 44)
+        self.assertEqual(report['objects']['records']['count'], 7)
+        self.assertTrue(report['bytes_per_line'] > 0)
+        self.assertTrue(len(report['top_sources']) > 0)
+        json.dumps(report)
+
+    @unittest.skipUnless(memprofile.available, 'tracemalloc is not available')
+    def test_stops_tracing_on_error(self):
+        import tracemalloc
+        from sic_assembler.errors import UndefinedSymbolError
+
+        source = """PROG    START   0
+        LDA     MISSING
+        END
+"""
+        a = Assembler(StringIO(source), memprofile=True)
+        self.assertRaises(UndefinedSymbolError, a.assemble)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_command_line(self):
+        from sic_assembler import argument_parser, parse_arguments
+
+        parser = argument_parser()
+        parser.add_argument('file')
+        args = parse_arguments(parser, ['--memprofile', 'prog.asm'])
+        self.assertEqual((args.file, args.memprofile), ('prog.asm', '-'))
+        args = parse_arguments(parser, ['prog.asm', '--memprofile-file',
+                                        'memory.json'])
+        self.assertEqual(args.memprofile, 'memory.json')
+        args = parse_arguments(parser, ['prog.asm'])
+        self.assertTrue(args.memprofile is None)
+
+    def test_write_report(self):
+        import json
+        import os
+        import shutil
+        import sys
+        import tempfile
+        from sic_assembler import write_memory_report
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'memory.json')
+            available = memprofile.available
+            memprofile.available = False
+            try:
+                a = self.assemble()
+            finally:
+                memprofile.available = available
+            stderr, sys.stderr = sys.stderr, StringIO()
+            try:
+                write_memory_report(a.memory_report, path)
+                notice = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            self.assertTrue(notice.startswith('[Memory Profile]: '))
+            with open(path, 'r') as f:
+                self.assertEqual(json.load(f), {'available': False})
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestCheckpoint(unittest.TestCase):
+    """
+    Test saving the state after pass 1 and resuming pass 2 from it.
+    """
+    def setUp(self):
+        import os
+        import tempfile
+
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        import os
+        os.remove(self.path)
+
+    def test_resume_pass_2(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            expected = Assembler(f, relocatable=True).assemble()
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f)
+            a.first_pass()
+            a.save_pass1(self.path)
+
+        b = Assembler(None, relocatable=True)
+        b.load_pass1(self.path)
+        self.assertEqual(b.symtab, a.symtab)
+        self.assertEqual(b.program_name, 'COPY')
+        self.assertEqual(b.end_operand, 'FIRST')
+        self.assertEqual([(x.line_number, x.location, x.label, x.mnemonic,
+                           x.operand) for x in b.temp_contents],
+                         [(x.line_number, x.location, x.label, x.mnemonic,
+                           x.operand) for x in a.temp_contents])
+        self.assertEqual(b.assemble(), expected)
+
+    def test_not_a_checkpoint(self):
+        from sic_assembler.errors import RecordError
+
+        with open(self.path, 'wb') as f:
+            f.write(b'SICD' + b'\0' * 40)
+        with self.assertRaises(RecordError):
+            Assembler(None).load_pass1(self.path)
+
+
+class TestSections(unittest.TestCase):
+    """
+    Test splitting a program into control sections and assembling them.
+    """
+    def sections(self):
+        from sic_assembler.sections import split_sections
+
+        with open('test-programs/csect.asm', 'r') as f:
+            return split_sections(f.read().splitlines())
+
+    def test_split_sections(self):
+        sections = self.sections()
+        self.assertEqual([(x.name, x.line_offset) for x in sections],
+                         [(None, 0), ('RDREC', 24), ('WRREC', 45)])
+        self.assertEqual(sections[1].lines[0], 'RDREC START 0')
+        # the END directive is given to the first section
+        self.assertEqual(sections[0].lines[-1].split(), ['END', 'FIRST'])
+        self.assertEqual(sections[2].lines[-1].split(), ['OUTPUT', 'BYTE',
+                                                         "X'05'"])
+
+    def test_records(self):
+        from sic_assembler.sections import assemble_sections
+
+        output = assemble_sections(self.sections(), processes=1)
+        self.assertEqual(output[:3], ['HCOPY  000000001033',
+                                      'DBUFFER000033BUFEND001033LENGTH000030',
+                                      'RRDREC WRREC '])
+        self.assertEqual([x for x in output if x.startswith('M')],
+                         ['M00000405+RDREC', 'M00001105+WRREC',
+                          'M00002405+WRREC', 'M00001805+BUFFER',
+                          'M00002105+LENGTH', 'M00000305+LENGTH',
+                          'M00000D05+BUFFER'])
+        self.assertEqual([x for x in output if x.startswith('E')],
+                         ['E000000', 'E', 'E'])
+        self.assertEqual(output[-6:-4], ['HWRREC 00000000001C',
+                                         'RLENGTHBUFFER'])
+
+    def test_same_as_sequential(self):
+        from sic_assembler.sections import assemble_sections
+
+        sections = self.sections()
+        self.assertEqual(assemble_sections(sections, processes=3,
+                                           relocatable=True),
+                         assemble_sections(sections, processes=1,
+                                           relocatable=True))
+
+    def test_single_program(self):
+        from sic_assembler.sections import assemble_sections, split_sections
+
+        with open('test-programs/page58.asm', 'r') as f:
+            lines = f.read().splitlines()
+        with open('test-programs/page58.asm', 'r') as f:
+            expected = Assembler(f).assemble()
+        self.assertEqual(assemble_sections(split_sections(lines)), expected)
+
+    def test_error_line_number(self):
+        from sic_assembler.errors import OpcodeLookupError
+        from sic_assembler.sections import assemble_sections
+
+        sections = self.sections()
+        sections[1].lines[5] = '        BOGUS   X'
+        with self.assertRaises(OpcodeLookupError) as context:
+            assemble_sections(sections, processes=2)
+        self.assertEqual(context.exception.details['line_number'], 30)
+
+    def test_external_reference_needs_format_4(self):
+        from sic_assembler.errors import InstructionError
+        from sic_assembler.sections import assemble_sections, split_sections
+
+        source = ["PROG    START   0",
+                  "        EXTREF  OTHER",
+                  "        LDA     OTHER",
+                  "        END     PROG"]
+        with self.assertRaises(InstructionError):
+            assemble_sections(split_sections(source), processes=1)
+
+
+class TestEngine(unittest.TestCase):
+    """
+    Test assembling many programs at once on a pool of threads.
+    """
+    programs = ['test-programs/basic.asm', 'test-programs/functions.asm',
+                'test-programs/page58.asm',
+                'test-programs/page58-syntax-changes.asm']
+
+    def test_same_as_assembler(self):
+        from sic_assembler.engine import Engine
+
+        with open('test-programs/page58.asm', 'r') as f:
+            source = f.read()
+        expected = Assembler(StringIO(source), relax=True).assemble()
+        self.assertEqual(Engine(relax=True).assemble(source), expected)
+
+    def test_lines_reused(self):
+        from sic_assembler.engine import Engine
+        from sic_assembler.errors import DuplicateSymbolError
+
+        engine = Engine()
+        with open('test-programs/page58.asm', 'r') as f:
+            source = f.read()
+        expected = engine.assemble(source)
+        cached = len(engine.lines)
+        self.assertTrue(cached > 0)
+        self.assertEqual(engine.assemble(source), expected)
+        self.assertEqual(len(engine.lines), cached)
+
+        # a line from the cache still has its own line number
+        lines = source.splitlines()
+        lines.insert(3, lines[1])
+        with self.assertRaises(DuplicateSymbolError) as context:
+            engine.assemble(lines)
+        self.assertEqual(context.exception.details['line_number'], 4)
+
+    def test_threads(self):
+        import threading
+        from sic_assembler.engine import Engine
+
+        engine = Engine(relax=True, relocatable=True)
+        sources = []
+        for path in self.programs:
+            with open(path, 'r') as f:
+                sources.append(f.read())
+        expected = [engine.assemble(x) for x in sources]
+
+        results = []
+        errors = []
+
+        def work(offset):
+            try:
+                for x in range(20):
+                    index = (offset + x) % len(sources)
+                    results.append((index, engine.assemble(sources[index])))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(x,))
+                   for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 8 * 20)
+        for index, records in results:
+            self.assertEqual(records, expected[index])
+
+
+class TestInclude(unittest.TestCase):
+    """
+    Test the INCLUDE directive and the cache of parsed include files.
+    """
+    def setUp(self):
+        import tempfile
+        from sic_assembler import includes
+
+        self.directory = tempfile.mkdtemp()
+        self.lib = self.write('lib/util.asm', """. doubling routine
+DOUBLE  ADD     TWO
+        RSUB
+""")
+        self.write('lib/consts.asm', """TWO     WORD    2
+THREE   WORD    3
+""")
+        self.main = self.write('main.asm', """MAIN    START   1000
+FIRST   LDA     #5
+        INCLUDE 'util.asm'
+        JSUB    DOUBLE
+        STA     RESULT
+        INCLUDE consts.asm
+RESULT  RESW    1
+        END     FIRST
+""")
+        includes.clear_cache()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def write(self, name, contents):
+        import os
+
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def assemble(self, path, **options):
+        import os
+
+        with open(path, 'r') as f:
+            a = Assembler(f, include_paths=[os.path.join(self.directory,
+                                                         'lib')], **options)
+            a.assemble()
+        return a
+
+    def test_same_as_one_file(self):
+        source = """MAIN    START   1000
+FIRST   LDA     #5
+DOUBLE  ADD     TWO
+        RSUB
+        JSUB    DOUBLE
+        STA     RESULT
+TWO     WORD    2
+THREE   WORD    3
+RESULT  RESW    1
+        END     FIRST
+"""
+        a = self.assemble(self.main)
+        self.assertEqual(a.generated_records,
+                         Assembler(StringIO(source)).assemble())
+        self.assertEqual(a.symtab['DOUBLE'], '0x1003')
+        # the INCLUDE line comes before the lines it includes
+        self.assertEqual(a.temp_contents[1].mnemonic, 'INCLUDE')
+        self.assertEqual(a.temp_contents[2].filename, self.lib)
+
+    def test_labeled_include_laid_out_again(self):
+        self.write('main.asm', """MAIN    START   1000
+FIRST   LDA     #5
+SUB     INCLUDE util.asm
+        STA     RESULT
+        J       SUB
+        INCLUDE consts.asm
+RESULT  RESW    1
+        END     FIRST
+""")
+        expected = self.assemble(self.main)
+        self.assertEqual(expected.symtab['SUB'], '0x1003')
+        for options in ({'relax': True}, {'peephole': True}):
+            a = self.assemble(self.main, **options)
+            # the label stays at the first included line
+            self.assertEqual(a.symtab['SUB'], a.symtab['DOUBLE'])
+            self.assertEqual(a.generated_records,
+                             expected.generated_records)
+
+    def test_parallel_first_pass(self):
+        import sic_assembler.parallel as parallel
+
+        min_chunk_lines = parallel.min_chunk_lines
+        parallel.min_chunk_lines = 1
+        try:
+            a = self.assemble(self.main, processes=2)
+        finally:
+            parallel.min_chunk_lines = min_chunk_lines
+        self.assertEqual(a.generated_records,
+                         self.assemble(self.main).generated_records)
+
+    def test_cache(self):
+        import os
+        from sic_assembler import includes
+
+        self.assemble(self.main)
+        self.assemble(self.main)
+        self.assertEqual(includes.cache_info, {'hits': 2, 'misses': 2})
+
+        # a changed file is parsed again
+        self.write('lib/consts.asm', "TWO     WORD    2\n")
+        a = self.assemble(self.main)
+        self.assertEqual(includes.cache_info, {'hits': 3, 'misses': 3})
+        self.assertFalse('THREE' in a.symtab)
+
+    def test_error_in_included_file(self):
+        from sic_assembler.errors import OpcodeLookupError
+
+        self.write('lib/consts.asm', "TWO     WORD    2\n        BOGUS   3\n")
+        with self.assertRaises(OpcodeLookupError) as context:
+            self.assemble(self.main)
+        self.assertEqual(context.exception.details['line_number'], 2)
+        self.assertTrue(context.exception.details['filename'].endswith(
+            'consts.asm'))
+
+    def test_limits_in_included_file(self):
+        from sic_assembler.errors import ResourceLimitError
+        from sic_assembler.limits import Limits
+
+        for options in ({}, {'processes': 2}):
+            with self.assertRaises(ResourceLimitError) as context:
+                self.assemble(self.main, limits=Limits(symbols=3), **options)
+            # THREE, on the second line of consts.asm
+            self.assertEqual(context.exception.details['line_number'], 2)
+            self.assertTrue(context.exception.details['filename'].endswith(
+                'consts.asm'))
+
+    def test_checkpoint(self):
+        import os
+        from sic_assembler.errors import UndefinedSymbolError
+
+        self.write('lib/consts.asm',
+                   "TWO     WORD    2\n        LDA     NONE\n")
+        path = os.path.join(self.directory, 'pass1.chk')
+        with open(self.main, 'r') as f:
+            a = Assembler(f, include_paths=[os.path.join(self.directory,
+                                                         'lib')])
+            a.first_pass()
+            a.save_pass1(path)
+
+        b = Assembler(None)
+        b.load_pass1(path)
+        self.assertEqual([x.filename for x in b.temp_contents],
+                         [x.filename for x in a.temp_contents])
+        # an error in pass 2 still names the included file
+        with self.assertRaises(UndefinedSymbolError) as context:
+            b.assemble()
+        self.assertEqual(context.exception.details['line_number'], 2)
+        self.assertTrue(context.exception.details['filename'].endswith(
+            'consts.asm'))
+
+    def test_circular_include(self):
+        import os
+        from sic_assembler.errors import IncludeError
+
+        self.write('lib/consts.asm', "        INCLUDE util.asm\n")
+        self.write('lib/util.asm', "        INCLUDE consts.asm\n")
+        with self.assertRaises(IncludeError) as context:
+            self.assemble(self.main)
+        self.assertEqual([os.path.basename(x)
+                          for x in context.exception.details['files']],
+                         ['util.asm', 'consts.asm'])
+
+    def test_lines_of_a_file(self):
+        from sic_assembler.errors import IncludeError
+
+        self.write('local.asm', "TWO     WORD    2\n")
+        lines = ["MAIN    START   0", "        LDA     TWO",
+                 "        INCLUDE local.asm", "        END"]
+        # the INCLUDE files are next to the file the lines came from
+        a = Assembler.from_lines(lines, source_path=self.main)
+        a.assemble()
+        self.assertEqual(a.symtab['TWO'], '0x3')
+
+        # and the file itself is being included
+        self.write('main.asm', "        INCLUDE main.asm\n")
+        a = Assembler.from_lines(lines[:2] + ["        INCLUDE main.asm"],
+                                 source_path=self.main)
+        with self.assertRaises(IncludeError) as context:
+            a.assemble()
+        self.assertEqual(context.exception.details['line_number'], 3)
+
+    def test_not_found(self):
+        from sic_assembler.errors import IncludeError
+
+        with self.assertRaises(IncludeError) as context:
+            with open(self.main, 'r') as f:
+                Assembler(f).assemble()
+        self.assertEqual(context.exception.details['line_number'], 3)
+
+
+class TestResourceLimits(unittest.TestCase):
+    """
+    Test stopping a program which uses more than its limits.
+    """
+    source = """PROG    START   0
+FIRST   CLEAR   A
+        J       FIRST
+BUF     RESB    10
+LAST    WORD    1
+        END     FIRST
+"""
+
+    def assertLimit(self, limit, function, *args, **kwargs):
+        from sic_assembler.errors import ResourceLimitError
+
+        with self.assertRaises(ResourceLimitError) as context:
+            function(*args, **kwargs)
+        self.assertEqual(context.exception.details['limit'], limit)
+        return context.exception
+
+    def test_within_limits(self):
+        from sic_assembler.limits import Limits
+
+        limits = Limits(source_bytes=10000, source_lines=100, symbols=100,
+                        output_bytes=1000, seconds=60)
+        with open('test-programs/page58.asm', 'r') as f:
+            expected = Assembler(f).assemble()
+        with open('test-programs/page58.asm', 'r') as f:
+            self.assertEqual(Assembler(f, limits=limits).assemble(),
+                             expected)
+
+    def test_address_space(self):
+        source = self.source.replace('RESB    10', 'RESB    99999999')
+        a = Assembler(StringIO(source))
+        e = self.assertLimit('address_space', a.assemble)
+        self.assertEqual(e.details['line_number'], 4)
+        self.assertEqual(e.details['maximum'], 0x100000)
+
+    def test_address_space_parallel(self):
+        source = self.source.replace('RESB    10', 'RESB    99999999')
+        a = Assembler(StringIO(source), processes=2)
+        e = self.assertLimit('address_space', a.assemble)
+        self.assertEqual(e.details['line_number'], 4)
+
+    def test_parallel_line_numbers(self):
+        from sic_assembler.limits import Limits
+
+        for limits, limit in ((Limits(symbols=2), 'symbols'),
+                              (Limits(source_lines=4), 'source_lines')):
+            a = Assembler.from_lines(self.source.splitlines(), processes=2,
+                                     limits=limits)
+            e = self.assertLimit(limit, a.assemble)
+            self.assertEqual(e.details['line_number'], 5)
+
+    def test_source_lines(self):
+        from sic_assembler.limits import Limits
+
+        e = self.assertLimit('source_lines', Assembler,
+                             StringIO(self.source),
+                             limits=Limits(source_lines=4))
+        self.assertEqual(e.details['line_number'], 5)
+
+        a = Assembler.from_lines(self.source.splitlines(),
+                                 limits=Limits(source_lines=4))
+        self.assertLimit('source_lines', a.assemble)
+
+    def test_endless_input(self):
+        from sic_assembler.limits import Limits
+
+        class Endless(object):
+            def readline(self, size=-1):
+                return 'BUF     RESB    1\n'
+
+        self.assertLimit('source_bytes', Assembler, Endless(),
+                         limits=Limits(source_bytes=1000))
+
+    def test_symbols(self):
+        from sic_assembler.limits import Limits
+
+        a = Assembler(StringIO(self.source), limits=Limits(symbols=2))
+        e = self.assertLimit('symbols', a.assemble)
+        self.assertEqual(e.details['line_number'], 5)
+
+    def test_output_bytes(self):
+        from sic_assembler.limits import Limits
+
+        a = Assembler(StringIO(self.source), limits=Limits(output_bytes=40))
+        self.assertLimit('output_bytes', a.assemble)
+
+    def test_time(self):
+        from sic_assembler.limits import Limits
+
+        a = Assembler(StringIO(self.source), limits=Limits(seconds=-1))
+        self.assertLimit('seconds', a.assemble)
+
+    def test_engine(self):
+        from sic_assembler.engine import Engine
+        from sic_assembler.limits import Limits
+
+        engine = Engine(limits=Limits(source_bytes=50))
+        self.assertLimit('source_bytes', engine.assemble, self.source)
+
+    def test_stream(self):
+        from sic_assembler.limits import Limits
+        from sic_assembler.pipeline import StreamAssembler
+
+        source = self.source.replace('RESB    10', 'RESB    99999999')
+        a = StreamAssembler(StringIO(source), lambda x: None)
+        self.assertLimit('address_space', a.assemble)
+        a = StreamAssembler(StringIO(self.source), lambda x: None,
+                            limits=Limits(output_bytes=40))
+        self.assertLimit('output_bytes', a.assemble)
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Test assembling in a single pass and emitting records while reading.
+    """
+    def test_same_records_as_batch(self):
+        from sic_assembler.pipeline import StreamAssembler
+
+        with open('test-programs/page58.asm', 'r') as f:
+            expected = Assembler(f, relocatable=True).assemble()
+        output = []
+        with open('test-programs/page58.asm', 'r') as f:
+            report = StreamAssembler(f, output.append,
+                                     relocatable=True).assemble()
+
+        self.assertEqual(sorted(output), sorted(expected))
+        self.assertEqual(output[-1], expected[-1])
+        self.assertEqual(report['records'], 5)
+        # the records with forward references to RDREC, WRREC and LENGTH
+        self.assertEqual(report['held_back'], 3)
+        self.assertTrue(report['first_record'] is not None)
+
+    def test_emits_before_end_of_input(self):
+        from sic_assembler.pipeline import StreamAssembler
+
+        source = """PROG    START   0
+FIRST   CLEAR   A
+        J       FIRST
+BUF     RESB    10
+        LDA     LATER
+LATER   WORD    1
+        END     FIRST
+"""
+        read = []
+        output = []
+
+        def lines():
+            for line in source.splitlines():
+                read.append(line)
+                yield line
+
+        def emit(record):
+            output.append((len(read), record))
+
+        header = []
+        StreamAssembler(lines(), emit, header.append).assemble()
+
+        # the first record is complete when the line after RESB is read
+        self.assertEqual(output[0], (5, 'T00000005B4003F2FFB'))
+        self.assertEqual(output[1], (7, 'T00000F06032000000001'))
+        self.assertEqual(header, ['HPROG  000000000015'])
+
+    def test_undefined_symbol(self):
+        from sic_assembler.errors import UndefinedSymbolError
+        from sic_assembler.pipeline import StreamAssembler
+
+        source = """PROG    START   0
+FIRST   CLEAR   A
+        J       MISSING
+        END     FIRST
+"""
+        a = StreamAssembler(StringIO(source), lambda x: None)
+        with self.assertRaises(UndefinedSymbolError) as context:
+            a.assemble()
+        self.assertEqual(context.exception.details['line_number'], 3)
+
+    def test_parse_error_line_number(self):
+        from sic_assembler.errors import LineFieldsError
+        from sic_assembler.pipeline import StreamAssembler
+
+        lines = ['PROG    START   0', 'FIRST   CLEAR   A',
+                 '        END     FIRST']
+        for x in (0, 2):
+            source = '\n'.join(lines[:x] + ['TOO     MANY    FIELDS  HERE'] +
+                               lines[x:]) + '\n'
+            for a in (Assembler(StringIO(source)),
+                      StreamAssembler(StringIO(source), lambda x: None)):
+                with self.assertRaises(LineFieldsError) as context:
+                    a.assemble()
+                self.assertEqual(context.exception.details['line_number'],
+                                 x + 1)
+
+
+class TestMultiProgram(unittest.TestCase):
+    """
+    Test assembling every program in a stream of several programs.
+    """
+    source = """. first program
+ONE     START   0
+FIRST   LDA     #1
+        STA     X1
+X1      RESW    1
+        END     FIRST
+
+TWO     START   100
+        LDA     MISSING
+        END
+. third
+THREE   START   0
+        CLEAR   A
+        RSUB
+        END
+"""
+
+    def test_split_programs(self):
+        from sic_assembler.multiprogram import split_programs
+
+        programs = list(split_programs(StringIO(self.source)))
+        self.assertEqual([x.index for x in programs], [1, 2, 3])
+        self.assertEqual([x.line_offset for x in programs], [1, 7, 11])
+        self.assertEqual(programs[1].lines, ['TWO     START   100',
+                                             '        LDA     MISSING',
+                                             '        END'])
+
+    def test_failure_does_not_stop_later_programs(self):
+        from sic_assembler.errors import UndefinedSymbolError
+        from sic_assembler.multiprogram import assemble_programs
+
+        results = list(assemble_programs(StringIO(self.source)))
+        self.assertEqual([x.name for x in results], ['ONE', 'TWO', 'THREE'])
+        self.assertTrue(isinstance(results[1].error, UndefinedSymbolError))
+        # the line number is the line in the whole stream
+        self.assertEqual(results[1].error.message,
+                         'Undefined symbol on line: 9')
+
+        expected = Assembler(StringIO('\n'.join(
+            self.source.splitlines()[11:]))).assemble()
+        self.assertEqual(results[2].records, expected)
+        self.assertEqual(results[0].records[0], 'HONE   000000000009')
+
+    def test_read_ahead(self):
+        from sic_assembler.multiprogram import assemble_programs
+
+        results = list(assemble_programs(StringIO(self.source)))
+        background = list(assemble_programs(StringIO(self.source), True))
+        self.assertEqual([x.records for x in background],
+                         [x.records for x in results])
+
+    def test_source_limits(self):
+        from sic_assembler.errors import ResourceLimitError
+        from sic_assembler.limits import Limits
+        from sic_assembler.multiprogram import assemble_programs
+
+        long_program = ['LONG    START   0'] + \
+            ['        CLEAR   A'] * 5000 + ['        END']
+        lines = long_program + self.source.splitlines()
+        results = list(assemble_programs(lines,
+                                         limits=Limits(source_bytes=100)))
+        self.assertEqual([x.name for x in results],
+                         ['LONG', 'ONE', 'TWO', 'THREE'])
+        self.assertTrue(isinstance(results[0].error, ResourceLimitError))
+        self.assertEqual(results[0].error.details['limit'], 'source_bytes')
+        self.assertEqual(len(results[1].records), 3)
+
+        # a program without an END isn't kept past the limit
+        def endless():
+            yield 'LOOP    START   0'
+            while True:
+                yield '        CLEAR   A'
+
+        results = assemble_programs(endless(), limits=Limits(source_lines=10))
+        result = next(results)
+        self.assertEqual(result.error.details['limit'], 'source_lines')
+        self.assertEqual(result.error.details['line_number'], 11)
+
+    def test_programming_errors_raised(self):
+        from sic_assembler.multiprogram import assemble_programs
+
+        with self.assertRaises(TypeError):
+            list(assemble_programs(StringIO(self.source), relax=True,
+                                   no_such_option=True))
+
+    def test_reader_error(self):
+        from sic_assembler.multiprogram import assemble_programs
+
+        def lines():
+            for line in self.source.splitlines()[:6]:
+                yield line
+            raise IOError('lost the input')
+
+        results = assemble_programs(lines(), True)
+        self.assertEqual(next(results).name, 'ONE')
+        with self.assertRaises(IOError):
+            next(results)
+
+
+class TestParallelFirstPass(unittest.TestCase):
+    """
+    Test pass 1 with the lines parsed and sized by worker processes.
+    """
+    def setUp(self):
+        import sic_assembler.parallel as parallel
+        self.parallel = parallel
+        self.min_chunk_lines = parallel.min_chunk_lines
+        # start the workers even for small programs
+        parallel.min_chunk_lines = 1
+
+    def tearDown(self):
+        self.parallel.min_chunk_lines = self.min_chunk_lines
+
+    def first_pass(self, source, processes):
+        a = Assembler(StringIO(source), processes=processes)
+        a.first_pass()
+        return a
+
+    def test_same_as_sequential(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            source = f.read()
+        expected = self.first_pass(source, 1)
+        a = self.first_pass(source, 3)
+
+        self.assertEqual(a.symtab, expected.symtab)
+        self.assertEqual(a.locctr, expected.locctr)
+        self.assertEqual(a.end_operand, expected.end_operand)
+        self.assertEqual([(x.line_number, x.location, x.mnemonic)
+                          for x in a.temp_contents],
+                         [(x.line_number, x.location, x.mnemonic)
+                          for x in expected.temp_contents])
+        a.second_pass()
+        expected.second_pass()
+        self.assertEqual(a.generate_records(), expected.generate_records())
+
+    def test_prefix_sum(self):
+        self.assertEqual(self.parallel.assign_addresses([3, 0, 4, 1], 0x10),
+                         [0x10, 0x13, 0x13, 0x17])
+
+    def test_errors_in_line_order(self):
+        from sic_assembler.errors import DuplicateSymbolError
+
+        source = """PROG    START   0
+FIRST   CLEAR   A
+        J       FIRST
+FIRST   RESB    10
+        BOGUS   1
+        END     FIRST
+"""
+        with self.assertRaises(DuplicateSymbolError) as context:
+            self.first_pass(source, 2)
+        self.assertEqual(context.exception.details['line_number'], 4)
+
+    def test_lines_after_end_are_ignored(self):
+        source = """PROG    START   1000
+FIRST   CLEAR   A
+        END     FIRST
+        BOGUS   1
+"""
+        a = self.first_pass(source, 2)
+        self.assertEqual(a.locctr, 0x1002)
+        self.assertEqual(a.end_operand, 'FIRST')
+
+
+class TestRelaxation(unittest.TestCase):
+    """
+    Test the automatic selection of format 3 and format 4 instructions.
+    """
+    source = """PROG    START   0
+FIRST   +JSUB   NEAR
+        JSUB    FAR
+NEAR    CLEAR   A
+        RSUB
+BUF     RESB    4096
+FAR     CLEAR   X
+        RSUB
+FIVE    WORD    5
+        END     FIRST
+"""
+
+    def test_out_of_range_without_relaxation(self):
+        from sic_assembler.errors import InstructionError
+
+        a = Assembler(StringIO(self.source))
+        self.assertRaises(InstructionError, a.assemble)
+
+    def test_relaxation(self):
+        a = Assembler(StringIO(self.source), relax=True)
+        output = a.assemble()
+
+        self.assertEqual(output[1:3], ['T0000000C4B20044B10100CB4004F0000',
+                                       'T00100C08B4104F0000000005'])
+        self.assertEqual(a.symtab['FAR'], '0x100c')
+        self.assertEqual(a.relaxation_report['extended'], 1)
+        self.assertEqual(a.relaxation_report['bytes_saved'], 3)
+
+    def test_relaxation_matches_hand_marked(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            expected = Assembler(f).assemble()
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f, relax=True)
+            output = a.assemble()
+
+        self.assertEqual(output, expected)
+        self.assertEqual(a.relaxation_report['extended'], 4)
+
+    def test_external_references_keep_format_4(self):
+        from sic_assembler.sections import assemble_sections, split_sections
+
+        with open('test-programs/csect.asm', 'r') as f:
+            lines = f.read().splitlines()
+        expected = assemble_sections(split_sections(lines), 1)
+        output = assemble_sections(split_sections(lines), 1, relax=True)
+        self.assertEqual(output, expected)
+
+    def test_undefined_symbol_keeps_format_4(self):
+        from sic_assembler.errors import UndefinedSymbolError
+
+        source = """PROG    START   0
+        +JSUB   MISSING
+        RSUB
+        END
+"""
+        a = Assembler(StringIO(source), relax=True)
+        self.assertRaises(UndefinedSymbolError, a.assemble)
+        self.assertEqual(a.temp_contents[0].mnemonic, '+JSUB')
+
+
+class TestAutoBase(unittest.TestCase):
+    """
+    Test loading the B register automatically to avoid format 4.
+    """
+    source = """FAR     START   0
+        J       FIRST
+SUB     LDA     ALPHA
+        ADD     BETA
+        STA     GAMMA
+        RSUB
+FIRST   JSUB    SUB
+        LDA     DELTA
+        STA     ALPHA,X
+        LDT     #BETA
+        J       FIRST
+GAP     RESB    8000
+ALPHA   WORD    1
+BETA    WORD    2
+GAMMA   RESW    1
+DELTA   WORD    4
+        END     FIRST
+"""
+
+    def test_base_placed(self):
+        a = Assembler(StringIO(self.source), auto_base=True)
+        output = a.assemble()
+
+        self.assertEqual(a.base_report['base'], 'ALPHA')
+        self.assertEqual(a.base_report['covered'], 6)
+        self.assertEqual(a.base_report['extended_avoided'], 6)
+        self.assertEqual(a.base_report['bytes_saved'], 2)
+        self.assertEqual(output[0], 'HFAR   000000001F6E')
+        # the entry point is the LDB, which can't use B itself
+        self.assertEqual(a.symtab['FIRST'], '0xf')
+        self.assertEqual(output[-1], 'E00000F')
+
+        modes = dict((location, x.encode().mode)
+                     for location, x in a.generated_objects
+                     if hasattr(x, 'encode') and len(x) == 3)
+        self.assertEqual(modes[3], 'base')
+        self.assertEqual(modes[0x19], 'base')
+        self.assertEqual(modes[0], 'pc')
+
+    def test_program_with_base(self):
+        with open('test-programs/page58.asm', 'r') as f:
+            expected = Assembler(f, relax=True).assemble()
+        with open('test-programs/page58.asm', 'r') as f:
+            a = Assembler(f, auto_base=True)
+            self.assertEqual(a.assemble(), expected)
+        self.assertEqual(a.base_report['skipped'], 'writes the B register')
+
+    def test_external_references(self):
+        from sic_assembler.sections import assemble_sections, split_sections
+
+        with open('test-programs/csect.asm', 'r') as f:
+            sections = split_sections(f.read().splitlines())
+        expected = assemble_sections(sections, processes=1, relax=True)
+        self.assertEqual(assemble_sections(sections, processes=1,
+                                           auto_base=True), expected)
+
+    def test_program_writes_b(self):
+        source = self.source.replace('RSUB\n', 'CLEAR   B\n        RSUB\n')
+        a = Assembler(StringIO(source), auto_base=True)
+        a.assemble()
+        self.assertEqual(a.base_report['skipped'], 'writes the B register')
+        self.assertEqual(a.relaxation_report['extended'], 6)
+
+    def test_not_worth_it(self):
+        source = """FAR     START   0
+FIRST   LDA     ALPHA
+        J       FIRST
+GAP     RESB    8000
+ALPHA   WORD    1
+        END     FIRST
+"""
+        expected = Assembler(StringIO(source), relax=True).assemble()
+        a = Assembler(StringIO(source), auto_base=True)
+        self.assertEqual(a.assemble(), expected)
+        self.assertEqual(a.base_report['skipped'], 'no bytes saved')
+        self.assertEqual(a.symtab['FIRST'], '0x0')
+
+
+class TestPeephole(unittest.TestCase):
+    """
+    Test the peephole optimizer run between the passes.
+    """
+    source = """PROG    START   0
+FIRST   LDA     ALPHA
+        STA     ALPHA
+        CLEAR   X
+        CLEAR   X
+        J       NEXT
+NEXT    STA     BETA
+        LDA     BETA
+LOOP    LDA     BETA
+        J       LOOP
+ALPHA   WORD    1
+BETA    WORD    2
+        END     FIRST
+"""
+
+    def test_optimize(self):
+        a = Assembler(StringIO(self.source), peephole=True)
+        output = a.assemble()
+
+        self.assertEqual(output[1], 'T0000001403200BB4100F20090320063F2FFA000001000002')
+        self.assertEqual(a.peephole_report['bytes_saved'], 11)
+        for hits in a.peephole_report['hits'].values():
+            self.assertEqual(hits, 1)
+
+    def test_labeled_lines_are_kept(self):
+        a = Assembler(StringIO(self.source))
+        a.first_pass()
+        a.optimize()
+
+        labels = [x.label for x in a.temp_contents if x.label is not None]
+        self.assertEqual(labels, ['FIRST', 'NEXT', 'LOOP', 'ALPHA', 'BETA'])
+        self.assertEqual(a.symtab['LOOP'], '0x8')
+
+    def test_configurable_rules(self):
+        from sic_assembler.peephole import redundant_clear
+
+        a = Assembler(StringIO(self.source))
+        a.first_pass()
+        report = a.optimize(rules=[redundant_clear])
+
+        self.assertEqual(report['hits'], {'redundant_clear': 1})
+        self.assertEqual(report['bytes_saved'], 2)
+
 
 if __name__ == '__main__':
     unittest.main()